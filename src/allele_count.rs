@@ -0,0 +1,399 @@
+/*
+Author:
+ Yu S. Huang, polyactis@gmail.com
+ Xinping Fan, 897488736@qq.com
+ */
+use rust_htslib::bam;
+use rust_htslib::bam::Read;
+use rust_htslib::bgzf;
+use rust_htslib::faidx;
+use rust_htslib::tbx;
+use rust_htslib::tbx::Read as TbxRead;
+use std::collections::HashMap;
+use std::io::prelude::*;
+use std::path::{Path, PathBuf};
+use std::str;
+
+// from lib.rs
+use process_contigs_in_order;
+// from select_het_snp.rs
+use select_het_snp::create_het_snp_writer;
+// from import_allele_counts.rs
+use import_allele_counts::is_het_in_normal;
+
+struct Site {
+    // 0-based
+    pos: u32,
+    // index into BASES of the ref/alt allele if the site file has them.
+    //  The ref allele is only used to check the site file against the genome.
+    alleles: Option<(usize, usize)>,
+}
+
+#[derive(Clone, Copy)]
+struct CountFilter {
+    min_coverage: usize,
+    max_coverage: usize,
+    min_allele_fraction: f32,
+    min_base_quality: u8,
+    min_mapping_quality: u8,
+}
+
+#[derive(Default)]
+struct CountSummary {
+    no_of_sites: u32,
+    // sites whose genome base is not A/C/G/T or differs from the ref of the site file.
+    no_of_sites_without_ref: u32,
+    no_of_good_hets_in_normal: u32,
+    no_of_good_hets: u32,
+}
+
+const BASES: [u8; 4] = [b'A', b'C', b'G', b'T'];
+
+fn base_index(base: u8) -> Option<usize> {
+    match base {
+        b'A' | b'a' => Some(0),
+        b'C' | b'c' => Some(1),
+        b'G' | b'g' => Some(2),
+        b'T' | b't' => Some(3),
+        _ => None,
+    }
+}
+
+fn read_sites_of_contig(sites_file: &Path, contig: &str) -> Vec<Site> {
+    // BED (chr, start, end[, ref, alt]) of known SNP sites, bgzipped and tabix-indexed.
+    //  Every base of an interval is a site.
+    let mut reader = tbx::Reader::from_path(sites_file)
+        .expect(&format!("Error in opening site file {:?}", sites_file));
+    let mut site_vec: Vec<Site> = Vec::new();
+    let tid = match reader.tid(contig) {
+        Ok(tid) => tid,
+        Err(_) => return site_vec,
+    };
+    reader.fetch(tid, 0, ::std::u32::MAX as u64)
+        .expect(&format!("Error in fetching {} from {:?}", contig, sites_file));
+    let mut line: Vec<u8> = Vec::new();
+    while reader.read(&mut line).expect("Error in reading site file.") {
+        let line_str = str::from_utf8(&line).unwrap();
+        let fields: Vec<&str> = line_str.split('\t').collect();
+        let start: u32 = fields[1].parse().unwrap();
+        let end: u32 = fields[2].parse().unwrap();
+        let alleles = if fields.len() >= 5 && fields[3].len() == 1 && fields[4].len() == 1 {
+            match (base_index(fields[3].as_bytes()[0]), base_index(fields[4].as_bytes()[0])) {
+                (Some(ref_index), Some(alt_index)) => Some((ref_index, alt_index)),
+                _ => None,
+            }
+        } else {
+            None
+        };
+        for pos in start..end {
+            site_vec.push(Site{pos, alleles});
+        }
+    }
+    site_vec.sort_by_key(|site| site.pos);
+    site_vec.dedup_by_key(|site| site.pos);
+    site_vec
+}
+
+// reference bases are fetched in blocks of at most this many bp.
+const REF_FETCH_BLOCK_SIZE: u32 = 1 << 20;
+
+fn read_ref_bases_of_sites(ref_fasta: &Path, contig: &str, site_vec: &Vec<Site>) -> Vec<u8> {
+    // the genome base at each site. Sites are fetched block by block from the
+    //  faidx-indexed FASTA, so memory does not grow with the contig length.
+    let reader = faidx::Reader::from_path(ref_fasta)
+        .expect(&format!("Error in opening indexed reference {:?}", ref_fasta));
+    let mut ref_base_vec: Vec<u8> = Vec::with_capacity(site_vec.len());
+    let mut block_first_index = 0usize;
+    while block_first_index < site_vec.len() {
+        let block_start = site_vec[block_first_index].pos;
+        let mut block_last_index = block_first_index;
+        while block_last_index + 1 < site_vec.len() &&
+                site_vec[block_last_index + 1].pos - block_start < REF_FETCH_BLOCK_SIZE {
+            block_last_index += 1;
+        }
+        // begin and end are 0-based and inclusive.
+        let block_seq = reader.fetch_seq(contig, block_start as usize,
+                site_vec[block_last_index].pos as usize)
+            .expect(&format!("Error in fetching {} from {:?}", contig, ref_fasta)).to_vec();
+        for site in site_vec[block_first_index..block_last_index + 1].iter() {
+            ref_base_vec.push(*block_seq.get((site.pos - block_start) as usize).unwrap_or(&b'N'));
+        }
+        block_first_index = block_last_index + 1;
+    }
+    ref_base_vec
+}
+
+fn count_bases_of_contig(bam_file: &Path, contig: &str, site_vec: &Vec<Site>,
+        min_base_quality: u8, min_mapping_quality: u8) -> Vec<[u32; 4]> {
+    // A/C/G/T counts at each site. Only reads overlapping the span of the sites are fetched.
+    //  Each fragment is counted once per site: where the two mates of a pair overlap,
+    //  only the base of the mate read first is counted.
+    let mut base_count_vec = vec![[0u32; 4]; site_vec.len()];
+    if site_vec.len() == 0 {
+        return base_count_vec;
+    }
+    let mut bam_reader = bam::IndexedReader::from_path(bam_file)
+        .expect(&format!("Error in opening indexed bam {:?}", bam_file));
+    let tid = match bam_reader.header().tid(contig.as_bytes()) {
+        Some(tid) => tid,
+        None => return base_count_vec,
+    };
+    bam_reader.fetch((tid, site_vec[0].pos as i64, site_vec[site_vec.len() - 1].pos as i64 + 1))
+        .expect(&format!("Error in fetching {} from {:?}", contig, bam_file));
+    let mut record = bam::Record::new();
+    // sites before this one end before all later reads (reads are sorted by start).
+    let mut first_site_index = 0usize;
+    // qname -> sites counted by a read whose mate, read later, overlaps it.
+    let mut qname2counted_site_indices: HashMap<Vec<u8>, Vec<usize>> = HashMap::new();
+    while let Some(result) = bam_reader.read(&mut record) {
+        result.expect("Error in reading bam record.");
+        if record.is_unmapped() || record.is_secondary() || record.is_quality_check_failed()
+            || record.is_duplicate() || record.is_supplementary()
+            || record.mapq() < min_mapping_quality {
+            continue;
+        }
+        let start = record.pos();
+        let cigar = record.cigar();
+        let end = cigar.end_pos();
+        while first_site_index < site_vec.len() && (site_vec[first_site_index].pos as i64) < start {
+            first_site_index += 1;
+        }
+        // sites already counted by the mate of this read, if the mates overlap.
+        let mate_counted_site_indices = if record.is_paired() {
+            qname2counted_site_indices.remove(record.qname())
+        } else {
+            None
+        };
+        let mate_overlaps_later = mate_counted_site_indices.is_none() && record.is_paired()
+            && !record.is_mate_unmapped() && record.mtid() == record.tid()
+            && record.mpos() >= start && record.mpos() < end;
+        let mut counted_site_indices: Vec<usize> = Vec::new();
+        let seq = record.seq();
+        let qual = record.qual();
+        let mut site_index = first_site_index;
+        while site_index < site_vec.len() && (site_vec[site_index].pos as i64) < end {
+            let pos = site_vec[site_index].pos;
+            if mate_counted_site_indices.as_ref()
+                    .map_or(false, |indices| indices.binary_search(&site_index).is_ok()) {
+                site_index += 1;
+                continue;
+            }
+            if let Ok(Some(read_pos)) = cigar.read_pos(pos, false, false) {
+                let read_pos = read_pos as usize;
+                if qual[read_pos] >= min_base_quality {
+                    if let Some(index) = base_index(seq[read_pos]) {
+                        base_count_vec[site_index][index] += 1;
+                        if mate_overlaps_later {
+                            counted_site_indices.push(site_index);
+                        }
+                    }
+                }
+            }
+            site_index += 1;
+        }
+        if mate_overlaps_later && counted_site_indices.len() > 0 {
+            qname2counted_site_indices.insert(record.qname().to_vec(), counted_site_indices);
+        }
+    }
+    base_count_vec
+}
+
+fn get_ref_alt_index(site: &Site, ref_base: u8, base_count: &[u32; 4]) -> Option<(usize, usize)> {
+    // ref is the genome base, alt the alt of the site file. A site file without alleles
+    //  (i.e. a region BED) takes the most frequent non-ref base of the normal (tumor if no
+    //  normal) as alt. None if the genome base is not A/C/G/T or the site file disagrees.
+    let ref_index = match base_index(ref_base) {
+        Some(ref_index) => ref_index,
+        None => return None,
+    };
+    match site.alleles {
+        Some((site_ref_index, alt_index)) => {
+            if site_ref_index == ref_index && alt_index != ref_index {
+                Some((ref_index, alt_index))
+            } else {
+                None
+            }
+        },
+        None => {
+            let alt_index = (0..4usize).filter(|&index| index != ref_index)
+                .max_by_key(|&index| (base_count[index], ::std::cmp::Reverse(index))).unwrap();
+            Some((ref_index, alt_index))
+        },
+    }
+}
+
+fn count_alleles_of_contig(tumor_bam: &Path, normal_bam: Option<&Path>, sites_file: &Path,
+        ref_fasta: &Path, contig: &str, filter: &CountFilter) -> (Vec<u8>, CountSummary) {
+    // one output block per contig.
+    //  Two samples: het_snp.tsv lines of sites het in the normal.
+    //  Tumor only: allele count lines (chr, pos, ref_count, alt_count) of covered sites.
+    let mut block: Vec<u8> = Vec::new();
+    let mut summary = CountSummary::default();
+    let site_vec = read_sites_of_contig(sites_file, contig);
+    summary.no_of_sites = site_vec.len() as u32;
+    let ref_base_vec = read_ref_bases_of_sites(ref_fasta, contig, &site_vec);
+    let tumor_count_vec = count_bases_of_contig(tumor_bam, contig, &site_vec,
+        filter.min_base_quality, filter.min_mapping_quality);
+    let normal_count_vec = match normal_bam {
+        Some(normal_bam) => count_bases_of_contig(normal_bam, contig, &site_vec,
+            filter.min_base_quality, filter.min_mapping_quality),
+        None => Vec::new(),
+    };
+    for (site_index, site) in site_vec.iter().enumerate() {
+        let tumor_count = &tumor_count_vec[site_index];
+        let base_count = if normal_bam.is_none() {
+            tumor_count
+        } else {
+            &normal_count_vec[site_index]
+        };
+        let (ref_index, alt_index) = match get_ref_alt_index(site, ref_base_vec[site_index],
+                base_count) {
+            Some(ref_alt_index) => ref_alt_index,
+            None => {
+                summary.no_of_sites_without_ref += 1;
+                continue;
+            },
+        };
+        if normal_bam.is_none() {
+            if tumor_count[ref_index] + tumor_count[alt_index] > 0 {
+                block.write_fmt(format_args!("{}\t{}\t{}\t{}\t{}\t{}\n", contig, site.pos + 1,
+                    tumor_count[ref_index], tumor_count[alt_index],
+                    BASES[ref_index] as char, BASES[alt_index] as char)).unwrap();
+            }
+            continue;
+        }
+        let normal_count = &normal_count_vec[site_index];
+        let normal_ro = normal_count[ref_index] as i32;
+        let normal_ao = normal_count[alt_index] as i32;
+        let normal_depth = normal_ro + normal_ao;
+        // is a good heterogeneous SNP site in normal sample?
+        if normal_depth > (filter.min_coverage as i32) && normal_depth < (filter.max_coverage as i32)
+            && is_het_in_normal(normal_ro, normal_ao, filter.min_allele_fraction) {
+            summary.no_of_good_hets_in_normal += 1;
+        } else {
+            continue;
+        }
+        let tumor_ro = tumor_count[ref_index] as i32;
+        let tumor_ao = tumor_count[alt_index] as i32;
+        let tumor_depth = tumor_ro + tumor_ao;
+        // Note: don't filter homologous SNP sites in tumor sample
+        if tumor_depth > (filter.min_coverage as i32) && tumor_depth < (filter.max_coverage as i32) {
+            summary.no_of_good_hets += 1;
+        } else {
+            continue;
+        }
+        block.write_fmt(format_args!("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n",
+            contig, site.pos + 1, tumor_depth, tumor_ro, tumor_ao,
+            normal_depth, normal_ro, normal_ao)).unwrap();
+    }
+    (block, summary)
+}
+
+pub struct AlleleCounter<'a> {
+    tumor_bam: &'a Path,
+    normal_bam: Option<&'a Path>,
+    sites_file: &'a Path,
+    // faidx-indexed genome FASTA. The ref allele of a site is its genome base.
+    ref_fasta: &'a Path,
+    output_file_path: &'a Path,
+    filter: CountFilter,
+    no_of_threads: usize,
+}
+
+impl<'a> AlleleCounter<'a> {
+    pub fn new(tumor_bam: &'a str,
+           normal_bam: Option<&'a str>,
+           sites_file: &'a str,
+           ref_fasta: &'a str,
+           output_file_path: &'a str,
+           min_coverage: usize,
+           max_coverage: usize,
+           min_allele_fraction: f32,
+           min_base_quality: u8,
+           min_mapping_quality: u8,
+           no_of_threads: usize,
+    ) -> AlleleCounter<'a> {
+        AlleleCounter {
+            tumor_bam: Path::new(tumor_bam),
+            normal_bam: normal_bam.map(|path| Path::new(path)),
+            sites_file: Path::new(sites_file),
+            ref_fasta: Path::new(ref_fasta),
+            output_file_path: Path::new(output_file_path),
+            filter: CountFilter{min_coverage, max_coverage, min_allele_fraction,
+                min_base_quality, min_mapping_quality},
+            no_of_threads,
+        }
+    }
+
+    fn create_allele_count_writer(&self) -> bgzf::Writer {
+        // tumor only: the layout read by import_allele_counts. BGZF like het_snp.tsv.gz.
+        let mut gz_writer = bgzf::Writer::from_path(self.output_file_path)
+            .expect(&format!("Error in creating output file {:?}", self.output_file_path));
+        gz_writer.write_fmt(format_args!("#min_base_quality={}, min_mapping_quality={}\n",
+            self.filter.min_base_quality, self.filter.min_mapping_quality)).unwrap();
+        gz_writer.write_fmt(format_args!("#tumor bam: {:?}, site file: {:?}, reference: {:?}\n",
+            self.tumor_bam, self.sites_file, self.ref_fasta)).unwrap();
+        gz_writer.write_fmt(format_args!("chr\tpos\tref_count\talt_count\tref\talt\n")).unwrap();
+        gz_writer
+    }
+
+    pub fn run(&self) {
+        let contig_vec: Vec<String> = tbx::Reader::from_path(self.sites_file)
+            .expect(&format!("Error in opening site file {:?}", self.sites_file)).seqnames();
+        let mut gz_writer = match self.normal_bam {
+            Some(normal_bam) => create_het_snp_writer(self.output_file_path, &vec![
+                format!("min_coverage={}, max_coverage={}, min_allele_fraction={}, \
+                    min_base_quality={}, min_mapping_quality={}",
+                    self.filter.min_coverage, self.filter.max_coverage,
+                    self.filter.min_allele_fraction, self.filter.min_base_quality,
+                    self.filter.min_mapping_quality),
+                format!("tumor bam: {:?}, normal bam: {:?}", self.tumor_bam, normal_bam),
+                format!("site file: {:?}, reference: {:?}", self.sites_file, self.ref_fasta),
+            ]),
+            None => self.create_allele_count_writer(),
+        };
+
+        // worker threads need their own copies of the paths. Each opens its own readers.
+        let tumor_bam = self.tumor_bam.to_path_buf();
+        let normal_bam: Option<PathBuf> = self.normal_bam.map(|path| path.to_path_buf());
+        let sites_file = self.sites_file.to_path_buf();
+        let ref_fasta = self.ref_fasta.to_path_buf();
+        let filter = self.filter;
+        let worker_contig_vec = contig_vec.clone();
+        let summary_vec = process_contigs_in_order(contig_vec.len() as u32, self.no_of_threads,
+            move |contig_index| {
+                let contig = &worker_contig_vec[contig_index as usize];
+                let (block, summary) = count_alleles_of_contig(&tumor_bam,
+                    normal_bam.as_ref().map(|path| path.as_path()), &sites_file, &ref_fasta, contig,
+                    &filter);
+                println_stderr!("Contig {} done, {} sites.", contig, summary.no_of_sites);
+                (block, summary)
+            }, &mut gz_writer);
+
+        let mut total_summary = CountSummary::default();
+        for summary in summary_vec.iter() {
+            total_summary.no_of_sites += summary.no_of_sites;
+            total_summary.no_of_sites_without_ref += summary.no_of_sites_without_ref;
+            total_summary.no_of_good_hets_in_normal += summary.no_of_good_hets_in_normal;
+            total_summary.no_of_good_hets += summary.no_of_good_hets;
+        }
+        if self.normal_bam.is_some() {
+            // counts are only known at the end. infer skips "#" lines anywhere.
+            gz_writer.write_fmt(format_args!("#no_of_total_records: {}\n",
+                total_summary.no_of_sites)).unwrap();
+            gz_writer.write_fmt(format_args!("#no_of_good_hets in normal: {}\n",
+                total_summary.no_of_good_hets_in_normal)).unwrap();
+            gz_writer.write_fmt(format_args!("#no_of_good hets in two samples: {}\n",
+                total_summary.no_of_good_hets)).unwrap();
+        }
+        // the BGZF EOF block is written when gz_writer is dropped.
+        gz_writer.flush()
+            .expect(&format!("ERROR flush() failure for gz_writer of {:?}.",
+                self.output_file_path));
+        println_stderr!("{} sites, {} without a matching genome base, {} good hets in normal, \
+            {} intersect SNPs.",
+            total_summary.no_of_sites, total_summary.no_of_sites_without_ref,
+            total_summary.no_of_good_hets_in_normal,
+            total_summary.no_of_good_hets);
+    }
+}
@@ -0,0 +1,232 @@
+/*
+Author:
+ Yu S. Huang, polyactis@gmail.com
+ Xinping Fan, 897488736@qq.com
+ */
+use rust_htslib::bgzf;
+use std::collections::{BTreeMap, HashMap};
+use std::io::prelude::*;
+use std::io::BufReader;
+use std::path::{Path};
+use flate2;
+use flate2::Compression;
+
+// from select_het_snp.rs
+use select_het_snp::create_het_snp_writer;
+
+struct AlleleCount {
+    chr: String,
+    pos: u32,
+    ref_count: i32,
+    alt_count: i32,
+}
+
+pub fn is_het_in_normal(ref_count: i32, alt_count: i32, min_allele_fraction: f32) -> bool {
+    // a simple het test on read counts: both alleles seen, minor allele not too rare.
+    let depth = ref_count + alt_count;
+    if ref_count <= 0 || alt_count <= 0 {
+        return false;
+    }
+    let alt_fraction = alt_count as f32 / depth as f32;
+    alt_fraction >= min_allele_fraction && alt_fraction <= 1.0 - min_allele_fraction
+}
+
+pub fn is_het_in_tumor_only(ref_count: i32, alt_count: i32, min_allele_fraction: f32) -> bool {
+    // tumor-only mode has no matched normal to genotype the patient. A panel het site is
+    //  taken as het if both alleles are seen in the tumor. LOH and amplifications skew tumor
+    //  allele fractions, so the minor allele fraction bound is half that of a normal.
+    is_het_in_normal(ref_count, alt_count, min_allele_fraction / 2.0)
+}
+
+fn read_allele_count_line(line: &str) -> Option<AlleleCount> {
+    // chr, pos (1-based), ref_count, alt_count, ... (GATK CollectAllelicCounts layout).
+    // comment lines ("@", "#") and the column header are skipped.
+    if line.starts_with('@') || line.starts_with('#') {
+        return None;
+    }
+    let fields: Vec<&str> = line.split('\t').collect();
+    if fields.len() < 4 {
+        return None;
+    }
+    let pos = match fields[1].parse::<u32>() {
+        Ok(pos) => pos,
+        Err(_) => return None,
+    };
+    Some(AlleleCount{
+        chr: fields[0].to_string(),
+        pos,
+        ref_count: fields[2].parse().expect(&format!("Bad ref count in line {}", line)),
+        alt_count: fields[3].parse().expect(&format!("Bad alt count in line {}", line)),
+    })
+}
+
+fn open_table(input_file_path: &Path) -> BufReader<bgzf::Reader> {
+    // plain or gzip/bgzip compressed.
+    let reader = bgzf::Reader::from_path(input_file_path)
+        .expect(&format!("Error in opening allele count table {:?}", input_file_path));
+    BufReader::new(reader)
+}
+
+pub fn build_common_het_sites(allele_count_file_path_vec: &Vec<&str>, output_file_path: &str,
+        min_coverage: usize, max_coverage: usize, min_allele_fraction: f32,
+        min_fraction_of_normals: f32) {
+    // common het SNP sites of a panel of normals. A site is kept if it is het in at least
+    //  min_fraction_of_normals of the normals. ref/alt counts are pooled over the het normals.
+    let no_of_normals = allele_count_file_path_vec.len();
+    let mut chr2order: HashMap<String, usize> = HashMap::new();
+    let mut chr_list: Vec<String> = Vec::new();
+    // (chr order, pos) -> (ref_count_sum, alt_count_sum, no_of_het_normals)
+    let mut site2pooled_count: BTreeMap<(usize, u32), (i64, i64, usize)> = BTreeMap::new();
+    for allele_count_file_path in allele_count_file_path_vec.iter() {
+        print_stderr!("Reading allele counts from {} ... ", allele_count_file_path);
+        let mut no_of_hets = 0usize;
+        for line in open_table(Path::new(allele_count_file_path)).lines() {
+            let line = line.expect("Error reading allele count table.");
+            let count = match read_allele_count_line(&line) {
+                Some(count) => count,
+                None => continue,
+            };
+            let depth = count.ref_count + count.alt_count;
+            if depth <= (min_coverage as i32) || depth >= (max_coverage as i32) ||
+                !is_het_in_normal(count.ref_count, count.alt_count, min_allele_fraction) {
+                continue;
+            }
+            if !chr2order.contains_key(&count.chr) {
+                chr2order.insert(count.chr.clone(), chr_list.len());
+                chr_list.push(count.chr.clone());
+            }
+            let pooled_count = site2pooled_count.entry((chr2order[&count.chr], count.pos))
+                .or_insert((0, 0, 0));
+            pooled_count.0 += count.ref_count as i64;
+            pooled_count.1 += count.alt_count as i64;
+            pooled_count.2 += 1;
+            no_of_hets += 1;
+        }
+        println_stderr!("{} hets.", no_of_hets);
+    }
+
+    let output_file_path = Path::new(output_file_path);
+    let output_f = ::std::fs::File::create(output_file_path)
+        .expect(&format!("Error in creating output file {:?}", output_file_path));
+    let mut gz_writer = flate2::GzBuilder::new()
+        .filename(output_file_path.file_stem().unwrap().to_str().unwrap())
+        .comment("Comment")
+        .write(output_f, Compression::default());
+    gz_writer.write_fmt(format_args!("#no_of_normals: {}\n", no_of_normals)).unwrap();
+    gz_writer.write_fmt(format_args!("#min_coverage={}, max_coverage={}, min_allele_fraction={}, \
+        min_fraction_of_normals={}\n",
+        min_coverage, max_coverage, min_allele_fraction, min_fraction_of_normals)).unwrap();
+    gz_writer.write_fmt(format_args!("chr\tpos\tref_count\talt_count\tno_of_het_normals\n")).unwrap();
+    let mut no_of_common_hets = 0usize;
+    for (&(chr_order, pos), &(ref_count, alt_count, no_of_het_normals)) in site2pooled_count.iter() {
+        if (no_of_het_normals as f32) < min_fraction_of_normals * no_of_normals as f32 {
+            continue;
+        }
+        no_of_common_hets += 1;
+        gz_writer.write_fmt(format_args!("{}\t{}\t{}\t{}\t{}\n", chr_list[chr_order], pos,
+            ref_count, alt_count, no_of_het_normals)).unwrap();
+    }
+    gz_writer.finish()
+        .expect(&format!("ERROR finish() failure for gz_writer of {:?}.", output_file_path));
+    println_stderr!("{} common het sites out of {} het sites from {} normals.",
+        no_of_common_hets, site2pooled_count.len(), no_of_normals);
+}
+
+pub struct ImportAlleleCounts<'a> {
+    tumor_file_path: &'a Path,
+    normal_file_path: &'a Path,
+    output_file_path: &'a Path,
+    min_coverage: usize,
+    max_coverage: usize,
+    min_allele_fraction: f32,
+    // the normal table is common het sites of a panel of normals (tumor-only mode).
+    //  Its pooled counts are not depth-filtered. Whether the patient is het at a site is
+    //  judged from the tumor (is_het_in_tumor_only()).
+    normal_is_panel: bool,
+}
+
+impl<'a> ImportAlleleCounts<'a> {
+    pub fn new(tumor_file_path: &'a str,
+           normal_file_path: &'a str,
+           output_file_path: &'a str,
+           min_coverage: usize,
+           max_coverage: usize,
+           min_allele_fraction: f32,
+           normal_is_panel: bool,
+    ) -> ImportAlleleCounts<'a> {
+        ImportAlleleCounts {
+            tumor_file_path: Path::new(tumor_file_path),
+            normal_file_path: Path::new(normal_file_path),
+            output_file_path: Path::new(output_file_path),
+            min_coverage,
+            max_coverage,
+            min_allele_fraction,
+            normal_is_panel,
+        }
+    }
+
+    fn is_good_depth(&self, depth: i32) -> bool {
+        depth > (self.min_coverage as i32) && depth < (self.max_coverage as i32)
+    }
+
+    fn read_het_sites_of_normal(&self) -> (HashMap<(String, u32), (i32, i32)>, u32) {
+        // only good het sites of the normal are kept in memory.
+        print_stderr!("Reading allele counts of normal from {:?} ... ", self.normal_file_path);
+        let mut site2normal_count: HashMap<(String, u32), (i32, i32)> = HashMap::new();
+        let mut no_of_total_records = 0u32;
+        for line in open_table(self.normal_file_path).lines() {
+            let line = line.expect("Error reading normal allele count table.");
+            if let Some(count) = read_allele_count_line(&line) {
+                no_of_total_records += 1;
+                if self.normal_is_panel || (self.is_good_depth(count.ref_count + count.alt_count) &&
+                    is_het_in_normal(count.ref_count, count.alt_count, self.min_allele_fraction)) {
+                    site2normal_count.insert((count.chr, count.pos),
+                        (count.ref_count, count.alt_count));
+                }
+            }
+        }
+        println_stderr!("{} sites, {} good hets.", no_of_total_records, site2normal_count.len());
+        (site2normal_count, no_of_total_records)
+    }
+
+    pub fn run(&self) {
+        let (site2normal_count, no_of_total_records) = self.read_het_sites_of_normal();
+        let mut gz_writer = create_het_snp_writer(self.output_file_path, &vec![
+            format!("min_coverage={}, max_coverage={}, min_allele_fraction={}",
+                self.min_coverage, self.max_coverage, self.min_allele_fraction),
+            format!("tumor allele count file: {:?}", self.tumor_file_path),
+            format!("normal allele count file: {:?}, panel of normals: {}",
+                self.normal_file_path, self.normal_is_panel),
+            format!("no_of_total_records in normal: {}", no_of_total_records),
+            format!("no_of_good_hets in normal: {}", site2normal_count.len()),
+        ]);
+        // output follows the order of the tumor table.
+        let mut no_of_good_hets = 0usize;
+        for line in open_table(self.tumor_file_path).lines() {
+            let line = line.expect("Error reading tumor allele count table.");
+            let count = match read_allele_count_line(&line) {
+                Some(count) => count,
+                None => continue,
+            };
+            let tumor_depth = count.ref_count + count.alt_count;
+            // Note: don't filter homologous SNP sites in tumor sample
+            if !self.is_good_depth(tumor_depth) {
+                continue;
+            }
+            if self.normal_is_panel &&
+                !is_het_in_tumor_only(count.ref_count, count.alt_count, self.min_allele_fraction) {
+                continue;
+            }
+            if let Some(&(normal_ro, normal_ao)) = site2normal_count.get(&(count.chr.clone(), count.pos)) {
+                no_of_good_hets += 1;
+                gz_writer.write_fmt(format_args!("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n",
+                    count.chr, count.pos, tumor_depth, count.ref_count, count.alt_count,
+                    normal_ro + normal_ao, normal_ro, normal_ao)).unwrap();
+            }
+        }
+        gz_writer.flush()
+            .expect(&format!("ERROR flush() failure for gz_writer of {:?}.",
+                self.output_file_path));
+        println_stderr!("{} intersect SNPs.", no_of_good_hets);
+    }
+}
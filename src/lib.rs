@@ -13,9 +13,13 @@ extern crate rust_htslib;
 use bio::io::fasta;
 use byteorder::*;
 use std::cmp;
+use std::collections::BTreeMap;
 use std::io::prelude::*;
+use std::io::BufWriter;
 use std::fs;
 use std::fs::File;
+use std::sync::{mpsc, Arc, Mutex};
+use std::thread;
 
 // The order matters!
 // these macros have to be defined before other modules/functions that are will use them.
@@ -61,13 +65,84 @@ pub fn calc_median_i32(numbers: &mut Vec<i32>) -> i32 {
 
 }
 
+pub fn calc_median_f32(numbers: &mut Vec<f32>) -> f32 {
+
+    numbers.sort_by(|a, b| a.partial_cmp(b).unwrap());
+
+    let mid = numbers.len() / 2;
+    if numbers.len() % 2 == 0 {
+        (numbers[mid-1] + numbers[mid]) / 2.0
+    } else {
+        numbers[mid]
+    }
+
+}
+
 pub mod select_het_snp;
 
 pub mod normalize;
 
 pub mod recall_precision;
 
-pub fn gc_index(input_filename: &str, output_dir: &str) {
+pub mod import_allele_counts;
+
+pub mod allele_count;
+
+pub mod thin_sites;
+
+// window sizes of the GC index, in bp. One file per chromosome per window size.
+pub const GC_INDEX_WINDOW_SIZES: [usize; 4] = [1, 5, 25, 125];
+
+fn is_gc(base: u8) -> bool {
+    base == 67u8 || base == 71u8 || base == 99u8 || base == 103u8
+}
+
+// A, C, G or T, any case. N and other IUPAC codes are not.
+fn is_acgt(base: u8) -> bool {
+    match base {
+        b'A' | b'C' | b'G' | b'T' | b'a' | b'c' | b'g' | b't' => true,
+        _ => false,
+    }
+}
+
+pub fn gc_index_of_one_chr(chromosome_name: &str, seq: &[u8], output_dir: &str) {
+    // chrN.gcW.bi: GC count, chrN.acgtW.bi: non-N count, of the window starting at
+    //  each base, one file per window size. normalize divides the former by the latter.
+    for window_size in GC_INDEX_WINDOW_SIZES.iter() {
+        write_count_index_of_one_chr(&(output_dir.to_string() + "/" + chromosome_name +
+            ".gc" + &window_size.to_string() + ".bi"), seq, *window_size, is_gc);
+        write_count_index_of_one_chr(&(output_dir.to_string() + "/" + chromosome_name +
+            ".acgt" + &window_size.to_string() + ".bi"), seq, *window_size, is_acgt);
+    }
+}
+
+fn write_count_index_of_one_chr(f_name: &str, seq: &[u8], window_size: usize,
+        is_counted: fn(u8) -> bool) {
+    // a count sliding along the chromosome. O(L) time and no memory beyond the
+    //  sequence itself.
+    let chromosome_length = seq.len();
+    let outfile = File::create(f_name).ok().expect("failed to open file");
+    let mut writer = BufWriter::with_capacity(1 << 20, outfile);
+    let mut buffer = Vec::with_capacity(1 << 16);
+    // count of [start, start+window_size)
+    let mut count = seq[..cmp::min(window_size, chromosome_length)].iter()
+        .filter(|base| is_counted(**base)).count() as u8;
+    for start in 0..chromosome_length {
+        buffer.push(count);
+        if buffer.len() == buffer.capacity() {
+            writer.write_all(&buffer).ok().expect("failed");
+            buffer.clear();
+        }
+        count -= is_counted(seq[start]) as u8;
+        if start + window_size < chromosome_length {
+            count += is_counted(seq[start + window_size]) as u8;
+        }
+    }
+    writer.write_all(&buffer).ok().expect("failed");
+    writer.flush().ok().expect("failed");
+}
+
+pub fn gc_index(input_filename: &str, output_dir: &str, no_of_threads: usize) {
     print_stderr!("Opening file {} ...", input_filename);
     let reader = fasta::Reader::from_file(input_filename).unwrap();
     let records = reader.records();
@@ -83,34 +158,99 @@ pub fn gc_index(input_filename: &str, output_dir: &str) {
         println_stderr!("Done.");
     }
 
+    // chromosomes are handed to a pool of workers through a bounded channel,
+    //  so at most 2*no_of_threads chromosomes are held in memory.
+    let no_of_threads = cmp::max(no_of_threads, 1);
+    let (sender, receiver) = mpsc::sync_channel::<fasta::Record>(no_of_threads);
+    let receiver = Arc::new(Mutex::new(receiver));
+    let mut workers = Vec::new();
+    for _ in 0..no_of_threads {
+        let receiver = Arc::clone(&receiver);
+        let output_dir = output_dir.to_string();
+        workers.push(thread::spawn(move || {
+            loop {
+                let job = receiver.lock().unwrap().recv();
+                match job {
+                    Ok(record) => {
+                        gc_index_of_one_chr(record.id(), record.seq(), &output_dir);
+                        println_stderr!("Chromosome {} done.", record.id());
+                    },
+                    Err(_) => break,
+                }
+            }
+        }));
+    }
+
     for (_, r) in records.enumerate() {
         let record = r.ok().expect("failed");
-        let chromosome_name = record.id().to_string();
-        let seq = record.seq();
-        let chromosome_length = seq.len();
-        println_stderr!("Working on chromosome {}, length={}", chromosome_name, chromosome_length);
-        let window_size_list = vec![1, 5, 25, 125];
-        for window_size in window_size_list {
-            print_stderr!("\tWindow size {} ...", window_size);
-            let f_name = output_dir.to_string() + "/" + &chromosome_name + ".gc" +
-                &window_size.to_string() + ".bi";
-            let mut outfile = File::create(&f_name).ok().expect("failed to open file");
-            let mut vec = vec![];
-            for start in 0..chromosome_length {
-                let end = cmp::min(start + window_size, chromosome_length);
-                let mut num: u8 = 0;
-                for l in start..end {
-                    if seq[l] == 67u8 || seq[l] == 71u8 || seq[l] == 99u8 || seq[l] == 103u8 {
-                        num = num + 1;
-                    }
+        // the record (and its sequence) is moved to a worker, not copied.
+        println_stderr!("Working on chromosome {}, length={}", record.id(), record.seq().len());
+        sender.send(record).ok().expect("failed");
+    }
+    drop(sender);
+    for worker in workers {
+        worker.join().ok().expect("GC index worker thread panicked");
+    }
+}
 
+pub fn process_contigs_in_order<S, F, W>(no_of_contigs: u32, no_of_threads: usize,
+        process_contig: F, writer: &mut W) -> Vec<S>
+    where S: Send + 'static, F: Fn(u32) -> (Vec<u8>, S) + Send + Sync + 'static, W: Write {
+    // contigs are handed to a pool of workers. The output block of a contig is written
+    //  as soon as the blocks of all contigs before it are written. At most
+    //  2*no_of_threads contigs past the last written one are in flight (queued, running or
+    //  waiting to be written), so memory stays flat however slow one contig is.
+    let no_of_threads = cmp::max(no_of_threads, 1);
+    let max_no_of_contigs_in_flight = 2 * no_of_threads as u32;
+    let process_contig = Arc::new(process_contig);
+    let (job_sender, job_receiver) =
+        mpsc::sync_channel::<u32>(max_no_of_contigs_in_flight as usize);
+    let job_receiver = Arc::new(Mutex::new(job_receiver));
+    let (block_sender, block_receiver) =
+        mpsc::sync_channel::<(u32, Vec<u8>, S)>(max_no_of_contigs_in_flight as usize);
+    let mut workers = Vec::new();
+    for _ in 0..no_of_threads {
+        let job_receiver = Arc::clone(&job_receiver);
+        let block_sender = block_sender.clone();
+        let process_contig = Arc::clone(&process_contig);
+        workers.push(thread::spawn(move || {
+            loop {
+                let job = job_receiver.lock().unwrap().recv();
+                match job {
+                    Ok(contig_index) => {
+                        let (block, summary) = process_contig(contig_index);
+                        block_sender.send((contig_index, block, summary)).ok().expect("failed");
+                    },
+                    Err(_) => break,
                 }
-                vec.push(num);
-            }
-            for ii in vec {
-                outfile.write_u8(ii).ok().expect("failed");
             }
-            println_stderr!("Done.");
+        }));
+    }
+    drop(block_sender);
+
+    let mut summary_vec = Vec::new();
+    let mut contig_index2pending_block: BTreeMap<u32, Vec<u8>> = BTreeMap::new();
+    let mut next_contig_index = 0u32;
+    let mut next_job_index = 0u32;
+    while next_contig_index < no_of_contigs {
+        // both channels hold at most max_no_of_contigs_in_flight items, so send() never blocks.
+        while next_job_index < no_of_contigs &&
+                next_job_index < next_contig_index + max_no_of_contigs_in_flight {
+            job_sender.send(next_job_index).ok().expect("failed");
+            next_job_index += 1;
+        }
+        let (contig_index, block, summary) = block_receiver.recv()
+            .ok().expect("contig worker thread panicked");
+        summary_vec.push(summary);
+        contig_index2pending_block.insert(contig_index, block);
+        while let Some(block) = contig_index2pending_block.remove(&next_contig_index) {
+            writer.write_all(&block).unwrap();
+            next_contig_index += 1;
         }
     }
-}
\ No newline at end of file
+    drop(job_sender);
+    for worker in workers {
+        worker.join().ok().expect("contig worker thread panicked");
+    }
+    summary_vec
+}
@@ -23,8 +23,9 @@ fn main() {
         .author("www.yfish.org")
         .about("A program that infers tumor purity, ploidy from tumor-normal WGS data")
         .subcommand(SubCommand::with_name("gc_index")
-            .about("GC indexing for a reference genome, counting the number of GCs in \
-                    overlapping windows of 1/5/25/125bp")
+            .about("GC indexing for a reference genome, counting the number of GCs \
+                    (chrN.gcW.bi) and of non-N bases (chrN.acgtW.bi) in overlapping windows \
+                    of 1/5/25/125bp")
             .version("ffcabfdb-SLT8YQBI-debug")
             .author("www.yfish.org")
             .arg(Arg::with_name("input_file")
@@ -43,11 +44,57 @@ fn main() {
                 .required(true)
                 .takes_value(true)
             )
+            .arg(Arg::with_name("threads")
+                .short("t")
+                .long("threads")
+                .value_name("THREADS")
+                .help("Number of chromosomes indexed in parallel")
+                .default_value("4")
+                .takes_value(true)
+            )
             .arg(Arg::with_name("debug")
                 .short("d")
                 .help("print debug information verbosely")
             )
         )
+        .subcommand(SubCommand::with_name("thin_sites")
+            .about("Make thinned tiers of the known SNP sites for the reference folder: \
+                one site of the highest population heterozygosity per N bp.")
+            .version("ffcabfdb-SLT8YQBI-debug")
+            .author("www.yfish.org")
+            .arg(Arg::with_name("input_file")
+                .short("i")
+                .long("input_file")
+                .value_name("VCF FILE")
+                .help("A sorted VCF of population SNPs with INFO/AF, i.e. 1000 Genomes sites.")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("output_dir")
+                .short("o")
+                .long("output_dir")
+                .value_name("OUTPUT DIR")
+                .help("The reference folder to contain snp_sites.thinN.bed.gz \
+                    and snp_sites.tiers.tsv")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("spacing")
+                .long("spacing")
+                .value_name("SPACING")
+                .help("One tier per spacing (bp), comma-separated.")
+                .default_value("1000,5000,20000")
+                .use_delimiter(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("min_allele_frequency")
+                .long("min_allele_frequency")
+                .value_name("MIN ALLELE FREQUENCY")
+                .help("SNPs with a minor allele frequency below this are skipped.")
+                .default_value("0.05")
+                .takes_value(true)
+            )
+        )
         .subcommand(SubCommand::with_name("normalize")
             .about("Smooth (window on either side also gets coverage) and normalize \
                 (divided by total fragment count) coverage of tumor and normal. \
@@ -110,7 +157,15 @@ fn main() {
                 .long("normal_file_path")
                 .value_name("NORMAL BAM FILE")
                 .help("The normal bam file")
-                .required(true)
+                .required_unless("pon_file")
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("pon_file")
+                .long("pon_file")
+                .value_name("PANEL OF NORMALS FILE")
+                .help("Tumor-only mode. The pon.coverage.w*.tsv.gz made by build_pon \
+                    replaces the normal.")
+                .conflicts_with("normal_file_path")
                 .takes_value(true)
             )
             .arg(Arg::with_name("genome_dict_path")
@@ -128,6 +183,23 @@ fn main() {
                 .required(true)
                 .takes_value(true)
             )
+            .arg(Arg::with_name("gc_index_dir")
+                .long("gc_index_dir")
+                .value_name("GC INDEX FOLDER")
+                .help("The folder of chrN.gcW.bi files made by gc_index. \
+                    If given, coverage is corrected for GC bias.")
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("input_format")
+                .long("input_format")
+                .value_name("INPUT FORMAT")
+                .help("bam: tumor/normal files are BAMs. \
+                    bedgraph: they are precomputed coverage tracks \
+                    (bedGraph/mosdepth regions, chr start end depth, optionally gzipped).")
+                .possible_values(&["bam", "bedgraph"])
+                .default_value("bam")
+                .takes_value(true)
+            )
             .arg(Arg::with_name("debug")
                 .short("d")
                 .long("debug")
@@ -172,6 +244,15 @@ fn main() {
                 .required(true)
                 .takes_value(true)
             )
+            .arg(Arg::with_name("threads")
+                .short("t")
+                .long("threads")
+                .value_name("THREADS")
+                .help("Number of contigs processed in parallel. \
+                    Needs a tabix/csi index of the SNP file.")
+                .default_value("4")
+                .takes_value(true)
+            )
             .arg(Arg::with_name("debug")
                 .short("d")
                 .long("debug")
@@ -179,6 +260,276 @@ fn main() {
                 .takes_value(true)
             )
         )
+        .subcommand(SubCommand::with_name("build_pon")
+            .about("Build a panel of normals from many normals for tumor-only runs: \
+                per-window coverage baseline and, if allele counts are given, \
+                common het SNP sites.")
+            .version("ffcabfdb-SLT8YQBI-debug")
+            .author("www.yfish.org")
+            .arg(Arg::with_name("normal_file_path")
+                .short("i")
+                .long("normal_file_path")
+                .value_name("NORMAL BAM FILES")
+                .help("The normal bam files (or coverage tracks if --input_format bedgraph).")
+                .required(true)
+                .multiple(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("allele_counts")
+                .long("allele_counts")
+                .value_name("NORMAL ALLELE COUNT FILES")
+                .help("Allele count tables (chr, pos, ref_count, alt_count) of the normals.")
+                .multiple(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("max_coverage")
+                .short("x")
+                .long("max_coverage")
+                .value_name("MAXIMUM COVERAGE")
+                .help("Coverage above this value is ignored.")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("min_coverage")
+                .short("m")
+                .long("min_coverage")
+                .value_name("MINIMUM COVERAGE")
+                .help("Allele counts with coverage below this value are ignored.")
+                .default_value("10")
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("min_allele_fraction")
+                .long("min_allele_fraction")
+                .value_name("MIN ALLELE FRACTION")
+                .help("A site is heterozygous in a normal if its alt allele fraction \
+                    is within [this, 1-this].")
+                .default_value("0.2")
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("min_fraction_of_normals")
+                .long("min_fraction_of_normals")
+                .value_name("MIN FRACTION OF NORMALS")
+                .help("A common het site is het in at least this fraction of the normals.")
+                .default_value("0.1")
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("no_of_autosomes")
+                .long("no_of_autosomes")
+                .value_name("The Number of Autosomes")
+                .help("The number of autosomes. 22 for human.")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("smooth_window_half_size")
+                .short("s")
+                .long("smooth_window_half_size")
+                .value_name("SMOOTH WINDOW HALF SIZE")
+                .help("Number of windows on either side that will be used to \
+                    smooth coverage.")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("window_size")
+                .short("w")
+                .long("window_size")
+                .value_name("WINDOW SIZE")
+                .help("Must be the same as the window size of normalize.")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("genome_dict_path")
+                .long("genome_dict_path")
+                .value_name("GENOME DICT FILE")
+                .help("The genome dict file")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("gc_index_dir")
+                .long("gc_index_dir")
+                .value_name("GC INDEX FOLDER")
+                .help("The folder of chrN.gcW.bi files made by gc_index. \
+                    If given, coverage is corrected for GC bias.")
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("input_format")
+                .long("input_format")
+                .value_name("INPUT FORMAT")
+                .help("bam or bedgraph, same as normalize.")
+                .possible_values(&["bam", "bedgraph"])
+                .default_value("bam")
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("output_folder")
+                .short("o")
+                .long("output_folder")
+                .value_name("OUTPUT FOLDER")
+                .help("The output folder to contain the panel of normals")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("debug")
+                .short("d")
+                .long("debug")
+                .help("Debug mode.")
+                .default_value("0")
+                .takes_value(true)
+            )
+        )
+        .subcommand(SubCommand::with_name("allele_count")
+            .about("Count alleles of tumor and normal BAMs at known SNP sites and output \
+                heterozygous SNPs of the normal. Without a normal, output the allele counts \
+                of the tumor for import_allele_counts.")
+            .version("ffcabfdb-SLT8YQBI-debug")
+            .author("www.yfish.org")
+            .arg(Arg::with_name("tumor_file_path")
+                .short("t")
+                .long("tumor_file_path")
+                .value_name("TUMOR BAM FILE")
+                .help("The indexed tumor bam file.")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("normal_file_path")
+                .short("n")
+                .long("normal_file_path")
+                .value_name("NORMAL BAM FILE")
+                .help("The indexed normal bam file.")
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("sites_file")
+                .short("s")
+                .long("sites_file")
+                .value_name("SITES FILE")
+                .help("bgzipped and tabix-indexed BED of known SNP sites \
+                    (chr, start, end, and optionally ref, alt). Sites whose ref differs from \
+                    the genome are skipped. Without ref/alt, the alt allele is the most \
+                    frequent non-ref base of the normal (tumor if no normal).")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("ref_fasta")
+                .short("r")
+                .long("ref_fasta")
+                .value_name("REFERENCE FASTA")
+                .help("The faidx-indexed genome FASTA (i.e. genome.fa). \
+                    The ref allele of a site is its genome base.")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("max_coverage")
+                .short("x")
+                .long("max_coverage")
+                .value_name("MAXIMUM COVERAGE")
+                .help("Coverage above this value is ignored.")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("min_coverage")
+                .short("m")
+                .long("min_coverage")
+                .value_name("MINIMUM COVERAGE")
+                .help("Coverage below this value is ignored.")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("min_allele_fraction")
+                .long("min_allele_fraction")
+                .value_name("MIN ALLELE FRACTION")
+                .help("A site is heterozygous in normal if its alt allele fraction \
+                    is within [this, 1-this].")
+                .default_value("0.2")
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("min_base_quality")
+                .long("min_base_quality")
+                .value_name("MIN BASE QUALITY")
+                .help("Bases with a lower base quality are not counted.")
+                .default_value("20")
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("min_mapping_quality")
+                .long("min_mapping_quality")
+                .value_name("MIN MAPPING QUALITY")
+                .help("Reads with a lower mapping quality are not counted.")
+                .default_value("20")
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("threads")
+                .long("threads")
+                .value_name("THREADS")
+                .help("Number of contigs processed in parallel")
+                .default_value("4")
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("output_file_path")
+                .short("o")
+                .long("output_file_path")
+                .value_name("OUTPUT FILE")
+                .help("The output file to contain heterozygous SNPs (or tumor allele counts)")
+                .required(true)
+                .takes_value(true)
+            )
+        )
+        .subcommand(SubCommand::with_name("import_allele_counts")
+            .about("Make the heterozygous SNP file from external allele count tables \
+                (chr, pos, ref_count, alt_count) of tumor and normal at common SNPs")
+            .version("ffcabfdb-SLT8YQBI-debug")
+            .author("www.yfish.org")
+            .arg(Arg::with_name("tumor_file_path")
+                .short("t")
+                .long("tumor_file_path")
+                .value_name("TUMOR ALLELE COUNT FILE")
+                .help("The allele count table of the tumor sample")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("normal_file_path")
+                .short("n")
+                .long("normal_file_path")
+                .value_name("NORMAL ALLELE COUNT FILE")
+                .help("The allele count table of the normal sample")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("max_coverage")
+                .short("x")
+                .long("max_coverage")
+                .value_name("MAXIMUM COVERAGE")
+                .help("Coverage above this value is ignored.")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("min_coverage")
+                .short("m")
+                .long("min_coverage")
+                .value_name("MINIMUM COVERAGE")
+                .help("Coverage below this value is ignored.")
+                .required(true)
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("min_allele_fraction")
+                .long("min_allele_fraction")
+                .value_name("MIN ALLELE FRACTION")
+                .help("A site is heterozygous in normal if its alt allele fraction \
+                    is within [this, 1-this].")
+                .default_value("0.2")
+                .takes_value(true)
+            )
+            .arg(Arg::with_name("normal_is_panel")
+                .long("normal_is_panel")
+                .help("The normal table is the pon.het_sites.tsv.gz of build_pon (tumor-only mode). \
+                    A panel site is kept if it is het in the tumor, with half the \
+                    --min_allele_fraction bound.")
+            )
+            .arg(Arg::with_name("output_file_path")
+                .short("o")
+                .long("output_file_path")
+                .value_name("OUTPUT FILE")
+                .help("The output file to contain selected heterozygous SNPs")
+                .required(true)
+                .takes_value(true)
+            )
+        )
         .subcommand(SubCommand::with_name("infer")
             .about("infers tumor purity, ploidy from tumor-normal WGS data")
             .version("ffcabfdb-SLT8YQBI-debug")
@@ -226,11 +577,24 @@ fn main() {
     if let Some(matches) = matches.subcommand_matches("gc_index") {
         let input_filename = matches.value_of("input_file").unwrap();
         let output_dir = matches.value_of("output_dir").unwrap();
-        let arguments = format!("-i {} -o {}", input_filename, output_dir);
-        maestre::gc_index(input_filename, output_dir);
+        let no_of_threads: usize = matches.value_of("threads").unwrap().parse().unwrap();
+        let arguments = format!("-i {} -o {} -t {}", input_filename, output_dir, no_of_threads);
+        maestre::gc_index(input_filename, output_dir, no_of_threads);
+    } else if let Some(matches) = matches.subcommand_matches("thin_sites") {
+        let input_filename = matches.value_of("input_file").unwrap();
+        let output_dir = matches.value_of("output_dir").unwrap();
+        let spacing_vec: Vec<i64> = matches.values_of("spacing").unwrap()
+            .map(|spacing| spacing.parse().unwrap()).collect();
+        let min_allele_frequency: f32 = matches.value_of("min_allele_frequency").unwrap()
+            .parse().unwrap();
+        let arguments = format!("-i {} -o {} --spacing {:?} --min_allele_frequency {}",
+            input_filename, output_dir, spacing_vec, min_allele_frequency);
+        let ins = maestre::thin_sites::ThinSites::new(input_filename, output_dir,
+            spacing_vec, min_allele_frequency);
+        ins.run();
     } else if let Some(matches) = matches.subcommand_matches("normalize") {
         let tumor_file_path = matches.value_of("tumor_file_path").unwrap();
-        let normal_file_path = matches.value_of("normal_file_path").unwrap();
+        let normal_file_path = matches.value_of("normal_file_path").unwrap_or("");
         let genome_dict_path = matches.value_of("genome_dict_path").unwrap();
         let output_folder = matches.value_of("output_folder").unwrap();
         let max_coverage: usize = matches.value_of("max_coverage").unwrap().parse().unwrap();
@@ -241,28 +605,113 @@ fn main() {
         let window_size: usize = matches.value_of("window_size").unwrap().parse().unwrap();
         let read_len: usize = matches.value_of("read_len").unwrap().parse().unwrap();
         let debug: i32 = matches.value_of("debug").unwrap().parse().unwrap();
+        let gc_index_dir = matches.value_of("gc_index_dir");
+        let input_format = matches.value_of("input_format").unwrap();
+        let pon_file_path = matches.value_of("pon_file");
 
         let arguments = format!("-t {} -n {} -w {} -l {} --smooth_window_half_size {} \
-            --max_coverage {} --no_of_autosomes {} -d {} -o {}",
+            --max_coverage {} --no_of_autosomes {} --gc_index_dir {:?} \
+            --input_format {} --pon_file {:?} -d {} -o {}",
             tumor_file_path, normal_file_path, window_size, read_len,
-            smooth_window_half_size, max_coverage, no_of_autosomes, debug, output_folder);
+            smooth_window_half_size, max_coverage, no_of_autosomes, gc_index_dir,
+            input_format, pon_file_path, debug, output_folder);
         let ins = maestre::normalize::Normalize::new(
             tumor_file_path, normal_file_path, output_folder,
             genome_dict_path, window_size, max_coverage, no_of_autosomes,
-            smooth_window_half_size, debug);
+            smooth_window_half_size, gc_index_dir, input_format, pon_file_path, debug);
         ins.run();
+    } else if let Some(matches) = matches.subcommand_matches("build_pon") {
+        let normal_file_path_vec: Vec<&str> = matches.values_of("normal_file_path").unwrap()
+            .collect();
+        let allele_count_file_path_vec: Vec<&str> = match matches.values_of("allele_counts") {
+            Some(values) => values.collect(),
+            None => Vec::new(),
+        };
+        let genome_dict_path = matches.value_of("genome_dict_path").unwrap();
+        let output_folder = matches.value_of("output_folder").unwrap();
+        let max_coverage: usize = matches.value_of("max_coverage").unwrap().parse().unwrap();
+        let min_coverage: usize = matches.value_of("min_coverage").unwrap().parse().unwrap();
+        let min_allele_fraction: f32 = matches.value_of("min_allele_fraction").unwrap()
+            .parse().unwrap();
+        let min_fraction_of_normals: f32 = matches.value_of("min_fraction_of_normals").unwrap()
+            .parse().unwrap();
+        let no_of_autosomes: usize = matches.value_of("no_of_autosomes").unwrap().
+            parse().unwrap();
+        let smooth_window_half_size: usize = matches.value_of("smooth_window_half_size").
+            unwrap().parse().unwrap();
+        let window_size: usize = matches.value_of("window_size").unwrap().parse().unwrap();
+        let debug: i32 = matches.value_of("debug").unwrap().parse().unwrap();
+        let gc_index_dir = matches.value_of("gc_index_dir");
+        let input_format = matches.value_of("input_format").unwrap();
+
+        let ins = maestre::normalize::Normalize::new(
+            "", "", output_folder,
+            genome_dict_path, window_size, max_coverage, no_of_autosomes,
+            smooth_window_half_size, gc_index_dir, input_format, None, debug);
+        ins.build_coverage_baseline(&normal_file_path_vec);
+        if allele_count_file_path_vec.len() > 0 {
+            let output_file_path = format!("{}/pon.het_sites.tsv.gz", output_folder);
+            maestre::import_allele_counts::build_common_het_sites(&allele_count_file_path_vec,
+                &output_file_path, min_coverage, max_coverage, min_allele_fraction,
+                min_fraction_of_normals);
+        }
     } else if let Some(matches) = matches.subcommand_matches("select_het_snp") {
         let snp_file = matches.value_of("snp_file").unwrap();
         let output_file_path = matches.value_of("output_file_path").unwrap();
         let min_coverage: usize = matches.value_of("min_coverage").unwrap().parse().unwrap();
         let max_coverage: usize = matches.value_of("max_coverage").unwrap().parse().unwrap();
         let debug: i32 = matches.value_of("debug").unwrap().parse().unwrap();
+        let no_of_threads: usize = matches.value_of("threads").unwrap().parse().unwrap();
 
-        let arguments = format!("-s {} --min_coverage {} --max_coverage {} -d {} -o {}",
-            snp_file, min_coverage, max_coverage, debug, output_file_path);
+        let arguments = format!("-s {} --min_coverage {} --max_coverage {} -t {} -d {} -o {}",
+            snp_file, min_coverage, max_coverage, no_of_threads, debug, output_file_path);
 
         let ins = maestre::select_het_snp::SelectHetSNP::new(snp_file, output_file_path,
-            min_coverage, max_coverage);
+            min_coverage, max_coverage, no_of_threads);
+        ins.run();
+    } else if let Some(matches) = matches.subcommand_matches("allele_count") {
+        let tumor_file_path = matches.value_of("tumor_file_path").unwrap();
+        let normal_file_path = matches.value_of("normal_file_path");
+        let sites_file = matches.value_of("sites_file").unwrap();
+        let ref_fasta = matches.value_of("ref_fasta").unwrap();
+        let output_file_path = matches.value_of("output_file_path").unwrap();
+        let min_coverage: usize = matches.value_of("min_coverage").unwrap().parse().unwrap();
+        let max_coverage: usize = matches.value_of("max_coverage").unwrap().parse().unwrap();
+        let min_allele_fraction: f32 = matches.value_of("min_allele_fraction").unwrap()
+            .parse().unwrap();
+        let min_base_quality: u8 = matches.value_of("min_base_quality").unwrap().parse().unwrap();
+        let min_mapping_quality: u8 = matches.value_of("min_mapping_quality").unwrap()
+            .parse().unwrap();
+        let no_of_threads: usize = matches.value_of("threads").unwrap().parse().unwrap();
+
+        let arguments = format!("-t {} -n {:?} -s {} -r {} --min_coverage {} --max_coverage {} \
+            --min_allele_fraction {} --min_base_quality {} --min_mapping_quality {} \
+            --threads {} -o {}",
+            tumor_file_path, normal_file_path, sites_file, ref_fasta, min_coverage, max_coverage,
+            min_allele_fraction, min_base_quality, min_mapping_quality, no_of_threads,
+            output_file_path);
+        let ins = maestre::allele_count::AlleleCounter::new(
+            tumor_file_path, normal_file_path, sites_file, ref_fasta, output_file_path,
+            min_coverage, max_coverage, min_allele_fraction,
+            min_base_quality, min_mapping_quality, no_of_threads);
+        ins.run();
+    } else if let Some(matches) = matches.subcommand_matches("import_allele_counts") {
+        let tumor_file_path = matches.value_of("tumor_file_path").unwrap();
+        let normal_file_path = matches.value_of("normal_file_path").unwrap();
+        let output_file_path = matches.value_of("output_file_path").unwrap();
+        let min_coverage: usize = matches.value_of("min_coverage").unwrap().parse().unwrap();
+        let max_coverage: usize = matches.value_of("max_coverage").unwrap().parse().unwrap();
+        let min_allele_fraction: f32 = matches.value_of("min_allele_fraction").unwrap()
+            .parse().unwrap();
+        let normal_is_panel = matches.is_present("normal_is_panel");
+
+        let arguments = format!("-t {} -n {} --min_coverage {} --max_coverage {} \
+            --min_allele_fraction {} --normal_is_panel {} -o {}",
+            tumor_file_path, normal_file_path, min_coverage, max_coverage,
+            min_allele_fraction, normal_is_panel, output_file_path);
+        let ins = maestre::import_allele_counts::ImportAlleleCounts::new(
+            tumor_file_path, normal_file_path, output_file_path,
+            min_coverage, max_coverage, min_allele_fraction, normal_is_panel);
         ins.run();
     }else if let Some(matches) = matches.subcommand_matches("recall_precision") {
         let truth_result_file_path = matches.value_of("truth_result_file_path").unwrap();
@@ -7,19 +7,35 @@ use flate2;
 use flate2::Compression;
 use rust_htslib::bam;
 use rust_htslib::bam::Read;
+use rust_htslib::bgzf;
 use std::cmp;
 use std::str;
 use std::collections::HashMap;
 use std::io::prelude::*;
+use std::io::{BufReader, BufWriter};
 use std::fs::File;
 use std::fs;
-use std::path::{Path};
+use std::path::{Path, PathBuf};
+use std::time::{Duration, UNIX_EPOCH};
+use byteorder::{LittleEndian, ReadBytesExt, WriteBytesExt};
 extern crate regex;
 use self::regex::Regex;
 
 // from lib.rs
 use calc_median_usize;
 use calc_median_i32;
+use calc_median_f32;
+use GC_INDEX_WINDOW_SIZES;
+
+// GC ratio of a window is binned by percent, bin 0..=100.
+const NO_OF_GC_BINS: usize = 101;
+// per-base depth from coverage tracks is stored as integer depth*COVERAGE_TRACK_SCALE.
+const COVERAGE_TRACK_SCALE: usize = 1000;
+// GC bins with fewer windows than this borrow the factor of the nearest populated bin.
+const MIN_NO_OF_WINDOWS_PER_GC_BIN: usize = 100;
+// panel-of-normals windows whose MAD exceeds this fraction of their median are too
+//  variable among normals to serve as a baseline.
+const MAX_PON_RELATIVE_MAD: f32 = 0.25;
 
 struct OneChrData{
     chr: String,
@@ -49,6 +65,75 @@ impl<'a> OneChrData{
     }
 }
 
+// read-level QC counters collected during the coverage scan of one BAM,
+//  so that no separate samtools-stats pass is needed. Definitions are in the
+//  header of qc_metrics.tsv (see output_qc_metrics()).
+struct QcMetrics{
+    no_of_reads: usize,
+    no_of_unmapped: usize,
+    no_of_off_target_chr: usize,
+    no_of_secondary_or_supplementary: usize,
+    no_of_qc_fail: usize,
+    no_of_mapped: usize,
+    no_of_paired: usize,
+    no_of_proper_pairs: usize,
+    no_of_duplicates: usize,
+    // filter reasons, counted by the first filter that rejects a read.
+    filtered_low_mapq: usize,
+    filtered_bad_insert_size: usize,
+    filtered_not_proper_pair: usize,
+    filtered_mate_unmapped: usize,
+    filtered_not_first_in_template: usize,
+    filtered_secondary: usize,
+    filtered_duplicate: usize,
+    filtered_supplementary: usize,
+    no_of_valid_fragments: usize,
+    // chromosomes restored from a checkpoint are not re-read, so the read
+    //  counters above do not cover them.
+    no_of_chrs_from_checkpoint: usize,
+    mapq_histogram: Vec<usize>,
+    // the last bin collects all insert sizes > max_fragment_len.
+    insert_size_histogram: Vec<usize>,
+    // (chr, no_of_fragments, no_of_windows, no_of_zero_coverage_windows)
+    chr_summary: Vec<(String, usize, usize, usize)>,
+}
+
+impl QcMetrics{
+    fn new(max_fragment_len: usize) -> QcMetrics {
+        QcMetrics{
+            no_of_reads: 0,
+            no_of_unmapped: 0,
+            no_of_off_target_chr: 0,
+            no_of_secondary_or_supplementary: 0,
+            no_of_qc_fail: 0,
+            no_of_mapped: 0,
+            no_of_paired: 0,
+            no_of_proper_pairs: 0,
+            no_of_duplicates: 0,
+            filtered_low_mapq: 0,
+            filtered_bad_insert_size: 0,
+            filtered_not_proper_pair: 0,
+            filtered_mate_unmapped: 0,
+            filtered_not_first_in_template: 0,
+            filtered_secondary: 0,
+            filtered_duplicate: 0,
+            filtered_supplementary: 0,
+            no_of_valid_fragments: 0,
+            no_of_chrs_from_checkpoint: 0,
+            mapq_histogram: vec![0usize; 256],
+            insert_size_histogram: vec![0usize; max_fragment_len + 2],
+            chr_summary: Vec::new(),
+        }
+    }
+
+    fn add_chr(&mut self, chr: &String, no_of_fragments: usize,
+            coverage_per_window: &Vec<usize>) {
+        let no_of_zero_windows = coverage_per_window.iter().filter(|&&c| c == 0).count();
+        self.chr_summary.push((chr.clone(), no_of_fragments,
+            coverage_per_window.len(), no_of_zero_windows));
+    }
+}
+
 pub struct Normalize<'a> {
     tumor_file_path: &'a Path,
     normal_file_path: &'a Path,
@@ -60,6 +145,14 @@ pub struct Normalize<'a> {
     float_multiplier: usize,
     max_coverage: usize,
     smooth_window_half_size: usize,
+    // folder of chrN.gcW.bi files from gc_index. No GC correction if None.
+    gc_index_dir: Option<&'a Path>,
+    // "bam", or "bedgraph" for precomputed coverage tracks (chr, start, end, depth).
+    input_format: &'a str,
+    // coverage_per_window / coverage_scale is the coverage in reads (bam) or depth (bedgraph).
+    coverage_scale: usize,
+    // panel-of-normals coverage baseline. If given, there is no normal sample (tumor-only).
+    pon_file_path: Option<&'a Path>,
     debug: i32,
 }
 
@@ -74,6 +167,9 @@ impl<'a> Normalize<'a> {
            max_coverage: usize,
            no_of_autosomes: usize,
            smooth_window_half_size: usize,
+           gc_index_dir: Option<&'a str>,
+           input_format: &'a str,
+           pon_file_path: Option<&'a str>,
            debug: i32,
     ) -> Normalize<'a> {
         let selected_chromosome_name: Vec<String> = (1..=no_of_autosomes).map(
@@ -105,6 +201,10 @@ impl<'a> Normalize<'a> {
             float_multiplier: 1000,
             max_coverage,
             smooth_window_half_size,
+            gc_index_dir: gc_index_dir.map(|dir| Path::new(dir)),
+            input_format,
+            coverage_scale: if input_format == "bedgraph" { COVERAGE_TRACK_SCALE } else { 1 },
+            pon_file_path: pon_file_path.map(|path| Path::new(path)),
             debug,
         }
     }
@@ -131,14 +231,84 @@ impl<'a> Normalize<'a> {
             coverage_per_base, no_of_windows);
     }
 
-    fn read_in_coverage_of_genome(&'a self, input_file_path: &'a Path) -> HashMap<usize, OneChrData> {
-        // let if_single_read = self.check_if_single_read(input_file_path);
-        println_stderr!("Reading in genome coverage from {:?} ... ", input_file_path);
-        let mut chr_idx2one_chr_data: HashMap<usize, OneChrData> = HashMap::new();
-        let mut bam_reader = bam::Reader::from_path(&input_file_path).unwrap();
-        let header = bam_reader.header().clone();
+    fn finish_one_chr(&self, chr_idx: usize, chr: &String, chr_len: usize,
+            no_of_fragments: usize, total_insert_len: usize,
+            coverage_per_window: &Vec<usize>, qc_metrics: &mut QcMetrics,
+            chr_idx2one_chr_data: &mut HashMap<usize, OneChrData>) {
+        let coverage_per_base = total_insert_len as f32 / chr_len as f32;
+        qc_metrics.add_chr(chr, no_of_fragments, coverage_per_window);
+        let one_chr_data = self.smooth_coverage_of_one_chr(chr.clone(), chr_len,
+            no_of_fragments, coverage_per_base, coverage_per_window);
+        chr_idx2one_chr_data.insert(chr_idx, one_chr_data);
+    }
+
+    fn write_checkpoint_of_one_chr(&self, checkpoint_dir: &Path, bam_file_signature: &[u64; 3],
+            chr: &String, chr_len: usize, no_of_fragments: usize,
+            total_insert_len: usize, coverage_per_window: &Vec<usize>) {
+        // write to a tmp file first and rename it, so that a killed process
+        //  never leaves a truncated checkpoint behind.
+        let checkpoint_path = checkpoint_dir.join(format!("{}.bin", chr));
+        let tmp_path = checkpoint_dir.join(format!("{}.bin.tmp", chr));
+        let output_f = File::create(&tmp_path)
+            .expect(&format!("Error in creating checkpoint file {:?}", &tmp_path));
+        let mut writer = BufWriter::new(output_f);
+        let header = [self.window_size, chr_len, no_of_fragments, total_insert_len,
+            coverage_per_window.len()];
+        for value in bam_file_signature.iter() {
+            writer.write_u64::<LittleEndian>(*value).unwrap();
+        }
+        for value in header.iter().chain(coverage_per_window.iter()) {
+            writer.write_u64::<LittleEndian>(*value as u64).unwrap();
+        }
+        // the data must be on disk before the rename makes it the checkpoint.
+        let output_f = writer.into_inner()
+            .expect(&format!("ERROR flush() failure for {:?}.", &tmp_path));
+        output_f.sync_all()
+            .expect(&format!("ERROR sync_all() failure for {:?}.", &tmp_path));
+        fs::rename(&tmp_path, &checkpoint_path)
+            .expect(&format!("Error in renaming {:?} to {:?}", &tmp_path, &checkpoint_path));
+    }
+
+    fn read_checkpoint_of_one_chr(&self, checkpoint_dir: &Path, bam_file_signature: &[u64; 3],
+            chr: &String, chr_len: usize) -> Option<(usize, usize, Vec<usize>)> {
+        // returns (no_of_fragments, total_insert_len, coverage_per_window) if a
+        //  checkpoint of the same BAM and window size exists.
+        let checkpoint_path = checkpoint_dir.join(format!("{}.bin", chr));
+        let input_f = match File::open(&checkpoint_path) {
+            Ok(f) => f,
+            Err(_) => return None,
+        };
+        let mut reader = BufReader::new(input_f);
+        let mut header = vec![0usize; 5];
+        for value in bam_file_signature.iter() {
+            if reader.read_u64::<LittleEndian>().ok() != Some(*value) {
+                return None;
+            }
+        }
+        for value in header.iter_mut() {
+            match reader.read_u64::<LittleEndian>() {
+                Ok(v) => *value = v as usize,
+                Err(_) => return None,
+            }
+        }
+        if header[0] != self.window_size || header[1] != chr_len {
+            return None;
+        }
+        let mut coverage_per_window = vec![0usize; header[4]];
+        for value in coverage_per_window.iter_mut() {
+            match reader.read_u64::<LittleEndian>() {
+                Ok(v) => *value = v as usize,
+                Err(_) => return None,
+            }
+        }
+        Some((header[2], header[3], coverage_per_window))
+    }
 
-        let mut no_of_reads: usize = 0;
+    fn scan_records<R: bam::Read>(&self, bam_reader: &mut R, input_file_path: &Path,
+            target_name_map: &HashMap<i32, (String, i32)>,
+            checkpoint_dir: &Path, bam_file_signature: &[u64; 3],
+            qc_metrics: &mut QcMetrics,
+            chr_idx2one_chr_data: &mut HashMap<usize, OneChrData>) -> usize {
         let mut no_of_valid_fragments_chr: usize = 0;
         let mut coverage_per_window = vec![0usize];
         let mut total_insert_len_of_chr: usize = 0;
@@ -148,24 +318,14 @@ impl<'a> Normalize<'a> {
         let mut chr_len = 0usize;
         let mut no_of_windows_in_this_chr = 0usize;
         let mut no_of_unique_chrs = 0usize;
-        let mut target_name_map: HashMap<i32, (String, i32)> = HashMap::new();
 
-        // generate tid -> (chr_name, chr_idx) to save time
-        for name in header.target_names() {
-            let tid = header.tid(name).expect("unparsed name") as i32;
-            let chr_name = str::from_utf8(name).unwrap().to_string();
-            let mut chr_idx = -1i32;
-            if self.chromosome_dict.contains_key(&chr_name) {
-                chr_idx = chr_name.trim_start_matches("chr").parse::<i32>().unwrap() - 1;
-            }
-            target_name_map.insert(tid, (chr_name, chr_idx));
-        }
         for r in bam_reader.records() {
             let record = r.unwrap();
-            no_of_reads += 1;
+            qc_metrics.no_of_reads += 1;
             let tid = record.tid();
             if tid == -1 {
                 // skip unmapped reads
+                qc_metrics.no_of_unmapped += 1;
                 continue;
             }
             let value = target_name_map[&tid].clone();
@@ -173,25 +333,24 @@ impl<'a> Normalize<'a> {
             current_chr_idx = value.1;
             if !self.chromosome_dict.contains_key(&chr_name) {
                 //skip all remaining irrelevant chromosomes
+                qc_metrics.no_of_off_target_chr += 1;
                 continue;
             }
 
             if current_chr_idx != prev_chr_idx {
                 no_of_unique_chrs += 1;
                 if prev_chr_idx!=-1 {
-                    let chr_idx: usize = prev_chr_idx as usize;
-                    let coverage_per_base = total_insert_len_of_chr as f32 / chr_len as f32;
                     println_stderr!("{} reads so far for {:?}. Chromosome {} \
                         contains {} valid fragments.",
-                        no_of_reads, &input_file_path, &chr, no_of_valid_fragments_chr);
+                        qc_metrics.no_of_reads, &input_file_path, &chr, no_of_valid_fragments_chr);
 
                     // handle previous chromosome data
-                    let one_chr_data = self.smooth_coverage_of_one_chr(
-                        chr.clone(), chr_len,
-                        no_of_valid_fragments_chr,
-                        coverage_per_base,
-                        &coverage_per_window);
-                    chr_idx2one_chr_data.insert(chr_idx, one_chr_data);
+                    self.write_checkpoint_of_one_chr(checkpoint_dir, bam_file_signature,
+                        &chr, chr_len, no_of_valid_fragments_chr,
+                        total_insert_len_of_chr, &coverage_per_window);
+                    self.finish_one_chr(prev_chr_idx as usize, &chr, chr_len,
+                        no_of_valid_fragments_chr, total_insert_len_of_chr,
+                        &coverage_per_window, qc_metrics, chr_idx2one_chr_data);
                 }
                 prev_chr_idx = current_chr_idx;
                 no_of_valid_fragments_chr = 0;
@@ -211,17 +370,65 @@ impl<'a> Normalize<'a> {
 
             }
 
+            // QC metrics of primary, QC-passed alignments only, like samtools stats.
+            //  The coverage filters below are unchanged.
+            if record.is_secondary() || record.is_supplementary() {
+                qc_metrics.no_of_secondary_or_supplementary += 1;
+            } else if record.is_quality_check_failed() {
+                qc_metrics.no_of_qc_fail += 1;
+            } else if record.is_unmapped() {
+                // placed unmapped mate
+                qc_metrics.no_of_unmapped += 1;
+            } else {
+                qc_metrics.no_of_mapped += 1;
+                qc_metrics.mapq_histogram[record.mapq() as usize] += 1;
+                if record.is_duplicate() {
+                    qc_metrics.no_of_duplicates += 1;
+                }
+                if record.is_paired() {
+                    qc_metrics.no_of_paired += 1;
+                    if record.is_proper_pair() {
+                        qc_metrics.no_of_proper_pairs += 1;
+                        // one mate per pair: the leftmost one has TLEN>0.
+                        if !record.is_duplicate() && record.insert_size()>0 {
+                            let bin = cmp::min(record.insert_size() as usize,
+                                self.max_fragment_len + 1);
+                            qc_metrics.insert_size_histogram[bin] += 1;
+                        }
+                    }
+                }
+            }
+
             if record.mapq()<30 {
+                qc_metrics.filtered_low_mapq += 1;
                 continue
             }
-            if record.is_paired() && ( record.insert_size()<0 || 
-                record.insert_size()>self.max_fragment_len as i64 ||
-                !record.is_proper_pair() || record.is_mate_unmapped() || 
-                !record.is_first_in_template() ||
-                record.is_secondary() || record.is_duplicate() || 
-                record.is_supplementary() ) {
-                continue;
+            if record.is_paired() {
+                // same filters as before, checked one by one to record the reason.
+                if record.insert_size()<0 || record.insert_size()>self.max_fragment_len as i64 {
+                    qc_metrics.filtered_bad_insert_size += 1;
+                    continue;
+                } else if !record.is_proper_pair() {
+                    qc_metrics.filtered_not_proper_pair += 1;
+                    continue;
+                } else if record.is_mate_unmapped() {
+                    qc_metrics.filtered_mate_unmapped += 1;
+                    continue;
+                } else if !record.is_first_in_template() {
+                    qc_metrics.filtered_not_first_in_template += 1;
+                    continue;
+                } else if record.is_secondary() {
+                    qc_metrics.filtered_secondary += 1;
+                    continue;
+                } else if record.is_duplicate() {
+                    qc_metrics.filtered_duplicate += 1;
+                    continue;
+                } else if record.is_supplementary() {
+                    qc_metrics.filtered_supplementary += 1;
+                    continue;
+                }
             }
+            qc_metrics.no_of_valid_fragments += 1;
 
             let mut start_pos = record.pos() as usize;
             if !record.is_paired() {
@@ -273,29 +480,426 @@ impl<'a> Normalize<'a> {
 
         // handle the last chromosome
         if prev_chr_idx != -1 && self.chromosome_dict.contains_key(&chr) {
-            let chr_idx: usize = prev_chr_idx as usize;
-            let coverage_per_base = total_insert_len_of_chr as f32 / chr_len as f32;
             println_stderr!("{} reads so far for {:?}. Chromosome {} contains \
                 {} valid fragments.",
-                no_of_reads, &input_file_path, &chr, no_of_valid_fragments_chr);
+                qc_metrics.no_of_reads, &input_file_path, &chr, no_of_valid_fragments_chr);
 
-            // handle previous chromosome data
-            let one_chr_data = self.smooth_coverage_of_one_chr(chr.clone(), chr_len,
-                                    no_of_valid_fragments_chr,
-                                    coverage_per_base,
-                                    &coverage_per_window);
-            chr_idx2one_chr_data.insert(chr_idx, one_chr_data);
+            self.write_checkpoint_of_one_chr(checkpoint_dir, bam_file_signature,
+                &chr, chr_len, no_of_valid_fragments_chr,
+                total_insert_len_of_chr, &coverage_per_window);
+            self.finish_one_chr(prev_chr_idx as usize, &chr, chr_len,
+                no_of_valid_fragments_chr, total_insert_len_of_chr,
+                &coverage_per_window, qc_metrics, chr_idx2one_chr_data);
+        }
+        no_of_unique_chrs
+    }
+
+    fn read_in_coverage_of_genome(&'a self, input_file_path: &'a Path,
+            sample_label: &str) -> HashMap<usize, OneChrData> {
+        // let if_single_read = self.check_if_single_read(input_file_path);
+        println_stderr!("Reading in genome coverage from {:?} ... ", input_file_path);
+        let mut chr_idx2one_chr_data: HashMap<usize, OneChrData> = HashMap::new();
+        let mut qc_metrics = QcMetrics::new(self.max_fragment_len);
+        let checkpoint_dir = self.checkpoint_dir(sample_label);
+        fs::create_dir_all(&checkpoint_dir)
+            .expect(&format!("Error in creating checkpoint folder {:?}", &checkpoint_dir));
+        // checkpoints of a different BAM (size or modification time) are ignored.
+        let bam_file_signature = self.get_bam_file_signature(input_file_path);
+
+        // pick up chromosomes finished by a previous (killed) run.
+        let mut unfinished_chrs: Vec<String> = Vec::new();
+        for chr_idx in 0..self.chromosome_dict.len() {
+            let chr = String::from("chr") + &(chr_idx + 1).to_string();
+            let chr_len = self.chromosome_dict[&chr];
+            match self.read_checkpoint_of_one_chr(&checkpoint_dir, &bam_file_signature,
+                    &chr, chr_len) {
+                Some((no_of_fragments, total_insert_len, coverage_per_window)) => {
+                    println_stderr!("Chromosome {} loaded from checkpoint.", chr);
+                    self.finish_one_chr(chr_idx, &chr, chr_len, no_of_fragments,
+                        total_insert_len, &coverage_per_window,
+                        &mut qc_metrics, &mut chr_idx2one_chr_data);
+                    qc_metrics.no_of_chrs_from_checkpoint += 1;
+                },
+                None => unfinished_chrs.push(chr),
+            }
+        }
+
+        let mut no_of_unique_chrs = 0usize;
+        if qc_metrics.no_of_chrs_from_checkpoint == 0 {
+            // fresh start, one sequential pass over the whole file.
+            let mut bam_reader = bam::Reader::from_path(&input_file_path).unwrap();
+            let target_name_map = self.get_target_name_map(bam_reader.header());
+            no_of_unique_chrs = self.scan_records(&mut bam_reader, input_file_path,
+                &target_name_map, &checkpoint_dir, &bam_file_signature,
+                &mut qc_metrics, &mut chr_idx2one_chr_data);
+        } else if unfinished_chrs.len() > 0 {
+            // resume. seek to each unfinished chromosome via the BAM index.
+            let mut bam_reader = bam::IndexedReader::from_path(&input_file_path)
+                .expect(&format!("Error in opening indexed BAM {:?}", input_file_path));
+            let target_name_map = self.get_target_name_map(bam_reader.header());
+            for chr in unfinished_chrs.iter() {
+                bam_reader.fetch(chr.as_str())
+                    .expect(&format!("Error in fetching {} from {:?}", chr, input_file_path));
+                no_of_unique_chrs += self.scan_records(&mut bam_reader, input_file_path,
+                    &target_name_map, &checkpoint_dir, &bam_file_signature,
+                    &mut qc_metrics, &mut chr_idx2one_chr_data);
+            }
         }
         println_stderr!("Reading and smoothing of coverage from {:?} is Done. \
-            {} unique chromosomes, {} reads.",
-            input_file_path, no_of_unique_chrs, no_of_reads);
+            {} unique chromosomes, {} reads, {} chromosomes from checkpoint.",
+            input_file_path, no_of_unique_chrs, qc_metrics.no_of_reads,
+            qc_metrics.no_of_chrs_from_checkpoint);
+        self.output_qc_metrics(&qc_metrics, sample_label);
+
+        chr_idx2one_chr_data
+    }
 
+    fn read_in_coverage_of_track(&self, input_file_path: &Path) -> HashMap<usize, OneChrData> {
+        // bedGraph/mosdepth-style coverage track: chr, start (0-based), end (exclusive), depth.
+        //  plain or gzip/bgzip compressed. Depth is averaged over each window.
+        println_stderr!("Reading in genome coverage track from {:?} ... ", input_file_path);
+        let reader = bgzf::Reader::from_path(input_file_path)
+            .expect(&format!("Error in opening coverage track {:?}", input_file_path));
+        let mut chr2depth_sum_per_window: HashMap<String, Vec<f64>> = HashMap::new();
+        let mut no_of_lines = 0usize;
+        for line in BufReader::new(reader).lines() {
+            let line = line.expect(&format!("Error in reading {:?}", input_file_path));
+            if line.starts_with('#') || line.starts_with("track") || line.starts_with("browser") {
+                continue;
+            }
+            let fields: Vec<&str> = line.split('\t').collect();
+            if fields.len() < 4 || !self.chromosome_dict.contains_key(fields[0]) {
+                continue;
+            }
+            no_of_lines += 1;
+            let chr_len = self.chromosome_dict[fields[0]];
+            let start: usize = fields[1].parse()
+                .expect(&format!("Bad start in line {} of {:?}", line, input_file_path));
+            let stop: usize = cmp::min(fields[2].parse()
+                .expect(&format!("Bad end in line {} of {:?}", line, input_file_path)), chr_len);
+            let depth: f64 = fields[3].parse()
+                .expect(&format!("Bad depth in line {} of {:?}", line, input_file_path));
+            if start >= stop || depth <= 0.0 {
+                continue;
+            }
+            let window_size = self.window_size;
+            let depth_sum_per_window = chr2depth_sum_per_window.entry(fields[0].to_string())
+                .or_insert_with(|| vec![0f64; (chr_len + window_size - 1) / window_size]);
+            for window_index in start / window_size..(stop - 1) / window_size + 1 {
+                let overlap_start = cmp::max(start, window_index * window_size);
+                let overlap_stop = cmp::min(stop, (window_index + 1) * window_size);
+                depth_sum_per_window[window_index] += depth * (overlap_stop - overlap_start) as f64;
+            }
+        }
+
+        let mut chr_idx2one_chr_data: HashMap<usize, OneChrData> = HashMap::new();
+        for (chr, depth_sum_per_window) in chr2depth_sum_per_window.iter() {
+            let chr_idx = chr.trim_start_matches("chr").parse::<usize>().unwrap() - 1;
+            let chr_len = self.chromosome_dict[chr];
+            let no_of_windows = depth_sum_per_window.len();
+            let mut coverage_per_window = vec![0usize; no_of_windows];
+            let mut total_depth = 0f64;
+            for window_index in 0..no_of_windows {
+                let window_len = cmp::min(chr_len, (window_index + 1) * self.window_size)
+                    - window_index * self.window_size;
+                total_depth += depth_sum_per_window[window_index];
+                coverage_per_window[window_index] = (depth_sum_per_window[window_index] /
+                    window_len as f64 * self.coverage_scale as f64).round() as usize;
+            }
+            let coverage_per_base = (total_depth / chr_len as f64) as f32;
+            chr_idx2one_chr_data.insert(chr_idx, self.smooth_coverage_of_one_chr(chr.clone(),
+                chr_len, 0, coverage_per_base, &coverage_per_window));
+        }
+        println_stderr!("Reading and smoothing of coverage track {:?} is Done. \
+            {} chromosomes, {} lines.",
+            input_file_path, chr_idx2one_chr_data.len(), no_of_lines);
         chr_idx2one_chr_data
     }
 
+    fn read_in_coverage(&'a self, input_file_path: &'a Path,
+            sample_label: &str) -> HashMap<usize, OneChrData> {
+        if self.input_format == "bedgraph" {
+            self.read_in_coverage_of_track(input_file_path)
+        } else {
+            self.read_in_coverage_of_genome(input_file_path, sample_label)
+        }
+    }
+
+    fn get_target_name_map(&self, header: &bam::HeaderView) -> HashMap<i32, (String, i32)> {
+        // generate tid -> (chr_name, chr_idx) to save time
+        let mut target_name_map: HashMap<i32, (String, i32)> = HashMap::new();
+        for name in header.target_names() {
+            let tid = header.tid(name).expect("unparsed name") as i32;
+            let chr_name = str::from_utf8(name).unwrap().to_string();
+            let mut chr_idx = -1i32;
+            if self.chromosome_dict.contains_key(&chr_name) {
+                chr_idx = chr_name.trim_start_matches("chr").parse::<i32>().unwrap() - 1;
+            }
+            target_name_map.insert(tid, (chr_name, chr_idx));
+        }
+        target_name_map
+    }
+
+    fn get_bam_file_signature(&self, input_file_path: &Path) -> [u64; 3] {
+        // size and modification time (seconds, nanoseconds) of the BAM file.
+        let metadata = fs::metadata(input_file_path)
+            .expect(&format!("Error in reading metadata of {:?}", input_file_path));
+        let mtime = metadata.modified()
+            .expect(&format!("Error in reading modification time of {:?}", input_file_path))
+            .duration_since(UNIX_EPOCH)
+            .unwrap_or(Duration::from_secs(0));
+        [metadata.len(), mtime.as_secs(), mtime.subsec_nanos() as u64]
+    }
+
+    fn checkpoint_dir(&self, sample_label: &str) -> PathBuf {
+        self.output_folder.join(format!("{}.checkpoint", sample_label))
+    }
+
+    fn output_qc_metrics(&self, qc_metrics: &QcMetrics, sample_label: &str) {
+        // long format: section, key, value. One file per sample.
+        let output_file_path = self.output_folder.join(format!("{}.qc_metrics.tsv", sample_label));
+        print_stderr!("Outputting QC metrics to {:?} ... ", &output_file_path);
+        let output_f = File::create(&output_file_path)
+            .expect(&format!("Error in creating output file {:?}", &output_file_path));
+        let mut writer = BufWriter::new(output_f);
+        let fraction = |numerator: usize, denominator: usize| -> f64 {
+            if denominator > 0 { numerator as f64 / denominator as f64 } else { 0.0 }
+        };
+        for comment_line in vec![
+                "no_of_reads: all records of the BAM. no_of_off_target_chr: records on other \
+                    chromosomes. The metrics below count only the other records.",
+                "no_of_secondary_or_supplementary, then no_of_qc_fail (flag 0x200), then \
+                    no_of_unmapped: records left out of all metrics below.",
+                "no_of_mapped, mapq, no_of_duplicates, no_of_paired, no_of_proper_pairs: \
+                    primary, QC-passed, mapped records.",
+                "duplicate_rate = no_of_duplicates/no_of_mapped. proper_pair_fraction = \
+                    no_of_proper_pairs/no_of_paired.",
+                "insert_size: TLEN of non-duplicate proper pairs, counted once per pair \
+                    (the mate with TLEN>0), as in samtools stats/Picard.",
+                "filter: reads dropped from the coverage, by the first filter that rejects them. \
+                    no_of_valid_fragments: reads used for the coverage.",
+                "chr_fragments/chr_window_dropout: per-chromosome fragments and the fraction \
+                    of windows without any."] {
+            writer.write_fmt(format_args!("# {}\n", comment_line)).unwrap();
+        }
+        writer.write_fmt(format_args!("section\tkey\tvalue\n")).unwrap();
+        let counters: Vec<(&str, usize)> = vec![
+            ("no_of_reads", qc_metrics.no_of_reads),
+            ("no_of_unmapped", qc_metrics.no_of_unmapped),
+            ("no_of_off_target_chr", qc_metrics.no_of_off_target_chr),
+            ("no_of_secondary_or_supplementary", qc_metrics.no_of_secondary_or_supplementary),
+            ("no_of_qc_fail", qc_metrics.no_of_qc_fail),
+            ("no_of_mapped", qc_metrics.no_of_mapped),
+            ("no_of_paired", qc_metrics.no_of_paired),
+            ("no_of_proper_pairs", qc_metrics.no_of_proper_pairs),
+            ("no_of_duplicates", qc_metrics.no_of_duplicates),
+            ("no_of_valid_fragments", qc_metrics.no_of_valid_fragments),
+            ("no_of_chrs_from_checkpoint", qc_metrics.no_of_chrs_from_checkpoint),
+        ];
+        for (key, value) in counters {
+            writer.write_fmt(format_args!("summary\t{}\t{}\n", key, value)).unwrap();
+        }
+        writer.write_fmt(format_args!("summary\tduplicate_rate\t{}\n",
+            fraction(qc_metrics.no_of_duplicates, qc_metrics.no_of_mapped))).unwrap();
+        writer.write_fmt(format_args!("summary\tproper_pair_fraction\t{}\n",
+            fraction(qc_metrics.no_of_proper_pairs, qc_metrics.no_of_paired))).unwrap();
+
+        let filters: Vec<(&str, usize)> = vec![
+            ("low_mapq", qc_metrics.filtered_low_mapq),
+            ("bad_insert_size", qc_metrics.filtered_bad_insert_size),
+            ("not_proper_pair", qc_metrics.filtered_not_proper_pair),
+            ("mate_unmapped", qc_metrics.filtered_mate_unmapped),
+            ("not_first_in_template", qc_metrics.filtered_not_first_in_template),
+            ("secondary", qc_metrics.filtered_secondary),
+            ("duplicate", qc_metrics.filtered_duplicate),
+            ("supplementary", qc_metrics.filtered_supplementary),
+        ];
+        for (key, value) in filters {
+            writer.write_fmt(format_args!("filter\t{}\t{}\n", key, value)).unwrap();
+        }
+        for (mapq, count) in qc_metrics.mapq_histogram.iter().enumerate() {
+            if *count > 0 {
+                writer.write_fmt(format_args!("mapq\t{}\t{}\n", mapq, count)).unwrap();
+            }
+        }
+        for (insert_size, count) in qc_metrics.insert_size_histogram.iter().enumerate() {
+            if *count > 0 {
+                if insert_size > self.max_fragment_len {
+                    writer.write_fmt(format_args!("insert_size\t>{}\t{}\n",
+                        self.max_fragment_len, count)).unwrap();
+                } else {
+                    writer.write_fmt(format_args!("insert_size\t{}\t{}\n", insert_size, count)).unwrap();
+                }
+            }
+        }
+        for &(ref chr, no_of_fragments, no_of_windows, no_of_zero_windows) in qc_metrics.chr_summary.iter() {
+            writer.write_fmt(format_args!("chr_fragments\t{}\t{}\n", chr, no_of_fragments)).unwrap();
+            writer.write_fmt(format_args!("chr_window_dropout\t{}\t{}\n", chr,
+                fraction(no_of_zero_windows, no_of_windows))).unwrap();
+        }
+        writer.flush()
+            .expect(&format!("ERROR flush() failure for {:?}.", &output_file_path));
+        println_stderr!("Done.");
+    }
+
+    fn read_gc_bins_of_one_chr(&self, gc_index_dir: &Path, chr: &String,
+            chr_len: usize) -> Vec<i32> {
+        // GC bin of each window, -1 if unknown. Uses the coarsest GC index whose
+        //  window size divides self.window_size, so only every w-th byte is summed.
+        // GC ratio = GC bases / non-N bases (chrN.acgtW.bi). A window that is mostly N
+        //  (gap edges) gets -1, so it is neither fitted nor adjusted. An index made
+        //  before the acgt files existed falls back to all bases as the denominator.
+        let gc_window_size = *GC_INDEX_WINDOW_SIZES.iter().rev()
+            .find(|&&w| self.window_size % w == 0).unwrap_or(&1);
+        let gc_file_path = gc_index_dir.join(format!("{}.gc{}.bi", chr, gc_window_size));
+        let gc_counts = fs::read(&gc_file_path)
+            .expect(&format!("Error in reading GC index file {:?}", &gc_file_path));
+        let acgt_file_path = gc_index_dir.join(format!("{}.acgt{}.bi", chr, gc_window_size));
+        let acgt_counts = match fs::read(&acgt_file_path) {
+            Ok(acgt_counts) => Some(acgt_counts),
+            Err(_) => {
+                println_stderr!("Warning: no {:?}. N bases count as non-GC. \
+                    Re-run gc_index to exclude them.", &acgt_file_path);
+                None
+            },
+        };
+        let no_of_windows = (chr_len + self.window_size - 1) / self.window_size;
+        let mut gc_bin_per_window = vec![-1i32; no_of_windows];
+        for window_index in 0..no_of_windows {
+            let start = window_index * self.window_size;
+            let stop = cmp::min(start + self.window_size, gc_counts.len());
+            if start >= stop {
+                break;
+            }
+            let no_of_gc: usize = gc_counts[start..stop].iter().step_by(gc_window_size)
+                .map(|&c| c as usize).sum();
+            let no_of_acgt: usize = match acgt_counts {
+                Some(ref acgt_counts) => acgt_counts[start..stop].iter().step_by(gc_window_size)
+                    .map(|&c| c as usize).sum(),
+                None => stop - start,
+            };
+            if no_of_acgt * 2 < stop - start {
+                continue;
+            }
+            let gc_ratio = no_of_gc as f32 / no_of_acgt as f32;
+            gc_bin_per_window[window_index] = (gc_ratio * (NO_OF_GC_BINS - 1) as f32).round() as i32;
+        }
+        gc_bin_per_window
+    }
+
+    fn read_gc_indices(&self, gc_index_dir: &Path) -> HashMap<usize, Vec<i32>> {
+        print_stderr!("Reading GC indices from {:?} ... ", gc_index_dir);
+        let mut chr_idx2gc_bins: HashMap<usize, Vec<i32>> = HashMap::new();
+        for chr_idx in 0..self.chromosome_dict.len() {
+            let chr = String::from("chr") + &(chr_idx + 1).to_string();
+            let chr_len = self.chromosome_dict[&chr];
+            chr_idx2gc_bins.insert(chr_idx, self.read_gc_bins_of_one_chr(gc_index_dir, &chr, chr_len));
+        }
+        println_stderr!("Done.");
+        chr_idx2gc_bins
+    }
+
+    fn fit_gc_adj_factor(&self, chr_idx2one_chr_data: &HashMap<usize, OneChrData>,
+            chr_idx2gc_bins: &HashMap<usize, Vec<i32>>, sample_label: &str) -> Vec<f32> {
+        // binned regression of coverage on GC: the factor of a GC bin is its
+        //  median coverage divided by the genome-wide median coverage.
+        print_stderr!("Fitting GC-vs-coverage curve of {} ... ", sample_label);
+        let mut coverage_by_gc_bin: Vec<Vec<usize>> = vec![Vec::new(); NO_OF_GC_BINS];
+        let mut coverage_all: Vec<usize> = Vec::new();
+        let mut reg_in_writer = if self.debug > 0 {
+            let reg_in_file_path = self.output_folder.join(format!("{}.reg.in.txt", sample_label));
+            let reg_in_f = File::create(&reg_in_file_path)
+                .expect(&format!("Error in creating output file {:?}", &reg_in_file_path));
+            let mut writer = BufWriter::new(reg_in_f);
+            writer.write_fmt(format_args!("gcRatio\treadCount\n")).unwrap();
+            Some(writer)
+        } else {
+            None
+        };
+        for (chr_idx, one_chr_data) in chr_idx2one_chr_data.iter() {
+            let gc_bin_per_window = &chr_idx2gc_bins[chr_idx];
+            for (window_index, &coverage) in one_chr_data.coverage_per_window.iter().enumerate() {
+                let gc_bin = gc_bin_per_window[window_index];
+                if gc_bin < 0 || coverage == 0 || coverage >= self.max_coverage * self.coverage_scale {
+                    continue;
+                }
+                coverage_by_gc_bin[gc_bin as usize].push(coverage);
+                coverage_all.push(coverage);
+                if let Some(ref mut writer) = reg_in_writer {
+                    writer.write_fmt(format_args!("{}\t{}\n",
+                        gc_bin as f32 / (NO_OF_GC_BINS - 1) as f32,
+                        coverage as f32 / self.coverage_scale as f32)).unwrap();
+                }
+            }
+        }
+        let mut gc_adj_factor = vec![1.0f32; NO_OF_GC_BINS];
+        if coverage_all.len() == 0 {
+            println_stderr!("no windows with coverage. No GC correction.");
+            return gc_adj_factor;
+        }
+        let coverage_median = calc_median_usize(&mut coverage_all) as f32;
+        let mut populated_bins: Vec<usize> = Vec::new();
+        for gc_bin in 0..NO_OF_GC_BINS {
+            if coverage_by_gc_bin[gc_bin].len() >= MIN_NO_OF_WINDOWS_PER_GC_BIN {
+                let bin_median = calc_median_usize(&mut coverage_by_gc_bin[gc_bin]) as f32;
+                if bin_median > 0.0 {
+                    gc_adj_factor[gc_bin] = bin_median / coverage_median;
+                    populated_bins.push(gc_bin);
+                }
+            }
+        }
+        if populated_bins.len() > 0 {
+            // sparse bins (extreme GC) take the factor of the nearest populated bin.
+            let raw_factor = gc_adj_factor.clone();
+            for gc_bin in 0..NO_OF_GC_BINS {
+                let nearest_bin = *populated_bins.iter()
+                    .min_by_key(|&&b| (b as i32 - gc_bin as i32).abs()).unwrap();
+                gc_adj_factor[gc_bin] = raw_factor[nearest_bin];
+            }
+            // smooth over neighboring bins to damp noise of the binned medians.
+            let unsmoothed_factor = gc_adj_factor.clone();
+            for gc_bin in 0..NO_OF_GC_BINS {
+                let left = cmp::max(gc_bin as i32 - 2, 0) as usize;
+                let right_stop = cmp::min(gc_bin + 3, NO_OF_GC_BINS);
+                let factor_sum: f32 = unsmoothed_factor[left..right_stop].iter().sum();
+                gc_adj_factor[gc_bin] = factor_sum / (right_stop - left) as f32;
+            }
+        }
+        if let Some(ref mut writer) = reg_in_writer {
+            writer.flush().unwrap();
+        }
+
+        let adj_factor_file_path = self.output_folder.join(format!("{}.cov.adj.factor.txt", sample_label));
+        let adj_factor_f = File::create(&adj_factor_file_path)
+            .expect(&format!("Error in creating output file {:?}", &adj_factor_file_path));
+        let mut writer = BufWriter::new(adj_factor_f);
+        for factor in gc_adj_factor.iter() {
+            writer.write_fmt(format_args!("{}\n", factor)).unwrap();
+        }
+        writer.flush().unwrap();
+        println_stderr!("Done. {} populated GC bins.", populated_bins.len());
+        gc_adj_factor
+    }
+
+    fn get_coverage_adj_factor_per_window(gc_bin_per_window: Option<&Vec<i32>>,
+            gc_adj_factor: &Vec<f32>, no_of_windows: usize) -> Vec<f32> {
+        let mut adj_factor_per_window = vec![1.0f32; no_of_windows];
+        if let Some(gc_bin_per_window) = gc_bin_per_window {
+            for window_index in 0..no_of_windows {
+                let gc_bin = gc_bin_per_window[window_index];
+                if gc_bin >= 0 {
+                    adj_factor_per_window[window_index] = gc_adj_factor[gc_bin as usize];
+                }
+            }
+        }
+        adj_factor_per_window
+    }
+
     fn output_coverage_ratio_of_one_chr(&self, one_chr_data_tumor: &OneChrData, 
             one_chr_data_normal: &OneChrData,
-            coverage_mean_tumor: &f32, coverage_mean_normal: &f32){
+            coverage_mean_tumor: &f32, coverage_mean_normal: &f32,
+            gc_adj_factor_tumor: &Vec<f32>, gc_adj_factor_normal: &Vec<f32>,
+            pon_baseline: Option<&Vec<f32>>){
         print_stderr!("Outputting normalized coverage ratio of {} ... ", one_chr_data_normal.chr);
         let no_of_windows = one_chr_data_tumor.no_of_windows;
         let output_file_path = self.output_folder.join(format!("{}.ratio.w{}.csv.gz", 
@@ -339,12 +943,27 @@ impl<'a> Normalize<'a> {
 
         let coverage_per_window_tumor = &one_chr_data_tumor.coverage_per_window;
         let coverage_per_window_normal = &one_chr_data_normal.coverage_per_window;
+        // (coverage_normal, coverage_normal_adj) of one window. In tumor-only mode, the
+        //  panel-of-normals baseline (relative coverage) stands in for the normal.
+        let normal_coverage_and_adj = |window_index: usize| -> (f32, f32) {
+            match pon_baseline {
+                Some(baseline) => (baseline[window_index] * coverage_mean_normal,
+                    baseline[window_index]),
+                None => {
+                    let coverage_normal = coverage_per_window_normal[window_index] as f32
+                        / self.coverage_scale as f32;
+                    (coverage_normal,
+                        coverage_normal / gc_adj_factor_normal[window_index] / coverage_mean_normal)
+                },
+            }
+        };
         //default coverage ratio is -1*self.float_multiplier (unknown), negative will not be outputted.
         let mut cov_ratio_int_smoothed_vec = vec![self.float_multiplier as i32 * -1; no_of_windows];
 
         for window_index in 0..no_of_windows {
-            let coverage_tumor = coverage_per_window_tumor[window_index] as f32;
-            let coverage_normal = coverage_per_window_normal[window_index] as f32;
+            let coverage_tumor = coverage_per_window_tumor[window_index] as f32
+                / self.coverage_scale as f32;
+            let (coverage_normal, coverage_normal_adj) = normal_coverage_and_adj(window_index);
             if coverage_normal > 0.0 && coverage_normal < self.max_coverage as f32
                 && coverage_tumor >0.0 && coverage_tumor < self.max_coverage as f32 {
                 //coverage_tumor usually won't be 0 because a deletion => zero \
@@ -352,8 +971,8 @@ impl<'a> Normalize<'a> {
                 // its gc_ratio_in is -1. cov=0 (unsequenced => unknown , \
                 //    not sure if it's deletion or not sequenced).
                 // cov=0 data is not fed into GC-regression. it will cause cov_adj_array_tumor[] out of bounds error.
-                let coverage_tumor_adj = coverage_tumor / coverage_mean_tumor;
-                let coverage_normal_adj = coverage_normal / coverage_mean_normal;
+                let coverage_tumor_adj = coverage_tumor / gc_adj_factor_tumor[window_index]
+                    / coverage_mean_tumor;
                 let coverage_ratio = coverage_tumor_adj / coverage_normal_adj;
                 cov_ratio_int_smoothed_vec[window_index] = 
                     (coverage_ratio * self.float_multiplier as f32) as i32;
@@ -371,11 +990,12 @@ impl<'a> Normalize<'a> {
                 // coverage_ratio=0 is excluded happen because coverage_tumor=0 \
                 //  are not included in smooth calculation.
                 // if coverage_ratio=0, it means the neighboring -1 (unknown) ratio has been used.
-                let coverage_tumor = coverage_per_window_tumor[window_index] as f32;
-                let coverage_tumor_adj = coverage_tumor / coverage_mean_tumor;
+                let coverage_tumor = coverage_per_window_tumor[window_index] as f32
+                    / self.coverage_scale as f32;
+                let coverage_tumor_adj = coverage_tumor / gc_adj_factor_tumor[window_index]
+                    / coverage_mean_tumor;
 
-                let coverage_normal = coverage_per_window_normal[window_index] as f32;
-                let coverage_normal_adj = coverage_normal / coverage_mean_normal;
+                let (coverage_normal, coverage_normal_adj) = normal_coverage_and_adj(window_index);
                 if self.debug>0 {
                     gz_writer.write_fmt(format_args!("{},{},{},{},{},{}\n", 
                         window_index * self.window_size + 1,
@@ -412,19 +1032,214 @@ impl<'a> Normalize<'a> {
 
     }
 
+    fn read_in_coverage_of_sample(&'a self, input_file_path: &'a Path, sample_label: &str,
+            chr_idx2gc_bins: &Option<HashMap<usize, Vec<i32>>>)
+            -> (HashMap<usize, OneChrData>, f32, Vec<f32>) {
+        // coverage, genome-wide mean coverage and GC adjustment factors of one sample.
+        let chr_idx2one_chr_data = self.read_in_coverage(input_file_path, sample_label);
+        let coverage_mean = self.calculate_genome_wide_cov_mean(&chr_idx2one_chr_data);
+        let mut gc_adj_factor = vec![1.0f32; NO_OF_GC_BINS];
+        if let Some(ref chr_idx2gc_bins) = *chr_idx2gc_bins {
+            gc_adj_factor = self.fit_gc_adj_factor(&chr_idx2one_chr_data,
+                chr_idx2gc_bins, sample_label);
+        }
+        (chr_idx2one_chr_data, coverage_mean, gc_adj_factor)
+    }
+
+    fn remove_checkpoint_dir(&self, sample_label: &str) {
+        let checkpoint_dir = self.checkpoint_dir(sample_label);
+        if !checkpoint_dir.exists() {
+            return;
+        }
+        if let Err(e) = fs::remove_dir_all(&checkpoint_dir) {
+            println_stderr!("Warning: failed to remove {:?}: {}", &checkpoint_dir, e);
+        }
+    }
+
+    pub fn build_coverage_baseline(&'a self, normal_file_path_vec: &Vec<&'a str>) {
+        // panel of normals: per-window median and MAD of the relative coverage
+        //  (coverage / genome-wide mean, GC-corrected if gc_index_dir is given) of many normals.
+        let chr_idx2gc_bins = self.gc_index_dir.map(|dir| self.read_gc_indices(dir));
+        let no_of_normals = normal_file_path_vec.len();
+        // chr_idx -> one vector of relative coverage (NaN if unknown) per normal
+        let mut chr_idx2relative_coverage_vec: HashMap<usize, Vec<Vec<f32>>> = HashMap::new();
+        for (normal_index, normal_file_path) in normal_file_path_vec.iter().enumerate() {
+            let sample_label = format!("pon_normal{}", normal_index);
+            let (chr_idx2one_chr_data, coverage_mean, gc_adj_factor) =
+                self.read_in_coverage_of_sample(Path::new(*normal_file_path), &sample_label,
+                    &chr_idx2gc_bins);
+            for (chr_idx, one_chr_data) in chr_idx2one_chr_data.iter() {
+                let gc_bin_per_window = chr_idx2gc_bins.as_ref().map(|m| &m[chr_idx]);
+                let adj_factor_per_window = Normalize::get_coverage_adj_factor_per_window(
+                    gc_bin_per_window, &gc_adj_factor, one_chr_data.no_of_windows);
+                let relative_coverage: Vec<f32> = one_chr_data.coverage_per_window.iter()
+                    .zip(adj_factor_per_window.iter()).map(|(&coverage, &adj_factor)| {
+                        let coverage = coverage as f32 / self.coverage_scale as f32;
+                        if coverage > 0.0 && coverage < self.max_coverage as f32 {
+                            coverage / adj_factor / coverage_mean
+                        } else {
+                            ::std::f32::NAN
+                        }
+                    }).collect();
+                chr_idx2relative_coverage_vec.entry(*chr_idx).or_insert_with(Vec::new)
+                    .push(relative_coverage);
+            }
+            self.remove_checkpoint_dir(&sample_label);
+        }
+
+        let output_file_path = self.output_folder.join(format!("pon.coverage.w{}.tsv.gz",
+            self.window_size));
+        print_stderr!("Outputting panel-of-normals coverage baseline to {:?} ... ", &output_file_path);
+        let output_f = File::create(&output_file_path)
+            .expect(&format!("Error in creating output file {:?}", &output_file_path));
+        let mut gz_writer = flate2::GzBuilder::new()
+            .filename(output_file_path.file_stem().unwrap().to_str().unwrap())
+            .comment("Comment")
+            .write(output_f, Compression::default());
+        gz_writer.write_fmt(format_args!("#window_size: {}\n", self.window_size)).unwrap();
+        gz_writer.write_fmt(format_args!("#no_of_normals: {}\n", no_of_normals)).unwrap();
+        gz_writer.write_fmt(format_args!("#gc_corrected: {}\n", chr_idx2gc_bins.is_some())).unwrap();
+        gz_writer.write_fmt(format_args!("chr\tstart\tmedian\tmad\n")).unwrap();
+        let mut no_of_windows_output = 0usize;
+        for chr_idx in 0..self.chromosome_dict.len() {
+            let relative_coverage_vec = match chr_idx2relative_coverage_vec.get(&chr_idx) {
+                Some(v) => v,
+                None => continue,
+            };
+            let no_of_windows = relative_coverage_vec[0].len();
+            for window_index in 0..no_of_windows {
+                let mut values: Vec<f32> = relative_coverage_vec.iter()
+                    .map(|v| v[window_index]).filter(|x| !x.is_nan()).collect();
+                // a window needs data in at least half of the normals.
+                if values.len() == 0 || values.len() * 2 < no_of_normals {
+                    continue;
+                }
+                let median = calc_median_f32(&mut values);
+                let mut deviations: Vec<f32> = values.iter().map(|x| (x - median).abs()).collect();
+                let mad = calc_median_f32(&mut deviations);
+                gz_writer.write_fmt(format_args!("chr{}\t{}\t{}\t{}\n", chr_idx + 1,
+                    window_index * self.window_size + 1, median, mad)).unwrap();
+                no_of_windows_output += 1;
+            }
+        }
+        gz_writer.finish()
+            .expect(&format!("ERROR finish() failure for gz_writer of {:?}.", &output_file_path));
+        println_stderr!("Done. {} windows from {} normals.", no_of_windows_output, no_of_normals);
+    }
+
+    fn read_pon_baseline(&self, pon_file_path: &Path) -> HashMap<usize, Vec<f32>> {
+        // chr_idx -> median relative coverage per window, -1 if unknown or if the normals
+        //  disagree too much (MAD > MAX_PON_RELATIVE_MAD * median).
+        print_stderr!("Reading panel-of-normals coverage baseline from {:?} ... ", pon_file_path);
+        let reader = bgzf::Reader::from_path(pon_file_path)
+            .expect(&format!("Error in opening panel of normals {:?}", pon_file_path));
+        let mut chr_idx2baseline: HashMap<usize, Vec<f32>> = HashMap::new();
+        for chr_idx in 0..self.chromosome_dict.len() {
+            let chr = String::from("chr") + &(chr_idx + 1).to_string();
+            let no_of_windows = (self.chromosome_dict[&chr] + self.window_size - 1) / self.window_size;
+            chr_idx2baseline.insert(chr_idx, vec![-1f32; no_of_windows]);
+        }
+        let mut has_gc_corrected_header = false;
+        let mut no_of_windows_used = 0usize;
+        let mut no_of_variable_windows = 0usize;
+        for line in BufReader::new(reader).lines() {
+            let line = line.expect(&format!("Error in reading {:?}", pon_file_path));
+            if line.starts_with("#window_size:") {
+                let pon_window_size: usize = line["#window_size:".len()..].trim().parse().unwrap();
+                if pon_window_size != self.window_size {
+                    println_stderr!("ERROR: window size of panel of normals {:?} is {}, not {}.",
+                        pon_file_path, pon_window_size, self.window_size);
+                    ::std::process::exit(3);
+                }
+                continue;
+            }
+            if line.starts_with("#gc_corrected:") {
+                // GC-corrected relative coverage can not stand in for uncorrected and vice versa.
+                let pon_gc_corrected: bool = line["#gc_corrected:".len()..].trim().parse().unwrap();
+                if pon_gc_corrected != self.gc_index_dir.is_some() {
+                    println_stderr!("ERROR: panel of normals {:?} has gc_corrected={}, but \
+                        normalize runs with gc_corrected={} (--gc_index_dir).",
+                        pon_file_path, pon_gc_corrected, self.gc_index_dir.is_some());
+                    ::std::process::exit(3);
+                }
+                has_gc_corrected_header = true;
+                continue;
+            }
+            if line.starts_with('#') || line.starts_with("chr\t") {
+                continue;
+            }
+            let fields: Vec<&str> = line.split('\t').collect();
+            if !self.chromosome_dict.contains_key(fields[0]) {
+                continue;
+            }
+            let chr_idx = fields[0].trim_start_matches("chr").parse::<usize>().unwrap() - 1;
+            let start: usize = fields[1].parse().unwrap();
+            let median: f32 = fields[2].parse().unwrap();
+            let mad: f32 = fields[3].parse().unwrap();
+            let baseline = chr_idx2baseline.get_mut(&chr_idx).unwrap();
+            let window_index = (start - 1) / self.window_size;
+            if window_index >= baseline.len() {
+                continue;
+            }
+            if mad > MAX_PON_RELATIVE_MAD * median {
+                no_of_variable_windows += 1;
+                continue;
+            }
+            baseline[window_index] = median;
+            no_of_windows_used += 1;
+        }
+        if !has_gc_corrected_header {
+            println_stderr!("ERROR: panel of normals {:?} has no #gc_corrected header.",
+                pon_file_path);
+            ::std::process::exit(3);
+        }
+        println_stderr!("Done. {} windows used, {} too variable among normals.",
+            no_of_windows_used, no_of_variable_windows);
+        chr_idx2baseline
+    }
+
     pub fn run(&self) {
-        //let chr_idx2gc_map = self.read_gc_indices();
+        let chr_idx2gc_bins = self.gc_index_dir.map(|dir| self.read_gc_indices(dir));
         //TODO parallel tumor and normal. not easy due to shared references (&self) not allowed in threads
-        let chr_idx2one_chr_data_tumor = self.read_in_coverage_of_genome(self.tumor_file_path);
-        let coverage_mean_tumor = self.calculate_genome_wide_cov_mean(&chr_idx2one_chr_data_tumor);
+        let (chr_idx2one_chr_data_tumor, coverage_mean_tumor, gc_adj_factor_tumor) =
+            self.read_in_coverage_of_sample(self.tumor_file_path, "tumor", &chr_idx2gc_bins);
 
-        let chr_idx2one_chr_data_normal = self.read_in_coverage_of_genome(self.normal_file_path);
-        let coverage_mean_normal = self.calculate_genome_wide_cov_mean(&chr_idx2one_chr_data_normal);
+        if let Some(pon_file_path) = self.pon_file_path {
+            // tumor-only. The normal's place is taken by the panel-of-normals baseline.
+            let chr_idx2baseline = self.read_pon_baseline(pon_file_path);
+            for chr_idx in 0..self.chromosome_dict.len() {
+                let one_chr_data_tumor = &chr_idx2one_chr_data_tumor[&chr_idx];
+                let no_of_windows = one_chr_data_tumor.no_of_windows;
+                let gc_bin_per_window = chr_idx2gc_bins.as_ref().map(|m| &m[&chr_idx]);
+                let adj_factor_per_window_tumor = Normalize::get_coverage_adj_factor_per_window(
+                    gc_bin_per_window, &gc_adj_factor_tumor, no_of_windows);
+                let one_chr_data_pon = OneChrData::new(one_chr_data_tumor.chr.clone(),
+                    one_chr_data_tumor.chr_len, Vec::new(), 0, coverage_mean_tumor, no_of_windows);
+                self.output_coverage_ratio_of_one_chr(one_chr_data_tumor, &one_chr_data_pon,
+                    &coverage_mean_tumor, &coverage_mean_tumor,
+                    &adj_factor_per_window_tumor, &vec![1.0f32; no_of_windows],
+                    Some(&chr_idx2baseline[&chr_idx]));
+            }
+            self.remove_checkpoint_dir("tumor");
+            return;
+        }
+
+        let (chr_idx2one_chr_data_normal, coverage_mean_normal, gc_adj_factor_normal) =
+            self.read_in_coverage_of_sample(self.normal_file_path, "normal", &chr_idx2gc_bins);
         for chr_idx in 0..self.chromosome_dict.len() {
+            let no_of_windows = chr_idx2one_chr_data_tumor[&chr_idx].no_of_windows;
+            let gc_bin_per_window = chr_idx2gc_bins.as_ref().map(|m| &m[&chr_idx]);
+            let adj_factor_per_window_tumor = Normalize::get_coverage_adj_factor_per_window(
+                gc_bin_per_window, &gc_adj_factor_tumor, no_of_windows);
+            let adj_factor_per_window_normal = Normalize::get_coverage_adj_factor_per_window(
+                gc_bin_per_window, &gc_adj_factor_normal, no_of_windows);
             self.output_coverage_ratio_of_one_chr(&chr_idx2one_chr_data_tumor[&chr_idx],
                 &chr_idx2one_chr_data_normal[&chr_idx],
-                &coverage_mean_tumor, &coverage_mean_normal);
+                &coverage_mean_tumor, &coverage_mean_normal,
+                &adj_factor_per_window_tumor, &adj_factor_per_window_normal, None);
         }
-
+        // all outputs are written. checkpoints are no longer needed.
+        self.remove_checkpoint_dir("tumor");
+        self.remove_checkpoint_dir("normal");
     }
 }
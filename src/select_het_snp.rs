@@ -5,38 +5,129 @@ Author:
  */
 extern crate time;
 
-use flate2;
-use flate2::Compression;
 use rust_htslib::bcf;
 use rust_htslib::bcf::Read;
-use std::fs::File;
+use rust_htslib::bgzf;
+use std::cmp;
 use std::io::prelude::*;
 use std::path::{Path};
 use std::str;
 
+// from lib.rs
+use process_contigs_in_order;
 
-struct Record {
-    chr: String,
-    pos: u32,
-    tumor_depth: i32,
-    tumor_ro: i32,
-    tumor_ao: i32,
-    normal_depth: i32,
-    normal_ro: i32,
-    normal_ao: i32,
-}   
 
+#[derive(Default)]
 struct SnpSummary {
     no_of_total_records: u32,
     no_of_good_hets_in_normal: u32,
     no_of_good_hets: u32,
 }
 
+impl SnpSummary {
+    fn add(&mut self, other: &SnpSummary) {
+        self.no_of_total_records += other.no_of_total_records;
+        self.no_of_good_hets_in_normal += other.no_of_good_hets_in_normal;
+        self.no_of_good_hets += other.no_of_good_hets;
+    }
+}
+
+fn is_het_genotype(genotype: &[i32]) -> bool {
+    // raw BCF GT values: (allele_index+1)<<1 | phased. Same as "0/1", "0|1" or "1|0".
+    // multi-sample snp calling maybe phase genotype
+    if genotype.len() < 2 {
+        return false;
+    }
+    (genotype[0] >> 1 == 1 && genotype[1] >> 1 == 2) || (genotype[0] >> 1 == 2 && genotype[1] == 3)
+}
+
+fn select_het_snp_of_records<R: bcf::Read, W: Write>(reader: &mut R, writer: &mut W,
+        min_coverage: usize, max_coverage: usize) -> SnpSummary {
+    // het SNPs are written to writer as they are read. sample 1 is normal, 2 is tumor.
+    let mut snp_summary = SnpSummary::default();
+    let mut record = reader.empty_record();
+    let mut chr: Option<(u32, String)> = None;
+    while let Some(result) = reader.read(&mut record) {
+        result.ok().expect("Error reading record.");
+        snp_summary.no_of_total_records += 1;
+        let (normal_ro, normal_ao, tumor_ro, tumor_ao);
+        {
+            let genotype_vec = record.format(b"GT").integer().expect("Error reading genotypes");
+            if !is_het_genotype(genotype_vec[0]) {
+                continue;
+            }
+            let allele_depth_vec = record.format(b"AD").integer().unwrap();
+            normal_ro = allele_depth_vec[0][0];
+            normal_ao = allele_depth_vec[0][1];
+            tumor_ro = allele_depth_vec[1][0];
+            tumor_ao = allele_depth_vec[1][1];
+        }
+        let normal_depth = normal_ro + normal_ao;
+        let tumor_depth = tumor_ro + tumor_ao;
+        // is a good heterogeneous SNP site in normal sample?
+        if normal_depth > (min_coverage as i32) && normal_depth < (max_coverage as i32) {
+            snp_summary.no_of_good_hets_in_normal += 1;
+        } else {
+            continue;
+        }
+        // is a good SNP site in tumor sample?
+        // Note: don't filter homologous SNP sites in tumor sample
+        if tumor_depth > (min_coverage as i32) && tumor_depth < (max_coverage as i32) {
+            snp_summary.no_of_good_hets += 1;
+        } else {
+            continue;
+        }
+        // the contig name is only looked up when the contig changes.
+        let rid = record.rid().expect("Error read rid.");
+        if chr.as_ref().map_or(true, |&(chr_rid, _)| chr_rid != rid) {
+            let chr_name = String::from_utf8_lossy(record.header().rid2name(rid).unwrap())
+                .to_string();
+            chr = Some((rid, chr_name));
+        }
+        // Have passed all filters, it is a good heterogeneous SNP site
+        writer.write_fmt(format_args!("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n",
+            chr.as_ref().unwrap().1, record.pos() + 1, //convert 0 base to 1 base
+            tumor_depth, tumor_ro, tumor_ao,
+            normal_depth, normal_ro, normal_ao)).unwrap();
+    }
+    snp_summary
+}
+
+fn select_het_snp_of_contig(snp_file: &Path, rid: u32, min_coverage: usize,
+        max_coverage: usize) -> (Vec<u8>, SnpSummary) {
+    // one contig through the tabix/csi index. Each worker has its own reader.
+    let mut vcf = bcf::IndexedReader::from_path(snp_file).ok().expect(
+        "Error opening indexed SNP file.");
+    let mut block: Vec<u8> = Vec::new();
+    if vcf.fetch(rid, 0, None).is_err() {
+        // contig without records in the index
+        return (block, SnpSummary::default());
+    }
+    let snp_summary = select_het_snp_of_records(&mut vcf, &mut block,
+        min_coverage, max_coverage);
+    (block, snp_summary)
+}
+
+pub fn create_het_snp_writer(output_file_path: &Path, comment_lines: &Vec<String>)
+        -> bgzf::Writer {
+    // het_snp.tsv.gz layout read by infer: "#" comment lines, then a column header.
+    // BGZF (still gzip), so that infer inflates its blocks in parallel.
+    let mut gz_writer = bgzf::Writer::from_path(output_file_path)
+        .expect(&format!("Error in creating output file {:?}", output_file_path));
+    for comment_line in comment_lines {
+        gz_writer.write_fmt(format_args!("#{}\n", comment_line)).unwrap();
+    }
+    gz_writer.write_fmt(format_args!("chr\tpos\ttumor_depth\ttumor_ro\t\
+            tumor_ao\tnormal_depth\tnormal_ro\tnormal_ao\n")).unwrap();
+    gz_writer
+}
+
 pub struct SelectHetSNP<'a> {
     snp_file: &'a Path,
     output_file_path: &'a Path,
     min_coverage: usize,
     max_coverage: usize,
+    no_of_threads: usize,
 }
 
 
@@ -46,102 +137,63 @@ impl<'a> SelectHetSNP<'a> {
            output_file_path: &'a str,
            min_coverage: usize,
            max_coverage: usize,
+           no_of_threads: usize,
     ) -> SelectHetSNP<'a> {
         SelectHetSNP {
             snp_file: Path::new(snp_file),
             output_file_path: Path::new(output_file_path),
             min_coverage,
             max_coverage,
+            no_of_threads: cmp::max(no_of_threads, 1),
         }
     }
 
-    fn select_het_snp(&self){
-        let mut vcf = bcf::Reader::from_path(&self.snp_file).ok().expect(
-            "Error opening SNP file.");
-        let mut snp_list: Vec<Record> = Vec::new();
-        let vcf_header = vcf.header().clone();
-        let mut snp_summary = SnpSummary{no_of_total_records:0, 
-                              no_of_good_hets_in_normal: 0,no_of_good_hets: 0};
-        for rec in vcf.records() {
-            snp_summary.no_of_total_records += 1;
-            let mut record = rec.ok().expect("Error reading record.");
-            let sample_1_genotype: String;
-            let _sample_2_genotype: String;
-            {
-                let genotypes = record.genotypes().expect("Error reading genotypes");
-                sample_1_genotype = format!("{}", genotypes.get(0));
-                _sample_2_genotype = format!("{}", genotypes.get(1));
-            }
-            let sample1_allele_depth: Vec<i32>;
-            let sample2_allele_depth: Vec<i32>;
-            {
-                let allele_depth_vec = record.format(b"AD").integer().unwrap();
-                sample1_allele_depth = allele_depth_vec[0].iter().map(|x| x.clone()).collect();
-                sample2_allele_depth = allele_depth_vec[1].iter().map(|x| x.clone()).collect();
-            }
-            let chr = String::from_utf8_lossy(vcf_header.rid2name(
-                      record.rid().expect("Error read rid.")).unwrap()).to_string();
-            let pos = record.pos() + 1; //convert 0 base to 1 base
-            let normal_depth = sample1_allele_depth[0] + sample1_allele_depth[1];
-            let tumor_depth = sample2_allele_depth[0] + sample2_allele_depth[1];
-            // is a good heterogeneous SNP site in normal sample?
-            // multi-sample snp calling maybe phase genotype
-            if (sample_1_genotype == "0/1" || sample_1_genotype == "0|1" ||
-                sample_1_genotype == "1|0") && normal_depth > (self.min_coverage as i32)
-                && normal_depth < (self.max_coverage as i32) {
-                snp_summary.no_of_good_hets_in_normal += 1;
-            } else {
-                continue;
-            }
-            // is a good SNP site in tumor sample?
-            // Note: don't filter homologous SNP sites in tumor sample
-            if tumor_depth > (self.min_coverage as i32)&& tumor_depth < (self.max_coverage as i32){
-                snp_summary.no_of_good_hets += 1;
-            } else {
-                continue;
-            }
-            // Have passed all filters, it is a good heterogeneous SNP site
-            let index: usize = snp_list.len();
-            snp_list.insert(index, Record{chr: chr.clone(), pos: pos as u32,
-                normal_ro: sample1_allele_depth[0],
-                normal_ao: sample1_allele_depth[1],
-                normal_depth: normal_depth, tumor_ro: sample2_allele_depth[0],
-                tumor_ao: sample2_allele_depth[1], tumor_depth: tumor_depth});
-            // println!("{}:{} {:?}:{:?}, {:?}:{:?}",chr,pos,sample_1_genotype,sample_2_genotype,
-            //           sample_1_AD,sample_2_AD);
+    fn select_het_snp_by_contig<W: Write>(&self, writer: &mut W) -> SnpSummary {
+        let no_of_contigs = {
+            let vcf = bcf::IndexedReader::from_path(&self.snp_file).ok().expect(
+                "Error opening indexed SNP file.");
+            vcf.header().contig_count()
+        };
+        let snp_file = self.snp_file.to_path_buf();
+        let (min_coverage, max_coverage) = (self.min_coverage, self.max_coverage);
+        let contig_snp_summary_vec = process_contigs_in_order(no_of_contigs, self.no_of_threads,
+            move |rid| select_het_snp_of_contig(&snp_file, rid, min_coverage, max_coverage),
+            writer);
+        let mut snp_summary = SnpSummary::default();
+        for contig_snp_summary in contig_snp_summary_vec.iter() {
+            snp_summary.add(contig_snp_summary);
         }
+        snp_summary
+    }
+
+    fn select_het_snp(&self){
+        let mut gz_writer = create_het_snp_writer(self.output_file_path, &vec![
+            format!("min_coverage={}, max_coverage={}", self.min_coverage, self.max_coverage),
+            format!("two sample snp file: {:?}", &self.snp_file),
+        ]);
+        let snp_summary = if bcf::IndexedReader::from_path(&self.snp_file).is_ok() {
+            self.select_het_snp_by_contig(&mut gz_writer)
+        } else {
+            println_stderr!("No index for {:?}. Reading it in one pass.", &self.snp_file);
+            let mut vcf = bcf::Reader::from_path(&self.snp_file).ok().expect(
+                "Error opening SNP file.");
+            select_het_snp_of_records(&mut vcf, &mut gz_writer,
+                self.min_coverage, self.max_coverage)
+        };
         println!("total SNP sites: {}\nGood heterogeneous SNP sites in normal: {}\n\
             Good heterogeneous SNP sites keeped: {}",
             snp_summary.no_of_total_records, snp_summary.no_of_good_hets_in_normal,
             snp_summary.no_of_good_hets);
-        let output_f = File::create(&self.output_file_path)
-            .expect(&format!("Error in creating output file {:?}", &self.output_file_path));
-        let mut gz_writer = flate2::GzBuilder::new()
-            .filename(self.output_file_path.file_stem().unwrap().to_str().unwrap())
-            .comment("Comment")
-            .write(output_f, Compression::default());
-        gz_writer.write_fmt(format_args!("#min_coverage={}, max_coverage={}\n",
-            self.min_coverage, self.max_coverage)).unwrap();
-        gz_writer.write_fmt(format_args!("#two sample snp file: {:?}\n", 
-            &self.snp_file)).unwrap();
-        gz_writer.write_fmt(format_args!("#no_of_total_records: {}\n", 
-            snp_summary.no_of_total_records)).unwrap();
-        gz_writer.write_fmt(format_args!("#no_of_good_hets in normal: {}\n", 
-            snp_summary.no_of_good_hets_in_normal)).unwrap();
-        gz_writer.write_fmt(format_args!("#no_of_good hets in two samples: {}\n", 
-            snp_summary.no_of_good_hets)).unwrap();
-        gz_writer.write_fmt(format_args!("chr\tpos\ttumor_depth\ttumor_ro\t\
-                tumor_ao\tnormal_depth\tnormal_ro\tnormal_ao\n")).unwrap();
-
-        for snp_record in snp_list {
-            gz_writer.write_fmt(format_args!("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n",
-                snp_record.chr, snp_record.pos, snp_record.tumor_depth,
-                snp_record.tumor_ro, snp_record.tumor_ao,
-                snp_record.normal_depth, snp_record.normal_ro,
-                snp_record.normal_ao)).unwrap();
+        // counts are only known at the end. infer skips "#" lines anywhere.
+        for comment_line in vec![
+                format!("no_of_total_records: {}", snp_summary.no_of_total_records),
+                format!("no_of_good_hets in normal: {}", snp_summary.no_of_good_hets_in_normal),
+                format!("no_of_good hets in two samples: {}", snp_summary.no_of_good_hets)] {
+            gz_writer.write_fmt(format_args!("#{}\n", comment_line)).unwrap();
         }
-        gz_writer.finish()
-            .expect(&format!("ERROR finish() failure for gz_writer of {:?}.", 
+        // the BGZF EOF block is written when gz_writer is dropped.
+        gz_writer.flush()
+            .expect(&format!("ERROR flush() failure for gz_writer of {:?}.",
                 &self.output_file_path));
         println_stderr!("{} intersect SNPs.", snp_summary.no_of_good_hets);
     }
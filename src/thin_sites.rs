@@ -0,0 +1,171 @@
+/*
+Author:
+ Yu S. Huang, polyactis@gmail.com
+ Xinping Fan, 897488736@qq.com
+ */
+use rust_htslib::bcf;
+use rust_htslib::bcf::Read;
+use rust_htslib::bgzf;
+use rust_htslib::htslib;
+use std::ffi::CString;
+use std::fs;
+use std::io::prelude::*;
+use std::path::{Path, PathBuf};
+use std::process::exit;
+
+struct Site {
+    pos: i64,
+    ref_allele: u8,
+    alt_allele: u8,
+    heterozygosity: f32,
+}
+
+struct Tier {
+    spacing: i64,
+    output_file_path: PathBuf,
+    writer: bgzf::Writer,
+    // the best site of the current bin
+    bin_index: i64,
+    best_site: Option<Site>,
+    no_of_sites: usize,
+}
+
+impl Tier {
+    fn flush(&mut self, chr: &str) {
+        if let Some(site) = self.best_site.take() {
+            self.writer.write_fmt(format_args!("{}\t{}\t{}\t{}\t{}\n", chr, site.pos, site.pos + 1,
+                site.ref_allele as char, site.alt_allele as char)).unwrap();
+            self.no_of_sites += 1;
+        }
+    }
+
+    fn add(&mut self, chr: &str, pos: i64, ref_allele: u8, alt_allele: u8, heterozygosity: f32) {
+        // one site, the most heterozygous, per bin of spacing bp.
+        let bin_index = pos / self.spacing;
+        if bin_index != self.bin_index {
+            self.flush(chr);
+            self.bin_index = bin_index;
+        }
+        if self.best_site.as_ref().map_or(true, |site| heterozygosity > site.heterozygosity) {
+            self.best_site = Some(Site{pos, ref_allele, alt_allele, heterozygosity});
+        }
+    }
+}
+
+fn build_bed_index(bed_file_path: &Path) {
+    // tabix index (.tbi), needed by strelka --callRegions and allele_count.
+    let c_path = CString::new(bed_file_path.to_str().unwrap()).unwrap();
+    let return_code = unsafe {
+        htslib::tbx_index_build(c_path.as_ptr(), 0, &htslib::tbx_conf_bed)
+    };
+    if return_code != 0 {
+        println_stderr!("ERROR: failed to build the tabix index of {:?}.", bed_file_path);
+        exit(3);
+    }
+}
+
+pub struct ThinSites<'a> {
+    input_file_path: &'a Path,
+    output_dir: &'a Path,
+    spacing_vec: Vec<i64>,
+    min_allele_frequency: f32,
+}
+
+impl<'a> ThinSites<'a> {
+    pub fn new(input_file_path: &'a str,
+           output_dir: &'a str,
+           spacing_vec: Vec<i64>,
+           min_allele_frequency: f32,
+    ) -> ThinSites<'a> {
+        ThinSites {
+            input_file_path: Path::new(input_file_path),
+            output_dir: Path::new(output_dir),
+            spacing_vec,
+            min_allele_frequency,
+        }
+    }
+
+    fn write_tier_list(&self, tier_vec: &Vec<Tier>, no_of_input_sites: usize) {
+        // read by main.py to pick a tier.
+        let output_file_path = self.output_dir.join("snp_sites.tiers.tsv");
+        let mut writer = fs::File::create(&output_file_path)
+            .expect(&format!("Error in creating output file {:?}", &output_file_path));
+        writer.write_fmt(format_args!("#input: {:?}, {} biallelic SNPs with AF>={}\n",
+            self.input_file_path, no_of_input_sites, self.min_allele_frequency)).unwrap();
+        writer.write_fmt(format_args!("tier\tspacing\tno_of_sites\tfile\n")).unwrap();
+        for (tier_index, tier) in tier_vec.iter().enumerate() {
+            writer.write_fmt(format_args!("{}\t{}\t{}\t{}\n", tier_index + 1, tier.spacing,
+                tier.no_of_sites,
+                tier.output_file_path.file_name().unwrap().to_str().unwrap())).unwrap();
+        }
+    }
+
+    pub fn run(&self) {
+        // input: a sorted VCF of population SNPs with INFO/AF (i.e. 1000 Genomes sites).
+        // output: one BED (chr, start, end, ref, alt) per spacing. A sparser tier is
+        //  a subset of a denser one when the spacings divide each other.
+        if fs::metadata(self.output_dir).is_err() {
+            fs::DirBuilder::new().recursive(true).create(self.output_dir).unwrap();
+        }
+        let mut spacing_vec = self.spacing_vec.clone();
+        spacing_vec.sort();
+        let mut tier_vec: Vec<Tier> = spacing_vec.iter().map(|&spacing| {
+            let output_file_path = self.output_dir.join(
+                format!("snp_sites.thin{}.bed.gz", spacing));
+            Tier{spacing, writer: bgzf::Writer::from_path(&output_file_path)
+                    .expect(&format!("Error in creating output file {:?}", &output_file_path)),
+                output_file_path, bin_index: -1, best_site: None, no_of_sites: 0}
+        }).collect();
+
+        let mut vcf = bcf::Reader::from_path(self.input_file_path).ok().expect(
+            "Error opening VCF file.");
+        let mut record = vcf.empty_record();
+        let mut chr = String::new();
+        let mut current_rid: Option<u32> = None;
+        let mut no_of_input_sites = 0usize;
+        while let Some(result) = vcf.read(&mut record) {
+            result.ok().expect("Error reading record.");
+            let alleles = record.alleles();
+            if alleles.len() != 2 || alleles[0].len() != 1 || alleles[1].len() != 1 {
+                continue;
+            }
+            let (ref_allele, alt_allele) = (alleles[0][0], alleles[1][0]);
+            let allele_frequency = match record.info(b"AF").float() {
+                Ok(Some(af_vec)) => af_vec[0],
+                _ => continue,
+            };
+            if allele_frequency < self.min_allele_frequency ||
+                allele_frequency > 1.0 - self.min_allele_frequency {
+                continue;
+            }
+            no_of_input_sites += 1;
+            let rid = record.rid().expect("Error read rid.");
+            if current_rid != Some(rid) {
+                for tier in tier_vec.iter_mut() {
+                    tier.flush(&chr);
+                    tier.bin_index = -1;
+                }
+                chr = String::from_utf8_lossy(record.header().rid2name(rid).unwrap()).to_string();
+                current_rid = Some(rid);
+                println_stderr!("Thinning chromosome {} ...", chr);
+            }
+            let heterozygosity = 2.0 * allele_frequency * (1.0 - allele_frequency);
+            for tier in tier_vec.iter_mut() {
+                tier.add(&chr, record.pos(), ref_allele, alt_allele, heterozygosity);
+            }
+        }
+        for tier in tier_vec.iter_mut() {
+            tier.flush(&chr);
+            tier.writer.flush().unwrap();
+        }
+        self.write_tier_list(&tier_vec, no_of_input_sites);
+        // close the bgzf files before indexing them.
+        let tier_summary_vec: Vec<(i64, usize, PathBuf)> = tier_vec.into_iter()
+            .map(|tier| (tier.spacing, tier.no_of_sites, tier.output_file_path)).collect();
+        for (spacing, no_of_sites, output_file_path) in tier_summary_vec.iter() {
+            build_bed_index(output_file_path);
+            println_stderr!("One site per {} bp: {} sites in {:?}.", spacing, no_of_sites,
+                output_file_path);
+        }
+    }
+}
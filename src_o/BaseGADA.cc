@@ -102,40 +102,34 @@ void BaseGADA::reconstruct(double *wr, long M_total_length, double *aux_vec) {
 	}
 }
 
-/* Bubble Sort */
+/* Sort (the name stays from the original bubble sort, which was O(L^2) or worse) */
 void BaseGADA::BubbleSort(long *I, long L) {
-	long i = 0;
-	long aux_local = 0;
-
-	for (i = 0; i < L - 1; i++) {
-		if (I[i] > I[i + 1]) {
-			aux_local = I[i + 1];
-			I[i + 1] = I[i];
-			I[i] = aux_local;
-			i = -1;
-		}
-	}
+	std::sort(I, I + L);
 }
 void BaseGADA::doubleBubbleSort(double *D, long *I, long L) {
-	long i = 0;
-	double Daux = 0;
-	long Iaux = 0;
-
-	for (i = 0; i < L - 1; i++) {
-		if (D[i] > D[i + 1]) {
-			Daux = D[i + 1];
-			D[i + 1] = D[i];
-			D[i] = Daux;
-
-			if (I != NULL) {
-				Iaux = I[i + 1];
-				I[i + 1] = I[i];
-				I[i] = Iaux;
-			}
-
-			i = -1;
+	/*
+	 * sort D ascendingly and permute I (if not NULL) along with it.
+	 * stable, so ties keep their order as in the old bubble sort.
+	 */
+	vector<long> orderVector(L);
+	long i;
+	for (i = 0; i < L; i++) {
+		orderVector[i] = i;
+	}
+	std::stable_sort(orderVector.begin(), orderVector.end(),
+			[D](long x, long y) {return D[x] < D[y];});
+	vector<double> sortedDVector(L);
+	for (i = 0; i < L; i++) {
+		sortedDVector[i] = D[orderVector[i]];
+	}
+	if (I != NULL) {
+		vector<long> sortedIVector(L);
+		for (i = 0; i < L; i++) {
+			sortedIVector[i] = I[orderVector[i]];
 		}
+		std::copy(sortedIVector.begin(), sortedIVector.end(), I);
 	}
+	std::copy(sortedDVector.begin(), sortedDVector.end(), D);
 }
 
 /////////////  TRIDIAGONAL MATRIX OPERATION FUNCTIONS ////////////////////
@@ -350,20 +344,21 @@ void BaseGADA::CompZ( // computes z=F'y for entire possilbe breakpoint positions
 	double LeftSum;
 	double RightSum;
 	double *aux_local = NULL;
+	long m;	//the loop variable had been renamed to M_total_length as well, which disabled both loops.
 
 	aux_local = (double*) calloc(M_total_length-1,sizeof(double));
 
 	LeftSum = 0;
 	RightSum = 0;
-	for (M_total_length = 1; M_total_length < M_total_length; M_total_length++) {
-		LeftSum = LeftSum + y[M_total_length - 1];
-		aux_local[M_total_length - 1] = (-1) * sqrt((double) (M_total_length - M_total_length) / ((double) M_total_length * (double) M_total_length))
+	for (m = 1; m < M_total_length; m++) {
+		LeftSum = LeftSum + y[m - 1];
+		aux_local[m - 1] = (-1) * sqrt((double) (M_total_length - m) / ((double) M_total_length * (double) m))
 				* LeftSum;
 	}
-	for (M_total_length = M_total_length - 1; M_total_length >= 1; M_total_length--) {
-		RightSum = RightSum + y[M_total_length];
-		z[M_total_length - 1] = aux_local[M_total_length - 1]
-				+ sqrt((double) M_total_length / ((double) (M_total_length - M_total_length) * (double) (M_total_length)))
+	for (m = M_total_length - 1; m >= 1; m--) {
+		RightSum = RightSum + y[m];
+		z[m - 1] = aux_local[m - 1]
+				+ sqrt((double) m / ((double) (M_total_length - m) * (double) (M_total_length)))
 						* RightSum;
 	}
 	free(aux_local);
@@ -1354,16 +1349,11 @@ BaseGADA::CompBaseAmpMedianMethod() {
 /**************************************************************************************************************************/
 
 
-long BaseGADA::SBLandBE() {
-	//double convergenceDelta, convergenceMaxAlpha, convergenceB;
-	//long maxNoOfIterations;
-	// SBL optimization parameters
-	//convergenceDelta = 1E-10; //1E-10 or 1E-8 seems to work well for this parameter. -- => ++ conv time
-	//convergenceMaxAlpha = 1E8; //1E8 better than 1E10 seems to work well for this parameter. -- => -- conv time
-	//maxNoOfIterations = 100000; //Maximum number of iterations to reach convergence...
-	//convergenceB = 1E-20; //
-	//sigma2 = *Psigma2;
-
+void BaseGADA::NormalizeInputData() {
+	/*
+	 * copy inputDataArray into normalized_data_array with its mean (ymean) removed,
+	 * and estimate sigma2 if it is negative.
+	 */
     //2013.08.28 no more copying of input data. to reduce memory usage.
 	//normalized_data_array = inputDataArray;
 
@@ -1392,9 +1382,23 @@ long BaseGADA::SBLandBE() {
 	ymean = ymean / _M_total_length;
 	for (i = 0; i < _M_total_length; ++i)
 		normalized_data_array[i] = normalized_data_array[i] - ymean;
+}
 
+long BaseGADA::SBLWithoutBE() {
+	/*
+	 * SBL part of SBLandBE(). Iext/Wext hold the breakpoints found by SBL in extended notation.
+	 */
+	//double convergenceDelta, convergenceMaxAlpha, convergenceB;
+	//long maxNoOfIterations;
+	// SBL optimization parameters
+	//convergenceDelta = 1E-10; //1E-10 or 1E-8 seems to work well for this parameter. -- => ++ conv time
+	//convergenceMaxAlpha = 1E8; //1E8 better than 1E10 seems to work well for this parameter. -- => -- conv time
+	//maxNoOfIterations = 100000; //Maximum number of iterations to reach convergence...
+	//convergenceB = 1E-20; //
+	//sigma2 = *Psigma2;
+	NormalizeInputData();
 
-
+	long i;
 	//Call to SBL
 	if (debug){
 		std::cerr << "_SBLBE_ Memory initialization\n";
@@ -1435,6 +1439,11 @@ long BaseGADA::SBLandBE() {
 	//for(i=K;i>0;i++)
 	//	Wext[i]=Wext[i-1];
 	Wext[0] = ymean;
+	return K;
+}
+
+long BaseGADA::SBLandBE() {
+	SBLWithoutBE();
 
 	if (debug){
 		std::cerr << "_SBLBE_ Backward Elimination T=" << T << " MinSegLen=" << MinSegLen << std::endl;
@@ -1459,6 +1468,321 @@ long BaseGADA::SBLandBE() {
 	return K;
 }
 
+long BaseGADA::BEOnBreakpoints(const vector<long> &breakpointVector) {
+	/*
+	 * Backward elimination (T, MinSegLen) over the whole input, starting from the given
+	 * 	candidate breakpoints instead of the SBL ones. A breakpoint is the index of the first
+	 * 	data point of a new segment (as in Iext). Their weights are refitted by least squares.
+	 * 	numEMsteps and noOfBreakpointsAfterSBL are left to the caller.
+	 */
+	long k;
+	if (normalized_data_array == NULL) {
+		NormalizeInputData();
+	}
+	vector<long> sortedBreakpointVector;
+	for (k = 0; k < (long) breakpointVector.size(); k++) {
+		if (breakpointVector[k] > 0 && breakpointVector[k] < _M_total_length) {
+			sortedBreakpointVector.push_back(breakpointVector[k]);
+		}
+	}
+	std::sort(sortedBreakpointVector.begin(), sortedBreakpointVector.end());
+	sortedBreakpointVector.erase(std::unique(sortedBreakpointVector.begin(), sortedBreakpointVector.end()),
+			sortedBreakpointVector.end());
+
+	K = sortedBreakpointVector.size();
+	Iext = (long*) calloc(K + 2, sizeof(long));
+	Wext = (double*) calloc(K + 1, sizeof(double));
+	Iext[0] = 0;
+	for (k = 0; k < K; k++) {
+		Iext[k + 1] = sortedBreakpointVector[k];
+	}
+	Iext[K + 1] = _M_total_length;
+	if (K > 0) {
+		ProjectCoeff(normalized_data_array, _M_total_length, Iext, K, Wext);
+	}
+	Wext[0] = ymean;
+
+	if (debug){
+		std::cerr << "_BEOnBreakpoints_ Backward Elimination K=" << K << " T=" << T << " MinSegLen=" << MinSegLen << std::endl;
+	}
+	if (K > 0) {
+		BEwTandMinLen(Wext, Iext, &K, sigma2, T, MinSegLen, debug);
+		Iext = (long*) realloc(Iext, (K + 2) * sizeof(long));
+		Wext = (double *) realloc(Wext, (K + 1) * sizeof(double));
+	}
+	return K;
+}
+
+long BaseGADA::SBLOnRegion(long start, long stop, vector<long> &breakpointVector, double &maxDelta) {
+	/*
+	 * SBL (no BE) at full resolution on data points [start, stop), with the sigma2 of the whole input.
+	 * 	Breakpoints (Iext notation, of the whole input) are appended to breakpointVector.
+	 * 	Returns the number of EM iterations. Only reads members, so it can run in parallel.
+	 */
+	long k;
+	if (stop - start < 3) {
+		return 0;
+	}
+	BaseGADA regionGADA(inputDataArray + start, stop - start, sigma2, BaseAmp, a, T, MinSegLen,
+			0, convergenceDelta, maxNoOfIterations, convergenceMaxAlpha, convergenceB, reportIntervalDuringBE);
+	regionGADA.SBLWithoutBE();
+	for (k = 1; k <= regionGADA.K; k++) {
+		breakpointVector.push_back(start + regionGADA.Iext[k]);
+	}
+	maxDelta = std::max(maxDelta, regionGADA.delta);
+	regionGADA.FreeArrays();
+	return regionGADA.numEMsteps;
+}
+
+long BaseGADA::SBLOnRegions(vector<std::pair<long, long> > &regionVector, vector<long> &breakpointVector) {
+	/*
+	 * SBLOnRegion() on each region [start, stop). Regions are clipped to the input, sorted,
+	 * 	and merged if they overlap. Returns the total number of EM iterations. delta is the max.
+	 */
+	long j, totalNumEMsteps = 0;
+	vector<std::pair<long, long> > mergedRegionVector;
+	std::sort(regionVector.begin(), regionVector.end());
+	for (j = 0; j < (long) regionVector.size(); j++) {
+		long start = std::max(regionVector[j].first, 0L);
+		long stop = std::min(regionVector[j].second, _M_total_length);
+		if (!mergedRegionVector.empty() && start <= mergedRegionVector.back().second) {
+			mergedRegionVector.back().second = std::max(mergedRegionVector.back().second, stop);
+		}
+		else {
+			mergedRegionVector.push_back(std::make_pair(start, stop));
+		}
+	}
+	regionVector = mergedRegionVector;
+	for (j = 0; j < (long) regionVector.size(); j++) {
+		totalNumEMsteps += SBLOnRegion(regionVector[j].first, regionVector[j].second, breakpointVector, delta);
+	}
+	return totalNumEMsteps;
+}
+
+long BaseGADA::CoarseToFineSBLandBE(long coarseBinSize, long flankLength) {
+	/*
+	 * Coarse-to-fine SBLandBE() for long inputs (small windows):
+	 * 	1. SBL on the medians of consecutive bins of coarseBinSize data points.
+	 * 	2. SBL at full resolution only within flankLength (default max(4*coarseBinSize, 100))
+ * 		data points around each coarse
+	 * 		breakpoint (overlapping neighbourhoods are merged).
+	 * 	3. backward elimination (T, MinSegLen) over the whole input on the union of the
+	 * 		refined breakpoints.
+	 * 	sigma2 is estimated (if negative) on the full-resolution data and used in steps 2 and 3.
+	 * 	Falls back to SBLandBE() if there are too few bins.
+	 */
+	long k;
+	if (flankLength <= 0) {
+		//SBL needs enough data on both sides of a breakpoint to place it as precisely
+		//	as at full resolution. 2 bins are not enough for small bins.
+		flankLength = std::max(4 * coarseBinSize, 100L);
+	}
+	long noOfBins = (_M_total_length + coarseBinSize - 1) / coarseBinSize;
+	if (coarseBinSize <= 1 || noOfBins < 3) {
+		return SBLandBE();
+	}
+	NormalizeInputData();
+
+	vector<double> binnedDataVector(noOfBins);
+	vector<double> binVector;
+	for (k = 0; k < noOfBins; k++) {
+		binVector.assign(inputDataArray + k * coarseBinSize,
+				inputDataArray + std::min((k + 1) * coarseBinSize, _M_total_length));
+		std::nth_element(binVector.begin(), binVector.begin() + binVector.size() / 2, binVector.end());
+		binnedDataVector[k] = binVector[binVector.size() / 2];
+	}
+	BaseGADA coarseGADA(binnedDataVector.data(), noOfBins, -1, BaseAmp, a, T, MinSegLen / coarseBinSize,
+			debug, convergenceDelta, maxNoOfIterations, convergenceMaxAlpha, convergenceB, reportIntervalDuringBE);
+	coarseGADA.SBLWithoutBE();
+	numEMsteps = coarseGADA.numEMsteps;
+	delta = coarseGADA.delta;
+	if (debug) {
+		std::cerr << boost::format("_CoarseToFine_ %1% breakpoints after SBL on %2% bins of %3% data points.\n") %
+				coarseGADA.K % noOfBins % coarseBinSize;
+	}
+
+	//neighbourhoods [start, stop) around coarse breakpoints.
+	vector<std::pair<long, long> > regionVector;
+	for (k = 1; k <= coarseGADA.K; k++) {
+		regionVector.push_back(std::make_pair(coarseGADA.Iext[k] * coarseBinSize - flankLength,
+				coarseGADA.Iext[k] * coarseBinSize + flankLength));
+	}
+	coarseGADA.FreeArrays();
+
+	vector<long> breakpointVector;
+	numEMsteps += SBLOnRegions(regionVector, breakpointVector);
+	noOfBreakpointsAfterSBL = breakpointVector.size();
+	if (debug) {
+		std::cerr << boost::format("_CoarseToFine_ %1% breakpoints after SBL within %2% regions.\n") %
+				noOfBreakpointsAfterSBL % regionVector.size();
+	}
+	return BEOnBreakpoints(breakpointVector);
+}
+
+long BaseGADA::WarmStartSBLandBE(const vector<long> &initBreakpointVector, long flankLength) {
+	/*
+	 * Re-segmentation seeded by the breakpoints of a previous run (Iext notation), i.e. after
+	 * 	a sequencing top-up. SBL runs at full resolution only
+	 * 	1. within flankLength (default max(2*MinSegLen, 100)) data points around each previous
+	 * 		breakpoint, to move or drop it.
+	 * 	2. on the whole of a previous segment that does not look homogeneous any more, to add
+	 * 		breakpoints. A segment is re-run if its max t-score, |mean1-mean2|/sqrt(1/n1+1/n2) as in
+	 * 		ComputeTScores(), is above T/2 for either
+	 * 		a. one split into two parts (both >=MinSegLen), i.e. a new step at one end, or
+	 * 		b. two splits into an interval (>=MinSegLen) and the rest, as in circular binary
+	 * 			segmentation, i.e. a new focal event in the middle, which a single split misses.
+	 * 			Interval lengths are scanned on a geometric grid (x1.25), so an interval is
+	 * 			covered by one >=80% of its length, at all positions.
+	 * 	then backward elimination (T, MinSegLen) over the whole input.
+	 */
+	long k, i;
+	if (flankLength <= 0) {
+		flankLength = std::max(2 * MinSegLen, 100L);
+	}
+	NormalizeInputData();
+	vector<long> segmentBoundaryVector(1, 0);
+	for (k = 0; k < (long) initBreakpointVector.size(); k++) {
+		if (initBreakpointVector[k] > 0 && initBreakpointVector[k] < _M_total_length) {
+			segmentBoundaryVector.push_back(initBreakpointVector[k]);
+		}
+	}
+	std::sort(segmentBoundaryVector.begin(), segmentBoundaryVector.end());
+	segmentBoundaryVector.erase(std::unique(segmentBoundaryVector.begin(), segmentBoundaryVector.end()),
+			segmentBoundaryVector.end());
+	segmentBoundaryVector.push_back(_M_total_length);
+
+	vector<std::pair<long, long> > regionVector;
+	vector<double> cumulativeSumVector;
+	long noOfChangedSegments = 0;
+	for (k = 0; k < (long) segmentBoundaryVector.size() - 1; k++) {
+		long start = segmentBoundaryVector[k];
+		long stop = segmentBoundaryVector[k + 1];
+		if (k > 0) {
+			regionVector.push_back(std::make_pair(start - flankLength, start + flankLength));
+		}
+		long n = stop - start;
+		if (n < 2) {
+			continue;
+		}
+		//cumulativeSumVector[i-start] is the sum of [start, i).
+		cumulativeSumVector.assign(n + 1, 0);
+		for (i = start; i < stop; i++) {
+			cumulativeSumVector[i - start + 1] = cumulativeSumVector[i - start] + normalized_data_array[i];
+		}
+		double sum = cumulativeSumVector[n], mean = sum / n, maxTScore = 0;
+		for (i = start + 1; i < stop; i++) {
+			double leftSum = cumulativeSumVector[i - start];
+			long n1 = i - start, n2 = stop - i;
+			if (n1 < MinSegLen || n2 < MinSegLen) {
+				continue;
+			}
+			double tscore = fabs(leftSum / n1 - (sum - leftSum) / n2) / sqrt(1.0 / n1 + 1.0 / n2);
+			maxTScore = std::max(maxTScore, tscore);
+		}
+		//for a fixed interval length m, the t-score is |intervalSum - m*mean|*sqrt(n/(m*(n-m))).
+		for (long m = std::max(MinSegLen, 1L); m < n; m = std::max(m + 1, (long) (m * 1.25))) {
+			double maxDeviation = 0;
+			for (i = 0; i + m <= n; i++) {
+				maxDeviation = std::max(maxDeviation,
+						fabs(cumulativeSumVector[i + m] - cumulativeSumVector[i] - m * mean));
+			}
+			maxTScore = std::max(maxTScore, maxDeviation * sqrt((double) n / (m * (double) (n - m))));
+		}
+		if (maxTScore > 0.5 * T * sqrt(sigma2)) {
+			regionVector.push_back(std::make_pair(start - flankLength, stop + flankLength));
+			noOfChangedSegments++;
+		}
+	}
+	vector<long> breakpointVector;
+	numEMsteps = SBLOnRegions(regionVector, breakpointVector);
+	noOfBreakpointsAfterSBL = breakpointVector.size();
+	if (debug) {
+		std::cerr << boost::format("_WarmStart_ %1% initial breakpoints, %2% segments re-run in full, "
+				"%3% breakpoints after SBL within %4% regions.\n") %
+				(segmentBoundaryVector.size() - 2) % noOfChangedSegments % noOfBreakpointsAfterSBL % regionVector.size();
+	}
+	return BEOnBreakpoints(breakpointVector);
+}
+
+long BaseGADA::ChunkedSBLandBE(long chunkSize, long overlapLength, int noOfThreads) {
+	/*
+	 * Divide-and-conquer SBLandBE() for long chromosomes:
+	 * 	1. the input is cut into chunks of chunkSize data points. Each chunk is extended by
+	 * 		overlapLength data points on both sides and SBL runs on it, noOfThreads chunks at a time.
+	 * 	2. a chunk keeps only the breakpoints within its own (not extended) part, so a breakpoint
+	 * 		in an overlap zone comes from the chunk that sees it with context on both sides.
+	 * 	3. backward elimination (T, MinSegLen) over the whole input, across chunk boundaries.
+	 * 	SBL memory is bounded by the chunk size. sigma2 is estimated (if negative) on the whole input.
+	 * 	Falls back to SBLandBE() if there is only one chunk.
+	 */
+	long c;
+	if (overlapLength <= 0) {
+		overlapLength = std::max(chunkSize / 10, 1000L);
+	}
+	long noOfChunks = chunkSize > 0 ? (_M_total_length + chunkSize - 1) / chunkSize : 1;
+	if (noOfChunks < 2) {
+		return SBLandBE();
+	}
+	NormalizeInputData();
+
+	vector<vector<long> > chunkBreakpointVector(noOfChunks);
+	vector<long> chunkNumEMStepsVector(noOfChunks, 0);
+	vector<double> chunkDeltaVector(noOfChunks, 0);
+	std::atomic<long> nextChunkIndex(0);
+	vector<std::thread> threadVector;
+	for (int t = 0; t < std::max(noOfThreads, 1); t++) {
+		threadVector.push_back(std::thread([&]() {
+			long chunkIndex;
+			while ((chunkIndex = nextChunkIndex++) < noOfChunks) {
+				long coreStart = chunkIndex * chunkSize;
+				long coreStop = std::min(coreStart + chunkSize, _M_total_length);
+				vector<long> breakpointVector;
+				chunkNumEMStepsVector[chunkIndex] = SBLOnRegion(std::max(coreStart - overlapLength, 0L),
+						std::min(coreStop + overlapLength, _M_total_length), breakpointVector,
+						chunkDeltaVector[chunkIndex]);
+				for (long b : breakpointVector) {
+					if (b >= coreStart && b < coreStop) {
+						chunkBreakpointVector[chunkIndex].push_back(b);
+					}
+				}
+			}
+		}));
+	}
+	for (std::thread &oneThread : threadVector) {
+		oneThread.join();
+	}
+
+	vector<long> breakpointVector;
+	numEMsteps = 0;
+	delta = 0;
+	for (c = 0; c < noOfChunks; c++) {
+		breakpointVector.insert(breakpointVector.end(), chunkBreakpointVector[c].begin(),
+				chunkBreakpointVector[c].end());
+		numEMsteps += chunkNumEMStepsVector[c];
+		delta = std::max(delta, chunkDeltaVector[c]);
+	}
+	noOfBreakpointsAfterSBL = breakpointVector.size();
+	if (debug) {
+		std::cerr << boost::format("_Chunked_ %1% breakpoints after SBL in %2% chunks of %3% (+%4% overlap) data points.\n") %
+				noOfBreakpointsAfterSBL % noOfChunks % chunkSize % overlapLength;
+	}
+	return BEOnBreakpoints(breakpointVector);
+}
+
+void BaseGADA::FreeArrays() {
+	//arrays allocated by SBLandBE() and alike. SegLen/SegAmp/SegState are left to the caller.
+	free(Iext);
+	free(Wext);
+	free(normalized_data_array);
+	free(_alpha_array);
+	free(_aux_array);
+	Iext = NULL;
+	Wext = NULL;
+	normalized_data_array = NULL;
+	_alpha_array = NULL;
+	_aux_array = NULL;
+}
+
 /**************************************************************************************************************************/
 long BaseGADA::BEwTandMinLen( //Returns breakpoint list length. with T and MinSegLen
 		double *Wext, //IO Breakpoint weights extended notation...
@@ -1503,9 +1827,7 @@ long BaseGADA::BEwTandMinLen( //Returns breakpoint list length. with T and MinSe
 		std::cerr << boost::format("_BEwTandMinLen_() finished. number of breakpoints=%1% \n") % K;
 	}
 
-	//Do not free tscore_local as it will trigger memory free error during program exit. 
-	//  tscore_local is realloc-ed in BEwTscore().
-	//free(tscore_local); 
+	free(tscore_local);
 
 	*pK = K;
 	return K;
@@ -1539,14 +1861,21 @@ long BaseGADA::BEwTscore(double *Wext, //IO Breakpoint weights extended notation
 	rbNodeType* currentNodePtr=rbTree.nil;
 	rbNodeType* genomeLeftNodePtr=rbTree.nil;
 	rbNodeType* genomeRightNodePtr=rbTree.nil;
-	BreakPoint *leftMostBreakPointPtr = new BreakPoint(Iext[0], Wext[0], tscore_array[0], 0, MinSegLen, T, Iext[K+1]);
+	//all break points in one block (one allocation instead of K), freed when BE is done.
+	//	reserved upfront so that pointers into it stay valid.
+	vector<BreakPoint> breakPointStorage;
+	breakPointStorage.reserve(K + 2);
+	breakPointStorage.push_back(BreakPoint(Iext[0], Wext[0], tscore_array[0], 0, MinSegLen, T, Iext[K+1]));
+	BreakPoint *leftMostBreakPointPtr = &breakPointStorage.back();
 	leftMostBreakPointPtr->nodePtr = rbTree.nil;
-	BreakPoint *rightMostBreakPointPtr = new BreakPoint(Iext[K+1], 0, 0, 0, MinSegLen, T, Iext[K+1]);
+	breakPointStorage.push_back(BreakPoint(Iext[K+1], 0, 0, 0, MinSegLen, T, Iext[K+1]));
+	BreakPoint *rightMostBreakPointPtr = &breakPointStorage.back();
 	rightMostBreakPointPtr->nodePtr = rbTree.nil;
 	int maxBPSetSize =0;
 	for (i = 1; i < K + 1; i++){
 		long segLength = min(Iext[i]-Iext[i-1],Iext[i+1]-Iext[i]);	//shorter of two neighboring segments as length for the breakpoint
-		BreakPoint* bpPtr = new BreakPoint(Iext[i], Wext[i], tscore_array[i], segLength, MinSegLen, T, Iext[K+1]);
+		breakPointStorage.push_back(BreakPoint(Iext[i], Wext[i], tscore_array[i], segLength, MinSegLen, T, Iext[K+1]));
+		BreakPoint* bpPtr = &breakPointStorage.back();
 		BreakPointKey bpKey = bpPtr->getKey();
 		//cerr<< *bpPtr << endl;
 		//cerr << boost::format("i=%1%, tree size=%2%, tree valid=%3%")% i % rbTree.size() % rbTree.isValidRedBlackTree() << endl;
@@ -1629,6 +1958,7 @@ long BaseGADA::BEwTscore(double *Wext, //IO Breakpoint weights extended notation
 				genomeLeftNodePtr->getDataPtr()->erase(leftBreakPointPtr);
 				if (genomeLeftNodePtr->getDataPtr()->size()==0){
 					//delete this node altogether if its vector is empty
+					delete genomeLeftNodePtr->getDataPtr();
 					rbTree.deleteNode(genomeLeftNodePtr);
 				}
 				//new genomeLeftNodePtr that matches the new key
@@ -1646,6 +1976,7 @@ long BaseGADA::BEwTscore(double *Wext, //IO Breakpoint weights extended notation
 				genomeRightNodePtr->getDataPtr()->erase(rightBreakPointPtr);
 				if (genomeRightNodePtr->getDataPtr()->size()==0){
 					//delete this node altogether if its vector is empty
+					delete genomeRightNodePtr->getDataPtr();
 					rbTree.deleteNode(genomeRightNodePtr);
 				}
 				//new genomeRightNodePtr that matches the new key
@@ -1658,7 +1989,7 @@ long BaseGADA::BEwTscore(double *Wext, //IO Breakpoint weights extended notation
 				rightBreakPointPtr->nodePtr = genomeRightNodePtr;
 			}
 		}
-		(*setOfBPPtr).clear();
+		delete setOfBPPtr;
 		//delete this minimum node after its data is all tossed out
 		rbTree.deleteNode(minNodePtr);
 
@@ -1686,44 +2017,36 @@ long BaseGADA::BEwTscore(double *Wext, //IO Breakpoint weights extended notation
 	}
 
 	// convert data back to old data structures
-	K = rbTree.noOfNodes();	//update the number of break points
-	vector<BreakPoint> breakPointVector;
-	breakPointVector.push_back(*leftMostBreakPointPtr);	//add this first
+	//	collect pointers (not copies) of the remaining break points, and sort them by position.
+	vector<BreakPoint*> breakPointPtrVector;
+	breakPointPtrVector.reserve(rbTree.noOfNodes() + 2);
+	breakPointPtrVector.push_back(leftMostBreakPointPtr);	//add this first
 	while (rbTree.noOfNodes()>0){
 		minNodePtr = rbTree.getMinimum();
 		setOfBPPtr = minNodePtr->getDataPtr();
 		for (setOfBPIterator =(*setOfBPPtr).begin(); setOfBPIterator!=(*setOfBPPtr).end(); setOfBPIterator++){
-			breakPointVector.push_back(**setOfBPIterator);
+			breakPointPtrVector.push_back(*setOfBPIterator);
 		}
+		delete setOfBPPtr;
 		rbTree.deleteNode(minNodePtr);
 	}
-	breakPointVector.push_back(*rightMostBreakPointPtr);	//add the right most.
 	if (debug){
-		cerr << boost::format("breakPointVector size=%1%, noOfNodesInTree=%2%, tree size=%3%, tree valid=%4%")%
-				breakPointVector.size() % rbTree.noOfNodes() % rbTree.size() % rbTree.isValidRedBlackTree() << endl;
-	}
-	//sort all the breakpoints in the tree by chromosomal position, reconstruct Iext, Wext, tscore, pK
-	sort(breakPointVector.begin(),breakPointVector.end());
-		/*
-		 * a c++0x sorting lambda function, not universally accepted
-		 	[](const BreakPoint& a, const BreakPoint& convergenceB) -> bool
-			{return a.position < b.position;});
-		 *
-		 */
+		cerr << boost::format("breakPointPtrVector size=%1%, noOfNodesInTree=%2%, tree valid=%3%")%
+				breakPointPtrVector.size() % rbTree.noOfNodes() % rbTree.isValidRedBlackTree() << endl;
+	}
+	//sort all the remaining breakpoints by chromosomal position, reconstruct Iext, Wext, tscore, pK
+	//	the left-most one (position 0) stays first.
+	sort(breakPointPtrVector.begin() + 1, breakPointPtrVector.end(),
+			[](const BreakPoint* a, const BreakPoint* b) -> bool {return a->position < b->position;});
+	K = breakPointPtrVector.size() - 1;	//update the number of break points
 	for (i=1; i<K+1; i++){
-		Wext[i]=breakPointVector[i].weight;
-		Iext[i]=breakPointVector[i].position;
-		tscore_array[i]=breakPointVector[i].tscore;
+		Wext[i]=breakPointPtrVector[i]->weight;
+		Iext[i]=breakPointPtrVector[i]->position;
+		tscore_array[i]=breakPointPtrVector[i]->tscore;
 	}
 	Iext[K+1] = leftMostBreakPointPtr->totalLength;
-	Iext = (long*) realloc(Iext, (K + 2) * sizeof(long));
-	Wext = (double *) realloc(Wext, (K + 1) * sizeof(double));
-	tscore_array = (double *) realloc(tscore_array, (K + 1) * sizeof(double));
-
-	//free(leftMostBreakPointPtr);
-	//free(rightMostBreakPointPtr);
-	leftBreakPointPtr = NULL;
-	rightMostBreakPointPtr = NULL;
+	//Iext/Wext/tscore_array are shrunk by the caller. Reallocating these local copies
+	//	of the pointers here would leave the caller with dangling pointers.
 	*pK = K;
 	return K;
 }
@@ -42,6 +42,8 @@
 #include <vector>
 #include <map>	//for hash_map
 #include <set>	//for set
+#include <thread>
+#include <atomic>
 #include <functional>	//2013.09.11 for customize hash
 #include <boost/functional/hash.hpp>	//2013.09.10 yh: for customize boost::hash
 #include <boost/algorithm/string.hpp>
@@ -391,6 +393,13 @@ public:
 			maxNoOfIterations (_maxNoOfIterations), convergenceMaxAlpha(_convergenceMaxAlpha),
 			convergenceB(_convergenceB), reportIntervalDuringBE(_reportIntervalDuringBE){
 		noOfBreakpointsAfterSBL = 0;
+		numEMsteps = 0;
+		delta = 0;
+		Iext = NULL;
+		Wext = NULL;
+		normalized_data_array = NULL;
+		_alpha_array = NULL;
+		_aux_array = NULL;
 	}
 	~BaseGADA(){
 		//free(SegLen);
@@ -446,6 +455,19 @@ public:
 			long *pointNumRem, double *pointTau);
 	//Returns breakpoint list lenght.
 	long SBLandBE();
+	void NormalizeInputData();
+	long SBLWithoutBE();
+	//BE over the whole input from given candidate breakpoints (Iext notation).
+	long BEOnBreakpoints(const vector<long> &breakpointVector);
+	//SBL on binned data first, then at full resolution around the coarse breakpoints only.
+	long CoarseToFineSBLandBE(long coarseBinSize, long flankLength=0);
+	//SBL on overlapping chunks in parallel, then BE across chunk boundaries.
+	long ChunkedSBLandBE(long chunkSize, long overlapLength=0, int noOfThreads=1);
+	long SBLOnRegion(long start, long stop, vector<long> &breakpointVector, double &maxDelta);
+	long SBLOnRegions(vector<std::pair<long, long> > &regionVector, vector<long> &breakpointVector);
+	//SBL only around the breakpoints of a previous run and in segments that changed.
+	long WarmStartSBLandBE(const vector<long> &initBreakpointVector, long flankLength=0);
+	void FreeArrays();
 
 	void Project(double *y, long M_total_length, long *I, long L, double *xI, double *wI);
 	void IextToSegLen();
@@ -19,7 +19,9 @@
 
  */
 #include <boost/program_options.hpp>  //for program options
-#include <boost/tokenizer.hpp>
+#include <atomic>
+#include <sstream>
+#include <thread>
 #include "BaseGADA.h"
 #include "read_para.h"
 
@@ -27,7 +29,77 @@ using namespace std;
 using namespace boost;
 namespace po = boost::program_options;
 
-typedef boost::tokenizer<boost::char_separator<char> > tokenizerCharType;	//to break a line into list by some delimiter
+void readRatioFile(const string &input_file_path, vector<long> &chr_start_pos_vector,
+                   vector<double> &ratio_vector, int no_of_threads = 1)
+{
+    /*
+     * read the start and ratio columns of a normalize output csv (plain or gzipped)
+     *  into exact-sized vectors. The whole file is decompressed into memory and parsed
+     *  in place. Reading stops at the first empty line.
+     */
+    string content = read_whole_file(input_file_path, no_of_threads);
+
+    long no_of_lines = std::count(content.begin(), content.end(), '\n') + 1;
+    chr_start_pos_vector.clear();
+    ratio_vector.clear();
+    chr_start_pos_vector.reserve(no_of_lines);
+    ratio_vector.reserve(no_of_lines);
+
+    const char *p = content.c_str();
+    const char *content_end = p + content.size();
+    while (p < content_end && *p != '\n') {
+        const char *line_end = (const char *) memchr(p, '\n', content_end - p);
+        if (line_end == NULL) {
+            line_end = content_end;
+        }
+        if (*p != '#' && strncmp(p, "start", 5) != 0) {
+            char *field_end;
+            long start = strtol(p, &field_end, 10);
+            if (field_end < line_end && *field_end == ',') {
+                chr_start_pos_vector.push_back(start);
+                ratio_vector.push_back(strtod(field_end + 1, NULL));
+            }
+        }
+        p = line_end + 1;
+    }
+    chr_start_pos_vector.shrink_to_fit();
+    ratio_vector.shrink_to_fit();
+}
+
+void readSegmentStartsFile(const string &input_file_path,
+                           std::map<string, vector<long> > &chr2segment_start_vector)
+{
+    /*
+     * segment start positions per chromosome of a previous GADA output (i.e. all_segments.tsv.gz):
+     *  chromosome, start, stop, ... Comment lines start with #.
+     */
+    std::istringstream inputStream(read_whole_file(input_file_path));
+    string line;
+    while (std::getline(inputStream, line)) {
+        if (line.empty() || line[0] == '#') {
+            continue;
+        }
+        std::istringstream lineStream(line);
+        string chromosome_id;
+        long start;
+        if (lineStream >> chromosome_id >> start) {
+            chr2segment_start_vector[chromosome_id].push_back(start);
+        }
+    }
+}
+
+vector<long> segmentStartsToBreakpoints(const vector<long> &segment_start_vector,
+                                        const vector<long> &chr_start_pos_vector)
+{
+    // the index of the first window at or after each segment start, as in BaseGADA::Iext.
+    vector<long> breakpoint_vector;
+    for (long segment_start : segment_start_vector) {
+        breakpoint_vector.push_back(
+            std::lower_bound(chr_start_pos_vector.begin(), chr_start_pos_vector.end(), segment_start) -
+            chr_start_pos_vector.begin());
+    }
+    return breakpoint_vector;
+}
 
 class GADA
 {
@@ -43,6 +115,7 @@ class GADA
 
     long input_array_len;
     double *input_array;
+    std::vector<double> input_vector;
     string chromosome_id;
     std::vector<long> chr_start_pos_vector;
 
@@ -76,14 +149,22 @@ class GADA
     int window_size;
 
     string input_file_path;
+    std::vector<string> input_file_path_vector;
     string output_file_path;
+    int batch;
+    int no_of_threads;
+    long coarse_bin_size;
+    long coarse_flank_length;
+    long chunk_size;
+    long chunk_overlap_length;
+    string init_breakpoints_file_path;
+    std::map<string, vector<long> > chr2init_segment_start_vector;
 
     GADA(int _argc, char *_argv[]);  // 2013.08.28 commandline version
 
     virtual ~GADA()
     {
         chr_start_pos_vector.clear();
-        free(input_array);
         // free(SegState);	//2013.08.30 SegState is not always allocated
         // with extra memory
     }
@@ -113,6 +194,15 @@ class GADA
 
     virtual void openOutputFile();
     virtual void closeFiles();
+    void outputParameterComments(std::ostream &outputStream, BaseGADA &baseGADA);
+    void outputSegments(std::ostream &outputStream, BaseGADA &baseGADA,
+                        const string &chromosome_id, const vector<long> &chr_start_pos_vector,
+                        double *ratio_array);
+    void runSBLandBE(BaseGADA &baseGADA, const string &chromosome_id,
+                     const vector<long> &chr_start_pos_vector, int no_of_chunk_threads);
+    string segmentOneChr(const string &chromosome_id, const string &input_file_path,
+                         int no_of_chunk_threads);
+    void runBatch();
     void run();
 
 };
@@ -134,8 +224,9 @@ GADA::GADA(int _argc, char *_argv[]) : argc(_argc), argv(_argv)
                   programName;
 
 
-    input_array_len = 1000;
-    input_array = (double *)calloc(input_array_len, sizeof(double));
+    input_array_len = 0;
+    input_array = NULL;
+    batch = 0;
 
 }
 
@@ -193,11 +284,37 @@ void GADA::constructOptionDescriptionStructure()
              "how often to report the break point to be removed during backward "
                      "elimination")
             ("chromosome_id", po::value<string>(&chromosome_id)->default_value("hello"), "chromosome ID for the input data")
-            ("input_file_path,i", po::value<string>(&input_file_path),
+            ("input_file_path,i", po::value<vector<string> >(&input_file_path_vector),
              "input file path, csv file, gzipped or plain. Comment lines start with #."
                      " 4 columns with a header start,tumor_read_count,normal_read_count,read_count_ratio."
-                     " This file can be an option or a positional argument.")
+                     " This file can be an option or a positional argument."
+                     " In --batch mode, one file per chromosome.")
             ("output_file_path,o", po::value<string>(&output_file_path), "output filepath")
+            ("batch", "segment all input files (one per chromosome, chromosome ID is the file"
+                     " name up to the first '.') in one process and write one combined output,"
+                     " i.e. all_segments.tsv.gz, in input order.")
+            ("threads,t", po::value<int>(&no_of_threads)->default_value(4),
+             "total number of threads. --batch segments chromosomes in parallel and, with --chunk_size,"
+                     " splits what is left per chromosome among its chunks.")
+            ("coarse_bin_size", po::value<long>(&coarse_bin_size)->default_value(0),
+             "coarse-to-fine mode if >1: SBL first on the medians of bins of this many data points,"
+                     " then at full resolution only around the coarse breakpoints, followed by"
+                     " backward elimination over the whole chromosome. 10-50 for small windows.")
+            ("coarse_flank_length", po::value<long>(&coarse_flank_length)->default_value(0),
+             "number of data points on each side of a coarse breakpoint to re-run SBL on."
+                     " 0 means max(4*coarse_bin_size, 100).")
+            ("chunk_size", po::value<long>(&chunk_size)->default_value(0),
+             "if >0, cut a chromosome into chunks of this many data points, run SBL on the chunks"
+                     " in parallel (--threads) and backward elimination across chunk boundaries."
+                     " Bounds SBL time and memory of long chromosomes. i.e. 200000.")
+            ("chunk_overlap_length", po::value<long>(&chunk_overlap_length)->default_value(0),
+             "number of data points a chunk is extended by on each side for SBL."
+                     " 0 means max(chunk_size/10, 1000).")
+            ("init_breakpoints", po::value<string>(&init_breakpoints_file_path),
+             "warm start from the segments of a previous run (i.e. all_segments.tsv.gz or a"
+                     " single-chromosome output of the same windows). SBL only re-runs around"
+                     " their breakpoints and within segments that are no longer homogeneous."
+                     " Chromosomes not in the file are segmented from scratch.")
             ("window_size", po::value<int>(&window_size)->default_value(500), "the windows size used in GC normalization");
 }
 
@@ -215,7 +332,7 @@ void GADA::parseCommandlineOptions()
     // po::store(po::parse_command_line(argc, argv, optionDescription),
     // optionVariableMap);
     po::notify(optionVariableMap);
-    if (optionVariableMap.count("help") || input_file_path.empty() ||
+    if (optionVariableMap.count("help") || input_file_path_vector.empty() ||
         output_file_path.empty())
     {
         cout << "Usage:" << endl << usageDoc << endl;
@@ -232,6 +349,25 @@ void GADA::parseCommandlineOptions()
     {
         debug = 0;
     }
+    input_file_path = input_file_path_vector[0];
+    if (optionVariableMap.count("batch"))
+    {
+        batch = 1;
+    }
+    else if (input_file_path_vector.size() > 1)
+    {
+        cerr << "ERROR: more than one input file needs --batch." << endl;
+        exit(1);
+    }
+    if ((chunk_size > 0) + (coarse_bin_size > 1) + (!init_breakpoints_file_path.empty()) > 1)
+    {
+        cerr << "ERROR: only one of --chunk_size, --coarse_bin_size and --init_breakpoints can be used." << endl;
+        exit(1);
+    }
+    if (!init_breakpoints_file_path.empty())
+    {
+        readSegmentStartsFile(init_breakpoints_file_path, chr2init_segment_start_vector);
+    }
     if (optionVariableMap.count("report"))
     {
         report = 1;
@@ -262,40 +398,9 @@ void GADA::openOneInputFile(
 
 void GADA::readInputFile() {
     std::cerr << "Reading data from " << input_file_path << " ... ";
-    openOneInputFile(input_file_path, inputFilterStreamBuffer);
-    std::istream inputStream(&inputFilterStreamBuffer);
-
-    boost::char_separator<char> sep(",");		//csv
-
-    long array_moving_index = 0;
-    int columnMovingIndex;
-    string statInStr;
-    std::string line;
-    std::getline(inputStream, line);
-    while (!line.empty())
-    {
-        if ( line.compare(0, 1, "#")!=0 && line.compare(0, 5, "start")!=0 ) {
-            tokenizerCharType line_toks(line, sep);
-            columnMovingIndex = 0;
-            for(tokenizerCharType::iterator it = line_toks.begin(), ite = line_toks.end(); it!=ite; ++it) {
-                statInStr = *it;
-                if (columnMovingIndex==0){
-                    chr_start_pos_vector.push_back(atol(statInStr.c_str()));
-                }
-                else if (columnMovingIndex==1) {
-                    input_array[array_moving_index++] = atof(statInStr.c_str());
-                    if (array_moving_index >= input_array_len) {
-                        input_array_len = input_array_len + 10000;
-                        input_array = (double *) realloc(input_array, input_array_len * sizeof(double));
-                    }
-                }
-                columnMovingIndex++;
-            }
-        }
-        std::getline(inputStream, line);
-    }
-    input_array_len = array_moving_index;
-    input_array = (double *)realloc(input_array, input_array_len * sizeof(double));
+    readRatioFile(input_file_path, chr_start_pos_vector, input_vector, no_of_threads);
+    input_array = input_vector.data();
+    input_array_len = input_vector.size();
     std::cerr << input_array_len << " data points for chromosome " << chromosome_id << "." << endl;
 }
 
@@ -352,10 +457,168 @@ void GADA::closeFiles()
 
 
 
+void GADA::outputParameterComments(std::ostream &outputStream, BaseGADA &baseGADA)
+{
+    //outputStream << "# GADA Genome Alteration Detection Algorithm\n";
+    //outputStream << "# Author: www.yfish.org polyactis@gmail.com. Originally from Roger Pique-Regi\n";
+    outputStream << boost::format(
+            "# Parameters: a=%1%,T=%2%,MinSegLen=%3%,sigma2=%4%,BaseAmp=%5%, convergenceDelta=%6%, maxNoOfIterations=%7%, "
+                    "convergenceMaxAlpha=%8%, convergenceB=%9%.\n") %
+            baseGADA.a % baseGADA.T % baseGADA.MinSegLen %
+            baseGADA.sigma2 % baseGADA.BaseAmp %
+            baseGADA.convergenceDelta % baseGADA.maxNoOfIterations %
+            baseGADA.convergenceMaxAlpha % baseGADA.convergenceB;
+    outputStream << boost::format("# %1% data points in input file\n") %
+                        baseGADA._M_total_length;
+    outputStream << boost::format("# Overall mean %1%\n") % baseGADA.Wext[0];
+    outputStream << boost::format("# Sigma^2=%1%\n") % baseGADA.sigma2;
+    outputStream << boost::format(
+                        "# Convergence: delta=%1% after %2% EM iterations.\n") %
+                        baseGADA.delta % baseGADA.numEMsteps;
+    outputStream << boost::format("# Found %1% breakpoints after SBL\n") %
+                        baseGADA.noOfBreakpointsAfterSBL;
+    outputStream << boost::format("# Kept %1% breakpoints after BE\n") %
+                        baseGADA.K;
+    if (coarse_bin_size > 1) {
+        outputStream << boost::format("# Coarse-to-fine: coarse_bin_size=%1%, coarse_flank_length=%2%\n") %
+                            coarse_bin_size % coarse_flank_length;
+    }
+    if (chunk_size > 0) {
+        outputStream << boost::format("# Chunked: chunk_size=%1%, chunk_overlap_length=%2%\n") %
+                            chunk_size % chunk_overlap_length;
+    }
+    if (!init_breakpoints_file_path.empty()) {
+        outputStream << boost::format("# Warm start from %1%\n") % init_breakpoints_file_path;
+    }
+}
+
+void GADA::runSBLandBE(BaseGADA &baseGADA, const string &chromosome_id,
+                       const vector<long> &chr_start_pos_vector, int no_of_chunk_threads)
+{
+    std::map<string, vector<long> >::const_iterator init_segment_start_iterator =
+        chr2init_segment_start_vector.find(chromosome_id);
+    if (init_segment_start_iterator != chr2init_segment_start_vector.end()) {
+        baseGADA.WarmStartSBLandBE(segmentStartsToBreakpoints(init_segment_start_iterator->second,
+                                                              chr_start_pos_vector));
+    }
+    else if (coarse_bin_size > 1) {
+        baseGADA.CoarseToFineSBLandBE(coarse_bin_size, coarse_flank_length);
+    }
+    else if (chunk_size > 0) {
+        baseGADA.ChunkedSBLandBE(chunk_size, chunk_overlap_length, no_of_chunk_threads);
+    }
+    else {
+        baseGADA.SBLandBE();
+    }
+}
+
+void GADA::outputSegments(std::ostream &outputStream, BaseGADA &baseGADA,
+                          const string &chromosome_id, const vector<long> &chr_start_pos_vector,
+                          double *ratio_array)
+{
+    //outputStream << boost::format("Chromosome\tStart\tStop\tMean\tStddev\tNoOfValidWindows\n");
+    for (int i = 0; i < baseGADA.K + 1; i++) {
+        int chr_start_pos = chr_start_pos_vector[baseGADA.Iext[i]];
+        int chr_stop_pos = chr_start_pos_vector[baseGADA.Iext[i+1]-1] + window_size - 1;
+        float segment_mean;
+        float segment_stddev;
+        calculate_robust_mean_stddev(ratio_array, baseGADA.Iext[i], baseGADA.Iext[i+1], 40, segment_mean, segment_stddev);
+        outputStream << chromosome_id << "\t" << chr_start_pos
+                     << "\t" << chr_stop_pos
+                     << "\t" << segment_mean
+                     << "\t" << segment_stddev
+                     << "\t" << baseGADA.SegLen[i]
+                     << std::endl;
+    }
+}
+
+string GADA::segmentOneChr(const string &chromosome_id, const string &input_file_path,
+                           int no_of_chunk_threads)
+{
+    // --batch: everything of one chromosome is local, so chromosomes can run in parallel.
+    vector<long> chr_start_pos_vector;
+    vector<double> ratio_vector;
+    readRatioFile(input_file_path, chr_start_pos_vector, ratio_vector);
+    std::ostringstream outputStream;
+    if (ratio_vector.empty()) {
+        cerr << "Warning: no data points for chromosome " << chromosome_id << "." << endl;
+        return outputStream.str();
+    }
+    BaseGADA baseGADA =
+        BaseGADA(ratio_vector.data(), ratio_vector.size(), sigma2, BaseAmp, a, T, MinSegLen, debug,
+                 convergenceDelta, maxNoOfIterations, convergenceMaxAlpha,
+                 convergenceB, reportIntervalDuringBE);
+    runSBLandBE(baseGADA, chromosome_id, chr_start_pos_vector, no_of_chunk_threads);
+    baseGADA.IextToSegLen();
+    baseGADA.IextWextToSegAmp();
+    outputParameterComments(outputStream, baseGADA);
+    outputSegments(outputStream, baseGADA, chromosome_id, chr_start_pos_vector, ratio_vector.data());
+    cerr << boost::format("Chromosome %1%: %2% data points, %3% breakpoints after SBL, "
+                          "%4% breakpoints after BE.\n") %
+            chromosome_id % ratio_vector.size() % baseGADA.noOfBreakpointsAfterSBL % baseGADA.K;
+    // ~BaseGADA() frees nothing. One process segments many chromosomes in --batch mode.
+    baseGADA.FreeArrays();
+    free(baseGADA.SegLen);
+    free(baseGADA.SegAmp);
+    return outputStream.str();
+}
+
+void GADA::runBatch()
+{
+    long no_of_chrs = input_file_path_vector.size();
+    vector<string> chromosome_id_vector;
+    for (const string &one_input_file_path : input_file_path_vector) {
+        string file_name = one_input_file_path.substr(one_input_file_path.find_last_of('/') + 1);
+        chromosome_id_vector.push_back(file_name.substr(0, file_name.find('.')));
+    }
+    // --threads is the total budget: chromosomes first, then chunks of one chromosome
+    //  (--chunk_size) with whatever is left per chromosome.
+    int no_of_chr_threads = (int) std::max(std::min((long) no_of_threads, no_of_chrs), 1L);
+    int no_of_chunk_threads = std::max(no_of_threads / no_of_chr_threads, 1);
+    std::cerr << "Segmenting " << no_of_chrs << " chromosomes with "
+              << no_of_chr_threads << " threads ..." << endl;
+    // chromosomes are picked up by the threads in input order. Output is kept per chromosome
+    //  and written in input order once all are done.
+    vector<string> output_text_vector(no_of_chrs);
+    std::atomic<long> next_chr_index(0);
+    vector<std::thread> thread_vector;
+    for (int i = 0; i < no_of_chr_threads; i++) {
+        thread_vector.push_back(std::thread([&]() {
+            long chr_index;
+            while ((chr_index = next_chr_index++) < no_of_chrs) {
+                output_text_vector[chr_index] = segmentOneChr(chromosome_id_vector[chr_index],
+                                                              input_file_path_vector[chr_index],
+                                                              no_of_chunk_threads);
+            }
+        }));
+    }
+    for (std::thread &one_thread : thread_vector) {
+        one_thread.join();
+    }
+
+    std::cerr << "Outputting final result ... ";
+    openOutputFile();
+    {
+        std::ostream outputStream(&outputFilterStreamBuffer);
+        for (const string &output_text : output_text_vector) {
+            outputStream << output_text;
+        }
+        outputStream.flush();
+    }
+    // pop the gzip compressor so that the gzip footer is written before closing the file.
+    outputFilterStreamBuffer.reset();
+    outputFile.close();
+    std::cerr << " output done." << endl;
+}
+
 void GADA::run()
 {
     constructOptionDescriptionStructure();
     parseCommandlineOptions();
+    if (batch) {
+        runBatch();
+        return;
+    }
     readInputFile();
 
     std::cerr << "Running SBLandBE ... " << endl;
@@ -363,7 +626,7 @@ void GADA::run()
         BaseGADA(input_array, input_array_len, sigma2, BaseAmp, a, T, MinSegLen, debug,
                  convergenceDelta, maxNoOfIterations, convergenceMaxAlpha,
                  convergenceB, reportIntervalDuringBE);
-    baseGADA.SBLandBE();
+    runSBLandBE(baseGADA, chromosome_id, chr_start_pos_vector, no_of_threads);
     // K = SBLandBE(input_array, input_array_len, &sigma2, a, T, MinSegLen, &Iext, &Wext, debug ,
     // delta, numEMsteps, noOfBreakpointsAfterSBL, convergenceDelta,
     // maxNoOfIterations, convergenceMaxAlpha, convergenceB);
@@ -386,44 +649,11 @@ void GADA::run()
 
     std::ostream outputStream(&outputFilterStreamBuffer);
 
-    //outputStream << "# GADA Genome Alteration Detection Algorithm\n";
-    //outputStream << "# Author: www.yfish.org polyactis@gmail.com. Originally from Roger Pique-Regi\n";
-    outputStream << boost::format(
-            "# Parameters: a=%1%,T=%2%,MinSegLen=%3%,sigma2=%4%,BaseAmp=%5%, convergenceDelta=%6%, maxNoOfIterations=%7%, "
-                    "convergenceMaxAlpha=%8%, convergenceB=%9%.\n") %
-            baseGADA.a % baseGADA.T % baseGADA.MinSegLen %
-            baseGADA.sigma2 % baseGADA.BaseAmp %
-            baseGADA.convergenceDelta % baseGADA.maxNoOfIterations %
-            baseGADA.convergenceMaxAlpha % baseGADA.convergenceB;
-    outputStream << boost::format("# %1% data points in input file\n") %
-                        baseGADA._M_total_length;
-    outputStream << boost::format("# Overall mean %1%\n") % baseGADA.Wext[0];
-    outputStream << boost::format("# Sigma^2=%1%\n") % baseGADA.sigma2;
-    outputStream << boost::format(
-                        "# Convergence: delta=%1% after %2% EM iterations.\n") %
-                        baseGADA.delta % baseGADA.numEMsteps;
-    outputStream << boost::format("# Found %1% breakpoints after SBL\n") %
-                        baseGADA.noOfBreakpointsAfterSBL;
-    outputStream << boost::format("# Kept %1% breakpoints after BE\n") %
-                        baseGADA.K;
-
+    outputParameterComments(outputStream, baseGADA);
 
     if (SelectClassifySegments == 0)
     {
-        //outputStream << boost::format("Chromosome\tStart\tStop\tMean\tStddev\tNoOfValidWindows\n");
-        for (int i = 0; i < baseGADA.K + 1; i++) {
-            int chr_start_pos = chr_start_pos_vector[baseGADA.Iext[i]];
-            int chr_stop_pos = chr_start_pos_vector[baseGADA.Iext[i+1]-1] + window_size - 1;
-            float segment_mean;
-            float segment_stddev;
-            calculate_robust_mean_stddev(input_array, baseGADA.Iext[i], baseGADA.Iext[i+1], 40, segment_mean, segment_stddev);
-            outputStream << chromosome_id << "\t" << chr_start_pos
-                         << "\t" << chr_stop_pos
-                         << "\t" << segment_mean
-                         << "\t" << segment_stddev
-                         << "\t" << baseGADA.SegLen[i]
-                         << std::endl;
-        }
+        outputSegments(outputStream, baseGADA, chromosome_id, chr_start_pos_vector, input_array);
     }
     else if (SelectClassifySegments == 1)
     {
@@ -0,0 +1,99 @@
+/*
+ Time the autocorrelation of infer (Infer::calculate_autocor) on synthetic
+ ratio histograms of increasing size, against the old full sort per shift.
+ Each histogram has Gaussian peaks every period (RESOLUTION/2) on [0, size).
+ Dense: peak stddev period/10. Sparse: peaks cut at 2 stddev (kernel_smoothing)
+ with few enough non-zero bins for the FFT path.
+ Output (stdout): histogram_size, no_of_non_zeros, seconds_full_sort, seconds, max_relative_difference.
+
+    make benchmark_autocor && ./benchmark_autocor 3001 10001 30001
+
+ Author:
+ Yu S. Huang, polyactis@gmail.com
+ */
+#include <chrono>
+#include <cstdlib>
+#include "prob.h"
+#include "read_para.h"
+
+void calc_autocor_by_full_sort(const vector<double> &pdf_vec, int max_shift,
+                               int max_no_of_terms, double *cor_array)
+{
+    // the code before calc_autocor_of_largest_terms().
+    for (int shift = 0; shift <= max_shift; shift++) {
+        vector<double> all_terms;
+        for (long i = 0; i + shift < (long) pdf_vec.size(); i++) {
+            all_terms.push_back(pdf_vec[i] * pdf_vec[i + shift]);
+        }
+        sort(all_terms.begin(), all_terms.end(), greater<double>());
+        double sum_cor = 0;
+        for (int tm = 0; tm < min((int) all_terms.size(), max_no_of_terms); tm++) {
+            sum_cor += all_terms[tm];
+        }
+        cor_array[shift] = sum_cor;
+    }
+}
+
+vector<double> make_histogram(long histogram_size, double peak_stddev)
+{
+    vector<double> pdf_vec(histogram_size, 0.0);
+    int period = RESOLUTION / 2;
+    for (long peak = period / 2; peak < histogram_size; peak += period) {
+        double weight = 1000.0 * (1 + rand() % 10);
+        long i_start = max(0L, (long) floor(peak - 2 * peak_stddev));
+        long i_end = min((long) ceil(peak + 2 * peak_stddev), histogram_size - 1);
+        for (long i = i_start; i <= i_end; i++) {
+            pdf_vec[i] += weight * kGaussianDensityFrontScalar / peak_stddev *
+                          exp(-(i - peak) * (i - peak) / (2 * peak_stddev * peak_stddev));
+        }
+    }
+    return pdf_vec;
+}
+
+void benchmark(Prob &prob, const vector<double> &pdf_vec)
+{
+    long no_of_non_zeros = 0;
+    for (double pdf : pdf_vec) {
+        if (pdf != 0) no_of_non_zeros++;
+    }
+    vector<double> old_cor_vec(kPeriodMax + 1), cor_vec(kPeriodMax + 1);
+
+    auto start_time = std::chrono::steady_clock::now();
+    calc_autocor_by_full_sort(pdf_vec, kPeriodMax, MAX_NUM_OF_COR_TO_SUM, old_cor_vec.data());
+    std::chrono::duration<double> old_seconds = std::chrono::steady_clock::now() - start_time;
+
+    start_time = std::chrono::steady_clock::now();
+    prob.calc_autocor_of_largest_terms(pdf_vec, kPeriodMax, MAX_NUM_OF_COR_TO_SUM, cor_vec.data());
+    std::chrono::duration<double> seconds = std::chrono::steady_clock::now() - start_time;
+
+    double max_relative_difference = 0;
+    for (int shift = 0; shift <= kPeriodMax; shift++) {
+        max_relative_difference = max(max_relative_difference,
+                                      fabs(cor_vec[shift] - old_cor_vec[shift]) / old_cor_vec[0]);
+    }
+    cout << pdf_vec.size() << "\t" << no_of_non_zeros << "\t" << old_seconds.count() << "\t"
+         << seconds.count() << "\t" << max_relative_difference << endl;
+}
+
+int main(int argc, char *argv[])
+{
+    vector<long> histogram_size_vector;
+    for (int i = 1; i < argc; i++) {
+        histogram_size_vector.push_back(atol(argv[i]));
+    }
+    if (histogram_size_vector.empty()) {
+        // infer: MAX_RATIO_HIGH_RES+1
+        histogram_size_vector = {1001, 3001, 10001, 30001};
+    }
+    Prob prob;
+    srand(1);
+    cout << "histogram_size\tno_of_non_zeros\tseconds_full_sort\tseconds\tmax_relative_difference" << endl;
+    for (long histogram_size : histogram_size_vector) {
+        benchmark(prob, make_histogram(histogram_size, RESOLUTION / 20.0));
+    }
+    for (long histogram_size : histogram_size_vector) {
+        // about 10 non-zero bins per peak
+        benchmark(prob, make_histogram(histogram_size, 2.0));
+    }
+    return 0;
+}
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+ Time GADA on synthetic chromosomes of increasing number of windows, i.e. to check
+ that segmentation scales to small (100-200bp) windows.
+ Each chromosome is a piecewise-constant coverage ratio (one segment every
+ --segment_length windows, ratios drawn from copy numbers 1-4) plus Gaussian noise.
+ Output (stdout): no_of_windows, no_of_breakpoints_after_SBL, no_of_segments, seconds.
+
+    ./benchmark_gada.py -g ./GADA -n 10000,100000,1000000
+"""
+from __future__ import print_function
+import os, sys
+import argparse
+import gzip
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-g', '--gada_path', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'GADA'),
+    help='the GADA binary. Default: %(default)s')
+parser.add_argument('-n', '--no_of_windows', default='10000,30000,100000,300000,1000000',
+    help='comma-separated numbers of windows to benchmark. Default: %(default)s')
+parser.add_argument('-l', '--segment_length', type=int, default=2000,
+    help='average number of windows per true segment. Default: %(default)s')
+parser.add_argument('-s', '--noise_sd', type=float, default=0.2,
+    help='standard deviation of the Gaussian noise on the ratio. Default: %(default)s')
+parser.add_argument('-T', '--T', type=float, default=30, help='GADA -T. Default: %(default)s')
+parser.add_argument('-M', '--MinSegLen', type=int, default=50, help='GADA -M. Default: %(default)s')
+parser.add_argument('-a', '--a', type=float, default=0.5, help='GADA -a. Default: %(default)s')
+parser.add_argument('--seed', type=int, default=1, help='random seed. Default: %(default)s')
+args = parser.parse_args()
+
+
+def write_synthetic_chromosome(output_file_path, no_of_windows, segment_length, noise_sd):
+	# same layout as the normalize output (chrN.ratio.wN.csv.gz), window size 100.
+	with gzip.open(output_file_path, 'wt') as output_file:
+		output_file.write('start,coverage_ratio,coverage_tumor_adj,coverage_normal_adj\n')
+		i = 0
+		while i < no_of_windows:
+			run_length = max(1, int(random.expovariate(1.0 / segment_length)))
+			ratio = random.choice([0.5, 1.0, 1.5, 2.0])
+			for j in range(i, min(i + run_length, no_of_windows)):
+				output_file.write('%d,%.4f,1,1\n' % (j * 100 + 1, ratio + random.gauss(0, noise_sd)))
+			i += run_length
+
+
+def run_gada(input_file_path, output_file_path):
+	start_time = time.time()
+	subprocess.check_call([args.gada_path, '-i', input_file_path, '-o', output_file_path,
+		'-T', str(args.T), '-a', str(args.a), '-M', str(args.MinSegLen)],
+		stdout=open(os.devnull, 'w'), stderr=open(os.devnull, 'w'))
+	seconds = time.time() - start_time
+	no_of_breakpoints_after_SBL = None
+	no_of_segments = 0
+	for line in open(output_file_path):
+		search_result = re.search(r'Found (\d+) breakpoints after SBL', line)
+		if search_result:
+			no_of_breakpoints_after_SBL = int(search_result.group(1))
+		elif line[0] != '#':
+			no_of_segments += 1
+	return no_of_breakpoints_after_SBL, no_of_segments, seconds
+
+
+if __name__ == '__main__':
+	if not os.path.isfile(args.gada_path):
+		sys.stderr.write("ERROR: GADA binary %s does not exist. Run make in src_o first.\n" % args.gada_path)
+		sys.exit(3)
+	random.seed(args.seed)
+	tmp_dir = tempfile.mkdtemp(prefix='benchmark_gada.')
+	try:
+		print('no_of_windows\tno_of_breakpoints_after_SBL\tno_of_segments\tseconds')
+		for no_of_windows in [int(n) for n in args.no_of_windows.split(',')]:
+			input_file_path = os.path.join(tmp_dir, 'chr1.ratio.w100.csv.gz')
+			output_file_path = os.path.join(tmp_dir, 'chr1.seg.tsv')
+			write_synthetic_chromosome(input_file_path, no_of_windows, args.segment_length, args.noise_sd)
+			no_of_breakpoints_after_SBL, no_of_segments, seconds = run_gada(input_file_path, output_file_path)
+			print('%d\t%s\t%d\t%.3f' % (no_of_windows, no_of_breakpoints_after_SBL, no_of_segments, seconds))
+			sys.stdout.flush()
+	finally:
+		shutil.rmtree(tmp_dir)
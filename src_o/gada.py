@@ -0,0 +1,48 @@
+"""
+ Segment coverage ratios with GADA from Python, i.e. to try -T/-M/a in a notebook.
+ Needs numpy. The ratio array is passed to the _gada extension (make _gada in src_o) without
+ copying and the GIL is released during segmentation, so chromosomes can be
+ segmented in parallel from Python threads:
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(8) as pool:
+        result_ls = list(pool.map(lambda r: gada.segment(r, T=30, MinSegLen=50), ratio_ls))
+
+ Author:
+ Yu S. Huang, polyactis@gmail.com
+"""
+import numpy as np
+import _gada
+
+
+def segment(ratios, positions=None, window_size=500, T=30.0, MinSegLen=50, a=0.5,
+        sigma2=-1.0, BaseAmp=0.0, convergenceDelta=1e-8, maxNoOfIterations=50000,
+        convergenceMaxAlpha=1e8, convergenceB=1e-20):
+    """
+    ratios: float64 coverage ratio per window (the 2nd column of chrN.ratio.wN.csv.gz).
+    positions: start of each window. If given, segment start/stop positions are added,
+        as GADA outputs them (stop = start of the last window + window_size - 1).
+    Default T and MinSegLen are the ones main.py uses.
+    Returns a dict of arrays, one element per segment.
+    """
+    ratios = np.ascontiguousarray(ratios, dtype=np.float64)
+    start_index, stop_index, mean, stddev, no_of_breakpoints_after_SBL, sigma2 = \
+        _gada.segment(ratios, T=T, MinSegLen=MinSegLen, a=a, sigma2=sigma2,
+            BaseAmp=BaseAmp, convergenceDelta=convergenceDelta,
+            maxNoOfIterations=maxNoOfIterations,
+            convergenceMaxAlpha=convergenceMaxAlpha, convergenceB=convergenceB)
+    #np.frombuffer() over bytes is read-only. copy() makes the arrays writable.
+    result = {
+        "start_index": np.frombuffer(start_index, dtype=np.int64).copy(),
+        "stop_index": np.frombuffer(stop_index, dtype=np.int64).copy(),
+        "mean": np.frombuffer(mean, dtype=np.float64).copy(),
+        "stddev": np.frombuffer(stddev, dtype=np.float64).copy(),
+        "no_of_breakpoints_after_SBL": no_of_breakpoints_after_SBL,
+        "sigma2": sigma2,
+    }
+    result["no_of_windows"] = result["stop_index"] - result["start_index"]
+    if positions is not None:
+        positions = np.asarray(positions)
+        result["start"] = positions[result["start_index"]]
+        result["stop"] = positions[result["stop_index"] - 1] + window_size - 1
+    return result
@@ -0,0 +1,114 @@
+/*
+ Python extension module _gada: BaseGADA segmentation on a float64 buffer
+ (i.e. a NumPy array) without copying it. Use it through gada.py.
+
+ Author:
+ Yu S. Huang, polyactis@gmail.com
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include "BaseGADA.h"
+#include "read_para.h"
+
+static PyObject *segment(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    /*
+     * Returns (segment_start_index, segment_stop_index, segment_mean, segment_stddev,
+     *  no_of_breakpoints_after_SBL, sigma2) for one chromosome.
+     * The first four are bytes of int64/float64 arrays, one element per segment.
+     *  stop index is exclusive. mean and stddev are the robust (40% trimmed) ones, same as GADA.
+     */
+    static const char *kwlist[] = {"ratios", "T", "MinSegLen", "a", "sigma2", "BaseAmp",
+                                   "convergenceDelta", "maxNoOfIterations",
+                                   "convergenceMaxAlpha", "convergenceB", NULL};
+    PyObject *ratio_object;
+    double T = 5.0, a = 0.5, sigma2 = -1, BaseAmp = 0.0;
+    double convergenceDelta = 1E-8, convergenceMaxAlpha = 1E8, convergenceB = 1E-20;
+    long MinSegLen = 0, maxNoOfIterations = 50000;
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|dlddddldd", (char **) kwlist,
+                                     &ratio_object, &T, &MinSegLen, &a, &sigma2, &BaseAmp,
+                                     &convergenceDelta, &maxNoOfIterations,
+                                     &convergenceMaxAlpha, &convergenceB)) {
+        return NULL;
+    }
+    Py_buffer ratio_buffer;
+    if (PyObject_GetBuffer(ratio_object, &ratio_buffer, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) != 0) {
+        return NULL;
+    }
+    if (ratio_buffer.itemsize != sizeof(double) || ratio_buffer.format == NULL ||
+        strcmp(ratio_buffer.format, "d") != 0) {
+        PyBuffer_Release(&ratio_buffer);
+        PyErr_SetString(PyExc_TypeError, "ratios must be a contiguous float64 array.");
+        return NULL;
+    }
+    long no_of_points = ratio_buffer.len / sizeof(double);
+    if (no_of_points < 2) {
+        PyBuffer_Release(&ratio_buffer);
+        PyErr_SetString(PyExc_ValueError, "ratios needs at least 2 data points.");
+        return NULL;
+    }
+    double *ratio_array = (double *) ratio_buffer.buf;
+
+    vector<long long> start_index_vector, stop_index_vector;
+    vector<double> mean_vector, stddev_vector;
+    long noOfBreakpointsAfterSBL;
+    // BaseGADA only reads ratio_array (it works on its own copy), so other Python threads
+    //  can run meanwhile. The buffer stays locked until it is released below.
+    Py_BEGIN_ALLOW_THREADS
+    BaseGADA baseGADA(ratio_array, no_of_points, sigma2, BaseAmp, a, T, MinSegLen, 0,
+                      convergenceDelta, maxNoOfIterations, convergenceMaxAlpha,
+                      convergenceB, 100000);
+    baseGADA.SBLandBE();
+    baseGADA.IextToSegLen();
+    baseGADA.IextWextToSegAmp();
+    noOfBreakpointsAfterSBL = baseGADA.noOfBreakpointsAfterSBL;
+    sigma2 = baseGADA.sigma2;
+    for (long i = 0; i < baseGADA.K + 1; i++) {
+        float segment_mean, segment_stddev;
+        calculate_robust_mean_stddev(ratio_array, baseGADA.Iext[i], baseGADA.Iext[i + 1], 40,
+                                     segment_mean, segment_stddev);
+        start_index_vector.push_back(baseGADA.Iext[i]);
+        stop_index_vector.push_back(baseGADA.Iext[i + 1]);
+        mean_vector.push_back(segment_mean);
+        stddev_vector.push_back(segment_stddev);
+    }
+    // BaseGADA leaves its arrays to the caller.
+    free(baseGADA.Iext);
+    free(baseGADA.Wext);
+    free(baseGADA.SegLen);
+    free(baseGADA.SegAmp);
+    free(baseGADA.normalized_data_array);
+    free(baseGADA._alpha_array);
+    free(baseGADA._aux_array);
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&ratio_buffer);
+
+    long no_of_segments = mean_vector.size();
+    return Py_BuildValue("(y#y#y#y#ld)",
+                         (const char *) start_index_vector.data(),
+                         (Py_ssize_t) (no_of_segments * sizeof(long long)),
+                         (const char *) stop_index_vector.data(),
+                         (Py_ssize_t) (no_of_segments * sizeof(long long)),
+                         (const char *) mean_vector.data(),
+                         (Py_ssize_t) (no_of_segments * sizeof(double)),
+                         (const char *) stddev_vector.data(),
+                         (Py_ssize_t) (no_of_segments * sizeof(double)),
+                         noOfBreakpointsAfterSBL, sigma2);
+}
+
+static PyMethodDef gada_methods[] = {
+    {"segment", (PyCFunction) segment, METH_VARARGS | METH_KEYWORDS,
+     "segment(ratios, T=5.0, MinSegLen=0, a=0.5, sigma2=-1, BaseAmp=0.0, convergenceDelta=1e-8, "
+     "maxNoOfIterations=50000, convergenceMaxAlpha=1e8, convergenceB=1e-20)\n"
+     "SBL and backward elimination on a contiguous float64 buffer. The GIL is released."},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef gada_module = {
+    PyModuleDef_HEAD_INIT, "_gada", "BaseGADA segmentation. Use gada.py.", -1, gada_methods
+};
+
+PyMODINIT_FUNC PyInit__gada(void)
+{
+    return PyModule_Create(&gada_module);
+}
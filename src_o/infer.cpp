@@ -5,14 +5,59 @@ Author:
  */
 
 #include "infer.h"
-#include "model_selection.h"
 #include <boost/iostreams/stream.hpp>
 #include <boost/iostreams/device/null.hpp>
 #include <algorithm>
+#include <atomic>
+#include <cstring>
+#include <functional>
+#include <memory>
 #include <numeric>
+#include <thread>
 using namespace std;
 using std::cerr;
 
+// population variance of the logOR of a segment. 0: all the same, Model_Selection can not fit.
+static double calc_logOR_variance(const vector<double> &logOR_list)
+{
+    double mean = std::accumulate(logOR_list.begin(), logOR_list.end(), 0.0) * 1.0 /
+                  logOR_list.size();
+    return std::accumulate(logOR_list.begin(), logOR_list.end(), 0.0,
+                           [&mean](double x, double y) { return x + std::pow(y - mean, 2); }) /
+           logOR_list.size();
+}
+
+static Model_Selection_Task make_model_selection_task(const OneSegment &oneSegment, int cp,
+                                                      double purity)
+{
+    return Model_Selection_Task{oneSegment.chr_index, oneSegment.start_pos, oneSegment.end_pos,
+                                &oneSegment.oneSegmentSNPs.logOR_list, cp, purity,
+                                oneSegment.oneSegmentSNPs.coverage};
+}
+
+// job(0), ..., job(no_of_jobs-1) on no_of_threads threads.
+static void run_in_parallel(int no_of_jobs, int no_of_threads, const std::function<void(int)> &job)
+{
+    std::atomic<int> next_job_index(0);
+    auto worker = [&]() {
+        for (int i = next_job_index++; i < no_of_jobs; i = next_job_index++) {
+            job(i);
+        }
+    };
+    int no_of_workers = min(no_of_threads, no_of_jobs);
+    if (no_of_workers <= 1) {
+        worker();
+        return;
+    }
+    vector<std::thread> thread_vector;
+    for (int i = 0; i < no_of_workers; i++) {
+        thread_vector.push_back(std::thread(worker));
+    }
+    for (std::thread &one_thread : thread_vector) {
+        one_thread.join();
+    }
+}
+
 //20171228 sort peak in descending order by no_of_windows
 struct peak_greater_no_of_windows
 {
@@ -28,7 +73,8 @@ Infer::Infer(string configFilepath, string segment_data_input_path,
              float segment_stddev_divider,
              int snp_coverage_min, float snp_coverage_var_vs_mean_ratio,
              int no_of_peaks_for_logL,
-             int debug, int auto_, string refdictFilepath, int custom_period_id)
+             int debug, int auto_, string refdictFilepath, int custom_period_id,
+             int no_of_threads, int period_top_k, double period_logL_rc_margin)
         : _configFilepath(configFilepath),
           _segment_data_input_path(segment_data_input_path),
           _snp_data_input_path(snp_data_input_path),
@@ -40,7 +86,10 @@ Infer::Infer(string configFilepath, string segment_data_input_path,
           _debug(debug),
           _auto(auto_),
           _refdictFilepath(refdictFilepath),
-          custom_period_id(custom_period_id)
+          custom_period_id(custom_period_id),
+          _period_top_k(period_top_k),
+          _period_logL_rc_margin(period_logL_rc_margin),
+          _model_selection_cache(no_of_threads)
 {
     _periodObjVector.reserve(5);
     _snp_maf_stddev_divider = 20.0;
@@ -64,6 +113,11 @@ Infer::Infer(string configFilepath, string segment_data_input_path,
             _no_of_peaks_for_logL);
         exit(3);
     }
+    if (_period_top_k<0 || _period_logL_rc_margin<0){
+        cerr << fmt::format("ERROR: _period_top_k {} or _period_logL_rc_margin {} less than 0.\n",
+            _period_top_k, _period_logL_rc_margin);
+        exit(3);
+    }
 
     _returnCode = 0;
 
@@ -115,6 +169,12 @@ Infer::Infer(string configFilepath, string segment_data_input_path,
                        "logL_of_one_maf_peak" << "\t" <<
                        "no_of_snps_of_one_rc_peak" << "\t" <<
                        "currentPeriodObj.no_of_maf_peaks" << endl;
+
+        tmp_file_path = _output_dir + "/model_selection_iterations.tsv";
+        _model_selection_iteration_outf.open(tmp_file_path.c_str(), ios::trunc);
+        _model_selection_iteration_outf << "chr\tstart\tend\tcp\tpurity\tmodel\tno_of_iterations"
+                                        << endl;
+        _model_selection_cache.iteration_out = &_model_selection_iteration_outf;
     }
     cerr <<"_segment_stddev_divider=" << _segment_stddev_divider << endl;
     cerr <<"_snp_maf_stddev_divider=" << _snp_maf_stddev_divider << endl;
@@ -135,6 +195,7 @@ Infer::~Infer()
     {
         _rc_logL_outf.close();
         _snp_logL_outf.close();
+        _model_selection_iteration_outf.close();
         rc_ratio_by_chr_out_file.flush();
         rc_ratio_by_chr_out_file.close();
     }
@@ -299,31 +360,8 @@ void Infer::calculate_autocor()
      * of summands.  ***/
     cerr << "Calculating auto correlation ...";
     double cor_raw_array[kPeriodMax + 1];
-    for (int shift = 0; shift <= kPeriodMax; shift++) {
-        double sum_cor = 0;
-        // cerr<<sum_cor<<endl;
-        vector<double> all_terms;
-        for (int i = 0; i + shift < _ratio_int_pdf_vec.size(); i++) {
-            all_terms.push_back(_ratio_int_pdf_vec[i] *
-                                _ratio_int_pdf_vec[i + shift]);
-        }
-
-        /** get the few MAX_NUM_OF_COR_TO_SUM summands **/
-        sort(all_terms.begin(), all_terms.end(), larger);
-        // for(int i=0;i<all_terms.size();i++) cerr<<all_terms[i]<<"\n";
-        // cerr<<endl;
-        int num_term = 0;
-        for (int tm = 0; tm < min((int)all_terms.size(), MAX_NUM_OF_COR_TO_SUM);
-             tm++) {
-            sum_cor += all_terms[tm];
-            num_term++;
-        }
-        if (num_term > 0)
-            cor_raw_array[shift] = sum_cor;
-        else
-            cor_raw_array[shift] = 0;
-        // cerr<<shift<<" "<<sum_cor<<endl;
-    }
+    _probInstance.calc_autocor_of_largest_terms(_ratio_int_pdf_vec, kPeriodMax,
+                                                MAX_NUM_OF_COR_TO_SUM, cor_raw_array);
 
     // averaging with window size 4
     _cor_array[0] =
@@ -690,20 +728,21 @@ int Infer::infer_candidate_period_by_autocor(OnePeriod &period_obj)
     return 0;
 }
 
-OnePeak Infer::find_first_peak_ab_init(int candidate_period_int)
+OnePeak Infer::find_first_peak_ab_init(int candidate_period_int, ostream &log_out)
 {
     OnePeak first_peak_obj = find_first_peak_given_bounds(
-            candidate_period_int, kFirstPeakMin, kFirstPeakMax + candidate_period_int/4);
-    cerr << " Find_first_peak_ab_init() for period: " << candidate_period_int << endl
-         << "  first peak: " << first_peak_obj.peak_center_int << endl;
-    cerr << "  lower bound: " << first_peak_obj.lower_bound_int << endl;
-    cerr << "  upper bound: " << first_peak_obj.upper_bound_int << endl;
+            candidate_period_int, kFirstPeakMin, kFirstPeakMax + candidate_period_int/4, log_out);
+    log_out << " Find_first_peak_ab_init() for period: " << candidate_period_int << endl
+            << "  first peak: " << first_peak_obj.peak_center_int << endl;
+    log_out << "  lower bound: " << first_peak_obj.lower_bound_int << endl;
+    log_out << "  upper bound: " << first_peak_obj.upper_bound_int << endl;
     return first_peak_obj;
 }
 
 OnePeak Infer::find_first_peak_given_bounds(int candidate_period_int,
                                             int first_peak_lower_bound_int,
-                                            int first_peak_upper_bound_int)
+                                            int first_peak_upper_bound_int,
+                                            ostream &log_out)
 {
     /***
     The best start position for a given candidate_period_int.
@@ -712,10 +751,10 @@ OnePeak Infer::find_first_peak_given_bounds(int candidate_period_int,
     It can correspond to regions with no peaks
     ***/
     if (_debug > 0) {
-        cerr << "Finding first peak, period_int: "
-             << candidate_period_int << ", within bounds of ("
-             << first_peak_lower_bound_int << "-" << first_peak_upper_bound_int
-             << ")... " << endl;
+        log_out << "Finding first peak, period_int: "
+                << candidate_period_int << ", within bounds of ("
+                << first_peak_lower_bound_int << "-" << first_peak_upper_bound_int
+                << ")... " << endl;
     }
     OnePeak first_peak_obj = OnePeak();
     double max_sum = -1;
@@ -785,10 +824,10 @@ OnePeak Infer::find_first_peak_given_bounds(int candidate_period_int,
     first_peak_obj.upper_bound_int =
             first_peak_obj.peak_center_int + candidate_peak_half_width;
     if (_debug > 0) {
-        cerr << "  best_first_peak center: " << best_first_peak << endl
-             << "  sum of window count at all periodic peaks: "
-             << all_sum[best_first_peak] << endl
-             << "  half_width_int: " << candidate_peak_half_width << endl;
+        log_out << "  best_first_peak center: " << best_first_peak << endl
+                << "  sum of window count at all periodic peaks: "
+                << all_sum[best_first_peak] << endl
+                << "  half_width_int: " << candidate_peak_half_width << endl;
     }
     return first_peak_obj;
 }
@@ -803,7 +842,7 @@ OnePeak Infer::refine_first_peak(int candidate_period_int,
     ***/
     return find_first_peak_given_bounds(candidate_period_int,
                                         first_peak_obj.lower_bound_int,
-                                        first_peak_obj.upper_bound_int);
+                                        first_peak_obj.upper_bound_int, cerr);
 }
 
 vector<OnePeak> Infer::find_peaks(OnePeriod &period_obj,
@@ -930,99 +969,57 @@ OnePeriod Infer::infer_best_period_by_logL(vector<OnePeriod> &candidate_period_v
             custom_period_id, suffix);
         cerr << warn_msg;
     }
+    if (_max_peak_half_width == -1 && candidate_periods_size > 0) {
+        // find_first_peak_given_bounds() sets it from the first candidate. Set it before
+        //  the candidates are evaluated in parallel.
+        _max_peak_half_width = candidate_period_vec[0].period_int / 4;
+    }
+    // peaks and read count logL of all candidates, in parallel.
+    vector<Candidate_Period_Evaluation> evaluation_vector(candidate_periods_size);
+    run_in_parallel(candidate_periods_size, _model_selection_cache.no_of_threads,
+                    [&](int candidate_period_index) {
+                        evaluate_candidate_period_by_rc(candidate_period_vec[candidate_period_index],
+                                                        evaluation_vector[candidate_period_index]);
+                    });
+    prune_candidate_periods_by_logL_rc(candidate_period_vec, evaluation_vector);
+    // Model_Selection of all candidates in one run(), so that no thread waits for
+    //  the slowest segment of each candidate.
+    vector<Model_Selection_Task> model_selection_task_vector;
+    for (const Candidate_Period_Evaluation &evaluation : evaluation_vector) {
+        model_selection_task_vector.insert(model_selection_task_vector.end(),
+                                           evaluation.model_selection_task_vector.begin(),
+                                           evaluation.model_selection_task_vector.end());
+    }
+    _model_selection_cache.run(model_selection_task_vector);
+
     for (int candidate_period_index = 0;
          candidate_period_index < candidate_periods_size;
          candidate_period_index++) {
         OnePeriod &candidate_period = candidate_period_vec[candidate_period_index];
-        int candidate_period_int = candidate_period.period_int;
-
-        string status_msg = fmt::format("### candidate period_int: {}\n", candidate_period_int);
-        cerr << status_msg;
-        _infer_details_outf << status_msg;
-        // find the first peak, ab init
-        candidate_period.first_peak_obj = find_first_peak_ab_init(candidate_period_int);
-        // peak must in a auto correlation field and
-        // first peak < 1000
-        //  _num_peak_less_one_half = (_one_half -_first_peak_obj.peak_center_int + 1) /
-        // _period_obj_from_autocor.period_int;
-
-        //candidate_period.first_peak_obj =
-        //    refine_first_peak(candidate_period_int, first_peak_obj_prior);
-        candidate_period.peak_obj_vector = find_peaks(
-            candidate_period, candidate_period.first_peak_obj);
-        // first_peak_obj is refined in find_peaks().
-        candidate_period.first_peak_obj = candidate_period.peak_obj_vector[0];
-        candidate_period.first_peak_int = candidate_period.first_peak_obj.peak_center_int;
-        // half_width_int is refined in find_peaks().
-        candidate_period.width = candidate_period.first_peak_obj.half_width_int;
-        int first_peak_int = candidate_period.first_peak_obj.peak_center_int;
-
-        // sort peak_obj by desc order
-        sort(candidate_period.peak_obj_vector.begin(), candidate_period.peak_obj_vector.end(),
-             [](const OnePeak &a, const OnePeak &b) -> bool {
-                 return a.peak_height > b.peak_height; });
-
-        // for each period, sum likelihood of all peaks (segments and snps)
-        candidate_period.ResetCounters();
-        double sum_adj_logL = 0;
-        if (_debug > 0) {
-            _rc_logL_outf << "period_int" << "\t"
-                          << candidate_period_int << "\t"
-                          << "half-width" << "\t"
-                          << candidate_period.period_int - candidate_period.lower_bound_int << endl;
-            _rc_logL_outf << "peak_index" << "\t" << "peak_center_float" << "\t"
-                          << "peak_height" << "\t"
-                          << "peak_half_width" << "\t"
-                          << "logL_peak" << "\t" << "candidate_period.logL"
-                          << endl;
-        }
-        //set no_of_peaks_for_logL for this period
-        candidate_period.no_of_peaks_for_logL = min(_no_of_peaks_for_logL, \
-            int(candidate_period.peak_obj_vector.size()));
-        for (unsigned int peak_index = 0;
-             peak_index < candidate_period.no_of_peaks_for_logL;
-             peak_index++) {
-            OnePeak &peak_obj =
-                    candidate_period.peak_obj_vector[peak_index];
-            float peak_center_float = peak_obj.peak_center_int * 1.0 / RESOLUTION;
-            double adj_logL;
-            float logL_peak = calc_one_peak_logL_rc(
-                    peak_center_float, peak_obj, candidate_period, adj_logL);
-            candidate_period.logL += logL_peak;
-            sum_adj_logL += adj_logL;
-            if (_debug > 0) {
-                _rc_logL_outf << peak_index << "\t" << peak_center_float << "\t"
-                              << peak_obj.peak_height << "\t"
-                              << peak_obj.half_width_int << "\t"
-                              << logL_peak << "\t"
-                              << candidate_period.logL << endl;
+        Candidate_Period_Evaluation &evaluation = evaluation_vector[candidate_period_index];
+        if (evaluation.has_windows && !candidate_period.pruned) {
+            this->infer_no_of_copy_nos_bf_1st_peak_for_one_period_by_logL_snp(
+                    candidate_period, evaluation);
+
+            candidate_period.logL += candidate_period.best_logL_snp;
+            if (_debug>0) {
+                evaluation.log_out << fmt::format(" best_logL_snp: {}\n", candidate_period.best_logL_snp);
+                evaluation.log_out << fmt::format(" no_of_peaks_for_logL: {}\n", candidate_period.no_of_peaks_for_logL);
+                evaluation.log_out << fmt::format(" purity: {}\n", candidate_period.best_purity);
+                evaluation.log_out << fmt::format(" ploidy: {}\n", candidate_period.best_ploidy);
+                evaluation.log_out << fmt::format(" logL: {}\n", candidate_period.logL);
             }
         }
-        if (candidate_period.no_of_windows <= 0) continue;
-        // float
-        // readCount_logL_penalty=0.5*log(candidate_period.no_of_windows)*total_used_peaks;
-        // TODO the total used peak is (10 * RESOLUTION - first_peak_int)/period_int ?
-        candidate_period.logL_rc_penalty =
-                -0.5 * log(candidate_period.no_of_windows) *
-                (10 * RESOLUTION - first_peak_int) / candidate_period_int;
-        candidate_period.logL += candidate_period.logL_rc_penalty;
-        candidate_period.logL_rc = candidate_period.logL;
-        candidate_period.adj_logL_rc =
-                -log(sqrt(sum_adj_logL / candidate_period.no_of_windows) /
-                     candidate_period_int *
-                     FRESOLUTION);
-        //-0.5*log(candidate_period.no_of_segments)/candidate_period.no_of_segments-0.5*
-        //  log(candidate_period.no_of_segments)*(50*1000-first_peak_int)/period_int/candidate_period.no_of_segments;
-
-        this->infer_no_of_copy_nos_bf_1st_peak_for_one_period_by_logL_snp(candidate_period);
-
-        candidate_period.logL += candidate_period.best_logL_snp;
-        if (_debug>0) {
-            cerr << fmt::format(" best_logL_snp: {}\n", candidate_period.best_logL_snp);
-            cerr << fmt::format(" no_of_peaks_for_logL: {}\n", candidate_period.no_of_peaks_for_logL);
-            cerr << fmt::format(" purity: {}\n", candidate_period.best_purity);
-            cerr << fmt::format(" ploidy: {}\n", candidate_period.best_ploidy);
-            cerr << fmt::format(" logL: {}\n", candidate_period.logL);
+        cerr << evaluation.log_out.str();
+        _infer_details_outf << evaluation.details_out.str();
+        if (_debug > 0) {
+            _rc_logL_outf << evaluation.rc_logL_out.str() << flush;
+            _snp_logL_outf << evaluation.snp_logL_out.str() << flush;
+        }
+        if (!evaluation.has_windows) continue;
+        if (candidate_period.pruned) {
+            _periodObjVector.push_back(candidate_period);
+            continue;
         }
         if (custom_period_id > 0) {
             if (custom_period_id == candidate_period_index + 1) {
@@ -1052,6 +1049,143 @@ OnePeriod Infer::infer_best_period_by_logL(vector<OnePeriod> &candidate_period_v
     return best_period_obj;
 }
 
+void Infer::evaluate_candidate_period_by_rc(OnePeriod &candidate_period,
+                                            Candidate_Period_Evaluation &evaluation)
+{
+    /***
+    Peaks and read count logL of one candidate period, and the Model_Selection tasks
+    of its copy number hypotheses. Only reads the shared data, so candidates can be
+    evaluated in parallel. Output goes to evaluation.
+    ***/
+    int candidate_period_int = candidate_period.period_int;
+
+    string status_msg = fmt::format("### candidate period_int: {}\n", candidate_period_int);
+    evaluation.log_out << status_msg;
+    evaluation.details_out << status_msg;
+    // find the first peak, ab init
+    candidate_period.first_peak_obj = find_first_peak_ab_init(candidate_period_int, evaluation.log_out);
+    // peak must in a auto correlation field and
+    // first peak < 1000
+    //  _num_peak_less_one_half = (_one_half -_first_peak_obj.peak_center_int + 1) /
+    // _period_obj_from_autocor.period_int;
+
+    //candidate_period.first_peak_obj =
+    //    refine_first_peak(candidate_period_int, first_peak_obj_prior);
+    candidate_period.peak_obj_vector = find_peaks(
+        candidate_period, candidate_period.first_peak_obj);
+    // first_peak_obj is refined in find_peaks().
+    candidate_period.first_peak_obj = candidate_period.peak_obj_vector[0];
+    candidate_period.first_peak_int = candidate_period.first_peak_obj.peak_center_int;
+    // half_width_int is refined in find_peaks().
+    candidate_period.width = candidate_period.first_peak_obj.half_width_int;
+    int first_peak_int = candidate_period.first_peak_obj.peak_center_int;
+
+    // sort peak_obj by desc order
+    sort(candidate_period.peak_obj_vector.begin(), candidate_period.peak_obj_vector.end(),
+         [](const OnePeak &a, const OnePeak &b) -> bool {
+             return a.peak_height > b.peak_height; });
+
+    // for each period, sum likelihood of all peaks (segments and snps)
+    candidate_period.ResetCounters();
+    double sum_adj_logL = 0;
+    if (_debug > 0) {
+        evaluation.rc_logL_out << "period_int" << "\t"
+                               << candidate_period_int << "\t"
+                               << "half-width" << "\t"
+                               << candidate_period.period_int - candidate_period.lower_bound_int << endl;
+        evaluation.rc_logL_out << "peak_index" << "\t" << "peak_center_float" << "\t"
+                               << "peak_height" << "\t"
+                               << "peak_half_width" << "\t"
+                               << "logL_peak" << "\t" << "candidate_period.logL"
+                               << endl;
+    }
+    //set no_of_peaks_for_logL for this period
+    candidate_period.no_of_peaks_for_logL = min(_no_of_peaks_for_logL, \
+        int(candidate_period.peak_obj_vector.size()));
+    for (unsigned int peak_index = 0;
+         peak_index < candidate_period.no_of_peaks_for_logL;
+         peak_index++) {
+        OnePeak &peak_obj =
+                candidate_period.peak_obj_vector[peak_index];
+        float peak_center_float = peak_obj.peak_center_int * 1.0 / RESOLUTION;
+        double adj_logL;
+        float logL_peak = calc_one_peak_logL_rc(
+                peak_center_float, peak_obj, candidate_period, adj_logL);
+        candidate_period.logL += logL_peak;
+        sum_adj_logL += adj_logL;
+        if (_debug > 0) {
+            evaluation.rc_logL_out << peak_index << "\t" << peak_center_float << "\t"
+                                   << peak_obj.peak_height << "\t"
+                                   << peak_obj.half_width_int << "\t"
+                                   << logL_peak << "\t"
+                                   << candidate_period.logL << endl;
+        }
+    }
+    if (candidate_period.no_of_windows <= 0) return;
+    // float
+    // readCount_logL_penalty=0.5*log(candidate_period.no_of_windows)*total_used_peaks;
+    // TODO the total used peak is (10 * RESOLUTION - first_peak_int)/period_int ?
+    candidate_period.logL_rc_penalty =
+            -0.5 * log(candidate_period.no_of_windows) *
+            (10 * RESOLUTION - first_peak_int) / candidate_period_int;
+    candidate_period.logL += candidate_period.logL_rc_penalty;
+    candidate_period.logL_rc = candidate_period.logL;
+    candidate_period.adj_logL_rc =
+            -log(sqrt(sum_adj_logL / candidate_period.no_of_windows) /
+                 candidate_period_int *
+                 FRESOLUTION);
+    //-0.5*log(candidate_period.no_of_segments)/candidate_period.no_of_segments-0.5*
+    //  log(candidate_period.no_of_segments)*(50*1000-first_peak_int)/period_int/candidate_period.no_of_segments;
+    evaluation.has_windows = true;
+    collect_copy_no_hypotheses(candidate_period, evaluation);
+}
+
+void Infer::prune_candidate_periods_by_logL_rc(vector<OnePeriod> &candidate_period_vec,
+                                                vector<Candidate_Period_Evaluation> &evaluation_vector)
+{
+    /***
+    Coarse-to-fine: rank the candidates by logL_rc (read count logL plus its penalty)
+    and drop the Model_Selection tasks of those outside the top _period_top_k and
+    more than _period_logL_rc_margin behind the best. The custom_period_id candidate
+    is always kept. Pruned candidates are marked in infer.out.details.tsv.
+    ***/
+    if (_period_top_k <= 0 && _period_logL_rc_margin <= 0) return;
+    vector<int> ranked_index_vector;
+    for (int i = 0; i < (int) candidate_period_vec.size(); i++) {
+        if (evaluation_vector[i].has_windows) ranked_index_vector.push_back(i);
+    }
+    if (ranked_index_vector.empty()) return;
+    stable_sort(ranked_index_vector.begin(), ranked_index_vector.end(),
+                [&candidate_period_vec](int a, int b) -> bool {
+                    return candidate_period_vec[a].logL_rc > candidate_period_vec[b].logL_rc; });
+    double best_logL_rc = candidate_period_vec[ranked_index_vector[0]].logL_rc;
+    int no_of_pruned = 0;
+    for (int rank = 0; rank < (int) ranked_index_vector.size(); rank++) {
+        int candidate_period_index = ranked_index_vector[rank];
+        OnePeriod &candidate_period = candidate_period_vec[candidate_period_index];
+        Candidate_Period_Evaluation &evaluation = evaluation_vector[candidate_period_index];
+        double logL_rc_behind = best_logL_rc - candidate_period.logL_rc;
+        if ((_period_top_k > 0 && rank < _period_top_k) ||
+            (_period_logL_rc_margin > 0 && logL_rc_behind <= _period_logL_rc_margin) ||
+            custom_period_id == candidate_period_index + 1) {
+            continue;
+        }
+        candidate_period.pruned = true;
+        candidate_period.best_logL_snp = (-1e99);
+        evaluation.hypothesis_vector.clear();
+        evaluation.model_selection_task_vector.clear();
+        string status_msg = fmt::format(
+                "pruned: logL_rc {} is {} behind the best, rank {} of {}. No SNP logL.\n",
+                candidate_period.logL_rc, logL_rc_behind, rank + 1, ranked_index_vector.size());
+        evaluation.log_out << status_msg;
+        evaluation.details_out << status_msg;
+        no_of_pruned++;
+    }
+    cerr << fmt::format("Pruned {} of {} candidate periods by logL_rc (top_k={}, margin={}).\n",
+                        no_of_pruned, ranked_index_vector.size(), _period_top_k,
+                        _period_logL_rc_margin);
+}
+
 int Infer::output_logL(OnePeriod &best_period_obj,
                        vector<OnePeriod> &period_obj_vector)
 {
@@ -1134,7 +1268,8 @@ int Infer::output_logL(OnePeriod &best_period_obj,
                             << "best_no_of_copy_nos_bf_1st_peak" << "\t"
                             << "first_peak_int" << "\t"
                             << "best_purity" << "\t"
-                            << "best_ploidy" << endl;
+                            << "best_ploidy" << "\t"
+                            << "pruned" << endl;
         vector<OnePeriod>::iterator it = period_obj_vector.begin();
         for (; it != period_obj_vector.end(); it++) {
             OnePeriod period_obj = *it;
@@ -1150,7 +1285,8 @@ int Infer::output_logL(OnePeriod &best_period_obj,
                     << period_obj.best_no_of_copy_nos_bf_1st_peak << "\t"
                     << period_obj.first_peak_int << "\t"
                     << period_obj.best_purity << "\t"
-                    << period_obj.best_ploidy
+                    << period_obj.best_ploidy << "\t"
+                    << period_obj.pruned
                     << endl;
         }
     }
@@ -1177,11 +1313,15 @@ double Infer::getReadDepthFromRegCoeffFile(string inputFname)
     return depth;
 }
 
-double Infer::infer_no_of_copy_nos_bf_1st_peak_for_one_period_by_logL_snp(
-        OnePeriod &candidate_period)
+void Infer::collect_copy_no_hypotheses(OnePeriod &candidate_period,
+                                       Candidate_Period_Evaluation &evaluation)
 {
+    /***
+    The copy number hypotheses (no_of_copy_nos_bf_1st_peak) of one candidate period
+    and the Model_Selection tasks of their segments. The SNP logL of each hypothesis
+    is summed up by infer_no_of_copy_nos_bf_1st_peak_for_one_period_by_logL_snp().
+    ***/
     double purity, ploidy;
-    candidate_period.best_logL_snp = (-1e99);
     int first_peak_int = candidate_period.first_peak_obj.peak_center_int;
     int period_int = candidate_period.period_int;
     //to assign copy number 2 to the peak with the most no_of_windows.
@@ -1190,27 +1330,24 @@ double Infer::infer_no_of_copy_nos_bf_1st_peak_for_one_period_by_logL_snp(
     sort(peak_obj_vector.begin(), peak_obj_vector.end(), peak_greater_no_of_windows());
     OnePeak &tallest_peak = peak_obj_vector[0];
 
-    // null iostream used in model selection output
-    boost::iostreams::stream<boost::iostreams::null_sink> nullOstream((boost::iostreams::null_sink()));
-
     if (_debug>0) {
-        cerr << fmt::format("  Tallest peak index={}, peak_center_int={}, no_of_windows={}.\n",
+        evaluation.log_out << fmt::format("  Tallest peak index={}, peak_center_int={}, no_of_windows={}.\n",
             tallest_peak.peak_index, tallest_peak.peak_center_int,
             tallest_peak.no_of_windows);
 
     }
     if (tallest_peak.peak_index>2){
-        cerr << fmt::format("  WARNING: return now as tallest_peak.peak_index {} is bigger than 2. Not correct.\n",
-                            tallest_peak.peak_index);
+        evaluation.log_out << fmt::format("  WARNING: return now as tallest_peak.peak_index {} is bigger than 2. Not correct.\n",
+                                          tallest_peak.peak_index);
         //something wrong
         //The tallest peak's copy number is more than 2 due to the order of peaks.
-        return candidate_period.best_logL_snp;
+        return;
     }
     int no_of_copy_nos_bf_1st_peak_prior = max(0, 2 - tallest_peak.peak_index);
     //sort the peak_obj_vector back to its original order by peak_center_int
     sort(peak_obj_vector.begin(), peak_obj_vector.end());
     if (_debug>0) {
-        cerr << fmt::format("  First peak's peak_index={}, peak_center_int={}, no_of_windows={}.\n",
+        evaluation.log_out << fmt::format("  First peak's peak_index={}, peak_center_int={}, no_of_windows={}.\n",
             peak_obj_vector[0].peak_index, peak_obj_vector[0].peak_center_int,
             peak_obj_vector[0].no_of_windows);
     }
@@ -1224,11 +1361,9 @@ double Infer::infer_no_of_copy_nos_bf_1st_peak_for_one_period_by_logL_snp(
         max_no_of_copy_nos_bf_1st_peak = no_of_copy_nos_bf_1st_peak_prior;
     }
     if (_debug>0) {
-        cerr << fmt::format("  no_of_copy_nos_bf_1st_peak_prior={}\n  max_no_of_copy_nos_bf_1st_peak={}\n",
-                            no_of_copy_nos_bf_1st_peak_prior, max_no_of_copy_nos_bf_1st_peak);
+        evaluation.log_out << fmt::format("  no_of_copy_nos_bf_1st_peak_prior={}\n  max_no_of_copy_nos_bf_1st_peak={}\n",
+                                          no_of_copy_nos_bf_1st_peak_prior, max_no_of_copy_nos_bf_1st_peak);
     }
-    OneSegmentSNPs oneSegmentSNPs;
-
     int cp_no_two_rc_ratio_int = -1;
     for (int no_of_copy_nos_bf_1st_peak = no_of_copy_nos_bf_1st_peak_prior;
          no_of_copy_nos_bf_1st_peak <= max_no_of_copy_nos_bf_1st_peak;
@@ -1244,17 +1379,47 @@ double Infer::infer_no_of_copy_nos_bf_1st_peak_for_one_period_by_logL_snp(
                 cp_no_two_rc_ratio_int, period_int, purity, ploidy);
         if (ploidy < MIN_PLOIDY || ploidy > MAX_PLOIDY) continue;
         if (purity >= 1 && purity < 1.1) {
-            cerr << fmt::format("WARNING: purity = {}, set to 0.99\n", purity);
+            evaluation.log_out << fmt::format("WARNING: purity = {}, set to 0.99\n", purity);
             purity=0.99;
         } else if (purity <= 0 && purity > -0.1){
-            cerr << fmt::format("WARNING: purity = {}, set to 0.03\n", purity);
+            evaluation.log_out << fmt::format("WARNING: purity = {}, set to 0.03\n", purity);
             purity=0.03;
         }
         
         if (purity >= 1.1 || purity <= -0.1) {
-            cerr << fmt::format("WARNING: purity = {}, skip\n", purity);
+            evaluation.log_out << fmt::format("WARNING: purity = {}, skip\n", purity);
             continue; 
         }
+        evaluation.hypothesis_vector.push_back(Copy_No_Hypothesis{
+                no_of_copy_nos_bf_1st_peak, cp_no_two_rc_ratio_int, purity, ploidy});
+        for (unsigned int peak_index = 0; peak_index < candidate_period.no_of_peaks_for_logL;
+             peak_index++) {
+            OnePeak &peak_obj = peak_obj_vector[peak_index];
+            if (peak_obj.no_of_snps <= 5) continue;
+            for (const OneSegment &oneSegment : peak_obj.segment_obj_vector) {
+                if (oneSegment.oneSegmentSNPs.no_of_snps <= 5 ||
+                    calc_logOR_variance(oneSegment.oneSegmentSNPs.logOR_list) <= 0)
+                    continue;
+                evaluation.model_selection_task_vector.push_back(make_model_selection_task(
+                        oneSegment, no_of_copy_nos_bf_1st_peak + peak_index, purity));
+            }
+        }
+    }  // each possible copy number status (no_of_copy_nos_bf_1st_peak)
+}
+
+double Infer::infer_no_of_copy_nos_bf_1st_peak_for_one_period_by_logL_snp(
+        OnePeriod &candidate_period, Candidate_Period_Evaluation &evaluation)
+{
+    /***
+    The segments of evaluation.model_selection_task_vector must have been fitted.
+    ***/
+    candidate_period.best_logL_snp = (-1e99);
+    int period_int = candidate_period.period_int;
+    vector<OnePeak> &peak_obj_vector = candidate_period.peak_obj_vector;
+    for (const Copy_No_Hypothesis &hypothesis : evaluation.hypothesis_vector) {
+        int no_of_copy_nos_bf_1st_peak = hypothesis.no_of_copy_nos_bf_1st_peak;
+        double purity = hypothesis.purity;
+        double ploidy = hypothesis.ploidy;
         // reset
         double logL_snp = 0.0;
         candidate_period.ResetSNPCounters();
@@ -1273,15 +1438,11 @@ double Infer::infer_no_of_copy_nos_bf_1st_peak_for_one_period_by_logL_snp(
             for (; one_segment_iterator !=
                    peak_obj_vector[peak_index].segment_obj_vector.end();
                    one_segment_iterator++) {
-                oneSegmentSNPs = one_segment_iterator->oneSegmentSNPs;
+                const OneSegmentSNPs &oneSegmentSNPs = one_segment_iterator->oneSegmentSNPs;
                 if (oneSegmentSNPs.no_of_snps <= 5)
                     continue;
                 //if all logOR in the segments is the same value, skip.
-                double mean = std::accumulate(oneSegmentSNPs.logOR_list.begin(),
-                    oneSegmentSNPs.logOR_list.end(),0.0)*1.0/oneSegmentSNPs.logOR_list.size();
-                double var = std::accumulate(oneSegmentSNPs.logOR_list.begin(), 
-                    oneSegmentSNPs.logOR_list.end(), 0.0, [&mean](double x, double y)
-                    {return x+std::pow(y-mean, 2);})/oneSegmentSNPs.logOR_list.size();
+                double var = calc_logOR_variance(oneSegmentSNPs.logOR_list);
                 if(var <= 0) {
                     cerr << "For segments: chr" << one_segment_iterator->chr_index + 1<< ": "
                          << one_segment_iterator->start_pos << "-"
@@ -1291,23 +1452,22 @@ double Infer::infer_no_of_copy_nos_bf_1st_peak_for_one_period_by_logL_snp(
                     exit(3);
                 }
                 
-                Model_Selection model_selection(oneSegmentSNPs.logOR_list, cp, 
-                                  purity, oneSegmentSNPs.coverage, nullOstream);
-                model_selection.run();
+                const Result &model_selection_result = _model_selection_cache.get(
+                        make_model_selection_task(*one_segment_iterator, cp, purity));
                 candidate_period.no_of_snps += oneSegmentSNPs.no_of_snps;
-                logL_snp += model_selection.result.best_logL;
-                logL_of_one_logOR_peak += model_selection.result.best_logL;
+                logL_snp += model_selection_result.best_logL;
+                logL_of_one_logOR_peak += model_selection_result.best_logL;
             }
             if (_debug) {
-                _snp_logL_outf << period_int << "\t"
-                                << no_of_copy_nos_bf_1st_peak << "\t"
-                                << peak_index << "\t"
-                                << peak_obj.no_of_logOR_peaks << "\t"
-                                << logL_snp << "\t"
-                                << logL_of_one_logOR_peak << "\t"
-                                << peak_obj.no_of_snps << "\t"
-                                << candidate_period.no_of_logOR_peaks
-                                << endl;  
+                evaluation.snp_logL_out << period_int << "\t"
+                                        << no_of_copy_nos_bf_1st_peak << "\t"
+                                        << peak_index << "\t"
+                                        << peak_obj.no_of_logOR_peaks << "\t"
+                                        << logL_snp << "\t"
+                                        << logL_of_one_logOR_peak << "\t"
+                                        << peak_obj.no_of_snps << "\t"
+                                        << candidate_period.no_of_logOR_peaks
+                                        << endl;  
                 
             }  // all logOR peaks of one rc_peak
 
@@ -1340,7 +1500,7 @@ double Infer::infer_no_of_copy_nos_bf_1st_peak_for_one_period_by_logL_snp(
                     no_of_copy_nos_bf_1st_peak;
             candidate_period.best_purity = purity;
             candidate_period.best_ploidy = ploidy;
-            candidate_period.rc_ratio_int_of_cp_2 = cp_no_two_rc_ratio_int;
+            candidate_period.rc_ratio_int_of_cp_2 = hypothesis.cp_no_two_rc_ratio_int;
             candidate_period.best_logL_snp_penalty = snp_logL_penalty;
             candidate_period.best_logL_snp_no_of_parameters =
                     candidate_period.no_of_logOR_peaks;
@@ -1363,7 +1523,7 @@ double Infer::calc_one_peak_logL_rc(float peak_center_float, OnePeak &peak_obj,
         int ratio_int = peak_obj.segment_rc_ratio_vector[i];
         vector<OneSegment>::iterator it = _rc_ratio_segments[ratio_int].begin();
         for (; it != _rc_ratio_segments[ratio_int].end(); it++) {
-            OneSegment oneSegment = *it;
+            const OneSegment &oneSegment = *it;
             float rc_ratio = oneSegment.rc_ratio;
             double stddev = oneSegment.stddev;
             int no_of_windows = oneSegment.no_of_windows;
@@ -1417,51 +1577,102 @@ int Infer::getSNPDataFromFile(string input_file_path)
         cerr << input_file_path << " does not exist. ERROR!" << endl;
         exit(3);
     }
-    ifstream input_file;
-    input_file.open(input_file_path.c_str(), std::ios::in | std::ios::binary);
-    boost::iostreams::filtering_streambuf<boost::iostreams::input> input_filter_stream_buffer;
-    input_filter_stream_buffer.push(boost::iostreams::gzip_decompressor());
-    input_filter_stream_buffer.push(input_file);
-    std::istream input_stream(&input_filter_stream_buffer);
-
-    string line, chr_string;
-    int loc, chr_index, coverage;
-    double tumor_ao, tumor_ro, normal_ao, normal_ro;
-    float logOR;
+    int no_of_threads = _model_selection_cache.no_of_threads;
+    string content = read_whole_file(input_file_path, no_of_threads);
+    // reading stops at the first empty line.
+    size_t content_size = content.find("\n\n");
+    content_size = (content_size == string::npos) ? content.size() : content_size + 1;
+    if (!content.empty() && content[0] == '\n') {
+        content_size = 0;
+    }
+    const char *content_start = content.c_str();
+    const char *content_end = content_start + content_size;
+
+    // the content is cut into chunks at line ends. Chunks are parsed in parallel and
+    //  their SNPs appended to _SNPs in chunk order.
+    int no_of_chunks =
+        (no_of_threads > 1) ? std::min(no_of_threads * 4, (int) (content_size >> 16) + 1) : 1;
+    vector<const char *> chunk_start_vector(1, content_start);
+    for (int i = 1; i < no_of_chunks; i++) {
+        const char *p = std::max(chunk_start_vector.back(),
+                                 content_start + content_size / no_of_chunks * i);
+        const char *line_end = (const char *) memchr(p, '\n', content_end - p);
+        chunk_start_vector.push_back(line_end == NULL ? content_end : line_end + 1);
+    }
+    chunk_start_vector.push_back(content_end);
+    vector<vector<vector<OneSNP> > > chunk_snps_vector(no_of_chunks);
+    vector<int> chunk_no_of_lines_vector(no_of_chunks, 0);
+    run_in_parallel(no_of_chunks, no_of_threads, [&](int chunk_index) {
+        vector<vector<OneSNP> > &chunk_snps = chunk_snps_vector[chunk_index];
+        chunk_snps.resize(_SNPs.size());
+        vector<const char *> field_vector;
+        const char *chunk_end = chunk_start_vector[chunk_index + 1];
+        for (const char *p = chunk_start_vector[chunk_index]; p < chunk_end;) {
+            const char *line_end = (const char *) memchr(p, '\n', chunk_end - p);
+            if (line_end == NULL) {
+                line_end = chunk_end;
+            }
+            const char *line = p;
+            p = line_end + 1;
+            chunk_no_of_lines_vector[chunk_index]++;
+            if (*line == '#' || split_line(line, line_end, '\t', field_vector) < 8 ||
+                (strncmp(field_vector[1], "pos", 3) == 0 &&
+                 (field_vector[1] + 3 == line_end || field_vector[1][3] == '\t'))) {
+                //ignore comments and header
+                continue;
+            }
+            const char *chr_start = field_vector[0];
+            if (*chr_start == 'c') {
+                chr_start += 3;
+            }
+            int chr_index = (chr_start < field_vector[1] && *chr_start != '\t')
+                                ? (int) strtol(chr_start, NULL, 10) - 1
+                                : -1;
+            if (chr_index < 0 || chr_index >= (int) chunk_snps.size()) {
+                continue;
+            }
+            int loc = (int) strtol(field_vector[1], NULL, 10);
+            int coverage = (int) strtol(field_vector[2], NULL, 10);
+            double tumor_ro = parse_count(field_vector[3]);
+            double tumor_ao = parse_count(field_vector[4]);
+            double normal_ro = parse_count(field_vector[6]);
+            double normal_ao = parse_count(field_vector[7]);
+            //skip homogenous SNP sites
+            if (tumor_ao == 0 || tumor_ro == 0 || normal_ro == 0 || normal_ao == 0) {
+                continue;
+            }
+            chunk_snps[chr_index].push_back(OneSNP(
+                chr_index, loc, log(tumor_ao / normal_ao / (tumor_ro / normal_ro)), coverage));
+        }
+    });
     _total_no_of_snps = 0;
     int noOfLines = 0;
-
-    std::getline(input_stream, line);
-    while (!line.empty()) {
-        noOfLines++;
-        std::vector<std::string> element_vec = string_split(line, "\t");
-        chr_string = element_vec[0];
-        std::getline(input_stream, line);
-        if (chr_string[0]=='#' || element_vec[1]=="pos") {
-            //ignore comments and header
+    for (int chunk_index = 0; chunk_index < no_of_chunks; chunk_index++) {
+        noOfLines += chunk_no_of_lines_vector[chunk_index];
+    }
+    for (size_t chr_index = 0; chr_index < _SNPs.size(); chr_index++) {
+        if (no_of_chunks == 1 && _SNPs[chr_index].empty()) {
+            _SNPs[chr_index].swap(chunk_snps_vector[0][chr_index]);
+            _total_no_of_snps += _SNPs[chr_index].size();
             continue;
-        } else if (chr_string[0] == 'c') {
-            chr_string = chr_string.substr(3);
         }
-        chr_index = atoi(chr_string.c_str()) - 1;
-        if (chr_index == -1) {
-            continue;
+        size_t no_of_snps = _SNPs[chr_index].size();
+        for (const vector<vector<OneSNP> > &chunk_snps : chunk_snps_vector) {
+            no_of_snps += chunk_snps[chr_index].size();
         }
-        loc = stoi(element_vec[1]);
-        tumor_ro = stod(element_vec[3]);
-        tumor_ao = stod(element_vec[4]);
-        normal_ro = stod(element_vec[6]);
-        normal_ao = stod(element_vec[7]);
-        coverage = stoi(element_vec[2]);
-        //skip homogenous SNP sites
-        if (tumor_ao == 0 || tumor_ro == 0 || normal_ro == 0 || normal_ao == 0) {
-            continue;
+        _SNPs[chr_index].reserve(no_of_snps);
+        for (const vector<vector<OneSNP> > &chunk_snps : chunk_snps_vector) {
+            _SNPs[chr_index].insert(_SNPs[chr_index].end(), chunk_snps[chr_index].begin(),
+                                    chunk_snps[chr_index].end());
+        }
+        _total_no_of_snps += _SNPs[chr_index].size();
+    }
+    // findSNPsWithinSegment() looks SNPs up by binary search.
+    for (vector<OneSNP> &chr_snp_vector : _SNPs) {
+        if (!std::is_sorted(chr_snp_vector.begin(), chr_snp_vector.end(), snp_position_less)) {
+            std::stable_sort(chr_snp_vector.begin(), chr_snp_vector.end(), snp_position_less);
         }
-        OneSNP oneSNP(chr_index, loc, log(tumor_ao/normal_ao/(tumor_ro/normal_ro)), coverage);
-        _SNPs[chr_index].push_back(oneSNP);
-        _total_no_of_snps++;
     }
-    input_file.close();
     cerr << _SNPs.size() << " chromosomes, " << _total_no_of_snps << " SNPs, "
          << noOfLines << " lines." << endl;
     return 0;
@@ -1478,14 +1689,8 @@ int Infer::getSegmentDataFromFile(string input_file_path)
         cerr << input_file_path << " does not exist. ERROR!" << endl;
         exit(3);
     }
-    ifstream input_file;
-    input_file.open(input_file_path.c_str(), std::ios::in | std::ios::binary);
-    boost::iostreams::filtering_streambuf<boost::iostreams::input> input_filter_stream_buffer;
-    input_filter_stream_buffer.push(boost::iostreams::gzip_decompressor());
-    input_filter_stream_buffer.push(input_file);
-    std::istream input_stream(&input_filter_stream_buffer);
+    string content = read_whole_file(input_file_path, _model_selection_cache.no_of_threads);
 
-    string line;
     int start, end, no_of_valid_windows;
     float read_count_ratio;
     double ratio_stddev;
@@ -1501,25 +1706,30 @@ int Infer::getSegmentDataFromFile(string input_file_path)
             noOfWindowsByRatioAndChr[i][chr_index] = 0;
     }
     int noOfLines = 0;
-    std::getline(input_stream, line);
-    while (!line.empty()) {
+    vector<const char *> field_vector;
+    const char *content_end = content.c_str() + content.size();
+    // reading stops at the first empty line.
+    for (const char *p = content.c_str(); p < content_end && *p != '\n';) {
+        const char *line_end = (const char *) memchr(p, '\n', content_end - p);
+        if (line_end == NULL) {
+            line_end = content_end;
+        }
+        const char *line = p;
+        p = line_end + 1;
         noOfLines++;
-        std::vector<std::string> element_vec = string_split(line, "\t");
-
-        chr_string = element_vec[0];
-        std::getline(input_stream, line);
-
-        if (chr_string[0]=='#') {
+        if (*line == '#' || split_line(line, line_end, '\t', field_vector) < 6) {
             //ignore comments
             continue;
         }
+        chr_string.assign(field_vector[0],
+                          (const char *) memchr(field_vector[0], '\t', line_end - field_vector[0]));
         _total_no_of_segments++;
-        start = stoi(element_vec[1]);
-        end = stoi(element_vec[2]);
-        read_count_ratio = stof(element_vec[3]);
+        start = (int) strtol(field_vector[1], NULL, 10);
+        end = (int) strtol(field_vector[2], NULL, 10);
+        read_count_ratio = strtof(field_vector[3], NULL);
         //decrease coverage ratio stddev to enhance signal/noise ratio
-        ratio_stddev = stof(element_vec[4])/_segment_stddev_divider;
-        no_of_valid_windows = stoi(element_vec[5]);
+        ratio_stddev = strtof(field_vector[4], NULL)/_segment_stddev_divider;
+        no_of_valid_windows = (int) strtol(field_vector[5], NULL, 10);
 
         if (_total_no_of_segments % 10000 == 0) {
             cerr << _total_no_of_segments << "\n";
@@ -1552,7 +1762,6 @@ int Infer::getSegmentDataFromFile(string input_file_path)
             _total_no_of_segments_used ++;
         }
     }
-    input_file.close();
     if (_debug > 0) {
         output_segment_ratio(noOfWindowsByRatioAndChr);
     }
@@ -1721,33 +1930,39 @@ int Infer::findSNPsWithinSegment(OneSegment &oneSegment)
         oneSegment.oneSegmentSNPs = OneSegmentSNPs();
         return 0;
     }
-    double maf_sum = 0, maf_ssum = 0, weight, sum_weight = 0, sum_cov = 0, ssum_cov = 0;
-    int total_no_of_snps = 0;
-    vector<OneSNP>::iterator oneSNPIt = _SNPs[oneSegment.chr_index].begin();
-    vector<double> logOR_vector;
-    vector<float> coverage_float_vector;
+    // SNPs within [start_pos, end_pos] are one contiguous slice of the sorted _SNPs.
+    const vector<OneSNP> &chr_snp_vector = _SNPs[oneSegment.chr_index];
+    vector<OneSNP>::const_iterator first_snp_it = std::lower_bound(
+            chr_snp_vector.begin(), chr_snp_vector.end(), oneSegment.start_pos,
+            [](const OneSNP &oneSNP, int position) { return oneSNP.position < position; });
+    vector<OneSNP>::const_iterator last_snp_it = std::upper_bound(
+            first_snp_it, chr_snp_vector.end(), oneSegment.end_pos,
+            [](int position, const OneSNP &oneSNP) { return position < oneSNP.position; });
+    int total_no_of_snps = last_snp_it - first_snp_it;
 
-    for (; oneSNPIt < _SNPs[oneSegment.chr_index].end(); oneSNPIt++) {
-        if (oneSNPIt->position >= oneSegment.start_pos &&
-            oneSNPIt->position <= oneSegment.end_pos) {
-            total_no_of_snps++;
-            logOR_vector.push_back(oneSNPIt->logOR);
-            coverage_float_vector.push_back(oneSNPIt->coverage*1.0);
-        }
-    }
     if (total_no_of_snps <= 10) {
         //not enough SNPs to do robust mean/maf_stddev
         // placeholder to match _rc_ratio_segments, but all values =-1
         oneSegment.oneSegmentSNPs = OneSegmentSNPs();
     } else {
+        vector<double> logOR_vector;
+        logOR_vector.reserve(total_no_of_snps);
+        _snp_coverage_buffer.clear();
+        for (vector<OneSNP>::const_iterator oneSNPIt = first_snp_it; oneSNPIt < last_snp_it; oneSNPIt++) {
+            logOR_vector.push_back(oneSNPIt->logOR);
+            _snp_coverage_buffer.push_back(oneSNPIt->coverage*1.0);
+        }
+        // median coverage, by selection instead of a full sort.
         float coverage;
-        int no_of_snps_to_use=coverage_float_vector.size();
-        int mid = coverage_float_vector.size() / 2;
-        std::sort(coverage_float_vector.begin(),coverage_float_vector.end());
-        if (coverage_float_vector.size() % 2 == 0) {
-            coverage = (coverage_float_vector[mid - 1] + coverage_float_vector[mid]) / 2.0;
+        int no_of_snps_to_use = total_no_of_snps;
+        int mid = total_no_of_snps / 2;
+        std::nth_element(_snp_coverage_buffer.begin(), _snp_coverage_buffer.begin() + mid,
+                         _snp_coverage_buffer.end());
+        if (total_no_of_snps % 2 == 0) {
+            coverage = (*std::max_element(_snp_coverage_buffer.begin(), _snp_coverage_buffer.begin() + mid) +
+                        _snp_coverage_buffer[mid]) / 2.0;
         } else {
-            coverage = coverage_float_vector[mid];
+            coverage = _snp_coverage_buffer[mid];
         }
         //Note: logOR_vector will be moved here, so logOR_vector will become empty vector
         oneSegment.oneSegmentSNPs =
@@ -1780,7 +1995,7 @@ int Infer::refine_peak_center(OnePeak &peak_obj, vector<int> segment_rc_ratio_ve
     int no_of_rc_ratios_of_one_peak = segment_rc_ratio_vector.size();
     for (int i = 0; i < no_of_rc_ratios_of_one_peak; i++) {
         int ratio_int = segment_rc_ratio_vector[i];
-        vector<OneSegment> all_segs_at_one_rc_ratio =
+        const vector<OneSegment> &all_segs_at_one_rc_ratio =
                 _rc_ratio_segments[ratio_int];
         int no_of_segments = all_segs_at_one_rc_ratio.size();
         for (int i = 0; i < no_of_segments; i++) {
@@ -1934,8 +2149,28 @@ double Infer::output_copy_number_segments(OnePeriod &best_period_obj,
 
     int no_of_peaks = peak_obj_vector.size();
     OneSegmentSNPs oneSegmentSNPs;
-    string model_selection_h5 = _output_dir + "/model_selection_log/model_selection.h5";
-    HDF5_Log model_selection_log(model_selection_h5);
+    // all segments in one HDF5 file, only when debugging.
+    std::unique_ptr<HDF5_Log> model_selection_log;
+    if (_debug > 0) {
+        model_selection_log.reset(new HDF5_Log(
+                _output_dir + "/model_selection_log/model_selection.h5"));
+    }
+    // fit the segments of all peaks first, in parallel (most were fitted for the logL already).
+    vector<Model_Selection_Task> model_selection_task_vector;
+    for (int peak_index = 0; peak_index < no_of_peaks; peak_index++) {
+        OnePeak &peak_obj = peak_obj_vector[peak_index];
+        int cp = no_of_copy_nos_bf_1st_peak + peak_index;
+        if (peak_obj.no_of_snps <= 0 || cp / 2 + 1 <= 0)
+            continue;
+        for (const OneSegment &oneSegment : peak_obj.segment_obj_vector) {
+            if (oneSegment.oneSegmentSNPs.no_of_snps <= 0 ||
+                calc_logOR_variance(oneSegment.oneSegmentSNPs.logOR_list) <= 0)
+                continue;
+            model_selection_task_vector.push_back(make_model_selection_task(
+                    oneSegment, cp, best_period_obj.best_purity));
+        }
+    }
+    _model_selection_cache.run(model_selection_task_vector);
     for (int peak_index = 0; peak_index < no_of_peaks; peak_index++) {
         OnePeak &peak_obj = peak_obj_vector[peak_index];
         int cp = no_of_copy_nos_bf_1st_peak + peak_index;
@@ -1968,11 +2203,7 @@ double Infer::output_copy_number_segments(OnePeriod &best_period_obj,
             if (oneSegmentSNPs.no_of_snps <= 0)
                 continue;
             //if all logOR in the segments is the same value, skip.
-            double mean = std::accumulate(oneSegmentSNPs.logOR_list.begin(), 
-                oneSegmentSNPs.logOR_list.end(),0.0)*1.0/oneSegmentSNPs.logOR_list.size();
-            double var = std::accumulate(oneSegmentSNPs.logOR_list.begin(),
-                oneSegmentSNPs.logOR_list.end(), 0.0, [&mean](double x, double y)
-                    {return x+std::pow(y-mean, 2);})/oneSegmentSNPs.logOR_list.size();
+            double var = calc_logOR_variance(oneSegmentSNPs.logOR_list);
             if(var <= 0) {
                 cerr << "For segments: chr" << one_segment_iterator->chr_index << ": "
                      << one_segment_iterator->start_pos << "-"
@@ -1981,22 +2212,20 @@ double Infer::output_copy_number_segments(OnePeriod &best_period_obj,
                      << "Maybe some error in data, so program exits." << endl;
                 exit(3);
             }
-            string logout = _output_dir + "/model_selection_log/" 
-                            + fmt::format("chr{}_{}_{}", chr_integer, start, end);
-            ofstream model_selection_output(logout.c_str());
-            Model_Selection model_selection(oneSegmentSNPs.logOR_list,
-                cp, best_period_obj.best_purity,
-                oneSegmentSNPs.coverage, model_selection_output);
-            model_selection.run();
-            string segment_name = fmt::format("chr{}_{}_{}", chr_integer, start, end);
-            model_selection_log.write(segment_name, oneSegmentSNPs.logOR_list,
-                model_selection.result);
+            const Result &model_selection_result = _model_selection_cache.get(
+                    make_model_selection_task(oneSegment, cp, best_period_obj.best_purity));
+            if (model_selection_log) {
+                std::sort(oneSegmentSNPs.logOR_list.begin(), oneSegmentSNPs.logOR_list.end());
+                model_selection_log->write(oneSegment.chr_index, start, end, cp,
+                                           best_period_obj.best_purity,
+                                           oneSegmentSNPs.logOR_list, model_selection_result);
+            }
             float cp_float = (oneSegment.get_rc_ratio_high_res() -
                               first_peak_obj.peak_center_int) *
                              1.0 / best_period_int +
                              no_of_copy_nos_bf_1st_peak;
-            int major_allele_cp = max(model_selection.result.selection.first,
-                                      model_selection.result.selection.second);
+            int major_allele_cp = max(model_selection_result.selection.first,
+                                      model_selection_result.selection.second);
 
             outf << chr_integer << "\t"
                  << start << "\t"
@@ -2013,6 +2242,25 @@ double Infer::output_copy_number_segments(OnePeriod &best_period_obj,
     // 20171213 not sure of segment_stddev_multiplier,
     //  maybe because segment MAD was reduced in segmentation.
     cerr << "For subclone regions" << endl;
+    // same conditions as the fits in the loop below.
+    model_selection_task_vector.clear();
+    for (int ratio_int = 0; ratio_int <= MAX_RATIO_RANGE_HIGH_RES; ratio_int++) {
+        if (is_ratio_looked[ratio_int])
+            continue;
+        for (const OneSegment &oneSegment : _rc_ratio_segments[ratio_int]) {
+            double cp_float =
+                    (ratio_int - first_peak_int) * 1.0 / best_period_int +
+                    no_of_copy_nos_bf_1st_peak;
+            int cp = int(cp_float) + (cp_float - int(cp_float) > 0.5 ? 1 : 0);
+            if (abs(cp - cp_float) > 0.1 || cp < 0 ||
+                oneSegment.oneSegmentSNPs.no_of_snps <= 0 ||
+                calc_logOR_variance(oneSegment.oneSegmentSNPs.logOR_list) <= 0)
+                continue;
+            model_selection_task_vector.push_back(make_model_selection_task(
+                    oneSegment, cp, best_period_obj.best_purity));
+        }
+    }
+    _model_selection_cache.run(model_selection_task_vector);
     for (int ratio_int = 0; ratio_int <= MAX_RATIO_RANGE_HIGH_RES; ratio_int++) {
         if (is_ratio_looked[ratio_int])
             continue;
@@ -2082,11 +2330,7 @@ double Infer::output_copy_number_segments(OnePeriod &best_period_obj,
                     continue;
                 }
                 //if all logOR in the segments is the same value, skip.
-                double mean = std::accumulate(oneSegmentSNPs.logOR_list.begin(),
-                    oneSegmentSNPs.logOR_list.end(),0.0)*1.0/oneSegmentSNPs.logOR_list.size();
-                double var = std::accumulate(oneSegmentSNPs.logOR_list.begin(),
-                    oneSegmentSNPs.logOR_list.end(), 0.0, [&mean](double x, double y)
-                        {return x+std::pow(y-mean, 2);})/oneSegmentSNPs.logOR_list.size();
+                double var = calc_logOR_variance(oneSegmentSNPs.logOR_list);
                 if(var <= 0) {
                     cerr << "For segments: chr" << chr_integer << ": "
                          << start << "-"
@@ -2095,18 +2339,16 @@ double Infer::output_copy_number_segments(OnePeriod &best_period_obj,
                         << "Maybe some error in data, so program exits." << endl;
                     exit(3);
                 }
-                string logout = _output_dir + "/model_selection_log/" 
-                                + fmt::format("chr{}_{}_{}", chr_integer, start, end);
-                ofstream model_selection_output(logout.c_str());
-                Model_Selection model_selection(oneSegmentSNPs.logOR_list, cp,
-                    best_period_obj.best_purity,
-                    oneSegmentSNPs.coverage, model_selection_output);
-                model_selection.run();
-                string segment_name = fmt::format("chr{}_{}_{}", chr_integer, start, end);
-                model_selection_log.write(segment_name, oneSegmentSNPs.logOR_list,
-                    model_selection.result);
-                int major_allele_cp = max(model_selection.result.selection.first,
-                    model_selection.result.selection.second);
+                const Result &model_selection_result = _model_selection_cache.get(
+                        make_model_selection_task(oneSegment, cp, best_period_obj.best_purity));
+                if (model_selection_log) {
+                    std::sort(oneSegmentSNPs.logOR_list.begin(), oneSegmentSNPs.logOR_list.end());
+                    model_selection_log->write(oneSegment.chr_index, start, end, cp,
+                                               best_period_obj.best_purity,
+                                               oneSegmentSNPs.logOR_list, model_selection_result);
+                }
+                int major_allele_cp = max(model_selection_result.selection.first,
+                    model_selection_result.selection.second);
 
                 outf << chr_integer << "\t"
                      << start << "\t"
@@ -2141,6 +2383,10 @@ double Infer::output_copy_number_segments(OnePeriod &best_period_obj,
     out_interval.close();
     cerr << "CNV output done. ploidy_cnv_all=" << _ploidy_cnv_all
         << " ploidy_clonal=" << _ploidy_clonal << "\n";
+    cerr << "Model_Selection: " << _model_selection_cache.no_of_fits << " fits for "
+        << _model_selection_cache.no_of_lookups << " segment lookups, "
+        << _model_selection_cache.no_of_em_iterations << " EM iterations, "
+        << _model_selection_cache.no_of_threads << " threads.\n";
     return _ploidy_cnv_all;
 }
 
@@ -2150,7 +2396,10 @@ int main(int argc, char **argv)
                       atof(argv[5]),
                       atoi(argv[6]), atof(argv[7]),
                       atoi(argv[8]),
-                      atoi(argv[9]), atoi(argv[10]),argv[11], atoi(argv[12]));
+                      atoi(argv[9]), atoi(argv[10]),argv[11], atoi(argv[12]),
+                      argc > 13 ? atoi(argv[13]) : 1,
+                      argc > 14 ? atoi(argv[14]) : 0,
+                      argc > 15 ? atof(argv[15]) : 0);
     int returnCode = infInstance.run();
     exit(returnCode);
 }
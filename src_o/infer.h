@@ -22,6 +22,7 @@
 #include "BaseGADA.h"
 #include "read_para.h"
 #include "prob.h"
+#include "model_selection.h"
 
 using namespace std;
 
@@ -29,6 +30,10 @@ inline bool larger(double a, double b) {
     return a > b;
 }
 
+inline bool snp_position_less(const OneSNP &a, const OneSNP &b) {
+    return a.position < b.position;
+}
+
 class OnePeak {
    public:
     OnePeak() : no_of_windows(0), no_of_snps(0) {
@@ -99,6 +104,7 @@ class OnePeriod {
         purity_corrected = -1.0;
         ploidy_corrected = -1.0;
         no_of_peaks_for_logL = 0;
+        pruned = false;
     }
 
     OnePeriod(int period_int, int lower_bound_int, int upper_bound_int)
@@ -120,6 +126,7 @@ class OnePeriod {
         ploidy_corrected = -1.0;
         best_logL_snp = -1E-99;
         no_of_peaks_for_logL;
+        pruned = false;
     }
 
     int getWidth() {
@@ -170,6 +177,8 @@ class OnePeriod {
     vector<double> ploidy_vector;
     vector<int> no_of_copy_nos_bf_1st_peak_vector;
     vector<OnePeak> peak_obj_vector;
+    // no SNP logL: its logL_rc is too far behind the best candidate's.
+    bool pruned;
     //sort in ascending order by auto_cor_value
     bool operator < (const OnePeriod& other_period) const {
         return (auto_cor_value < other_period.auto_cor_value);
@@ -183,6 +192,26 @@ class OnePeriod {
 
 
 
+// a copy number assignment of the peaks of one candidate period, i.e. its purity and ploidy.
+struct Copy_No_Hypothesis {
+    int no_of_copy_nos_bf_1st_peak;
+    int cp_no_two_rc_ratio_int;
+    double purity;
+    double ploidy;
+};
+
+// infer_best_period_by_logL() evaluates the candidate periods in parallel and writes
+//  what each one outputs from these buffers, in candidate order.
+struct Candidate_Period_Evaluation {
+    bool has_windows = false;
+    vector<Copy_No_Hypothesis> hypothesis_vector;
+    vector<Model_Selection_Task> model_selection_task_vector;
+    ostringstream log_out;       // cerr
+    ostringstream details_out;   // _infer_details_outf
+    ostringstream rc_logL_out;   // _rc_logL_outf
+    ostringstream snp_logL_out;  // _snp_logL_outf
+};
+
 class Infer {
    public:
     Infer(string configFilepath, string segment_data_input_path,
@@ -190,7 +219,8 @@ class Infer {
           float segment_stddev_divider,
           int snp_coverage_min, float snp_coverage_var_vs_mean_ratio,
           int no_of_peaks_for_logL,
-          int debug, int auto_, string refdictFilepath, int custom_period_id);
+          int debug, int auto_, string refdictFilepath, int custom_period_id,
+          int no_of_threads = 1, int period_top_k = 0, double period_logL_rc_margin = 0);
     ~Infer();
     int run();
 
@@ -207,10 +237,11 @@ class Infer {
     int infer_candidate_period_by_autocor(OnePeriod &period_obj);
     void calc_autocor_shift_diff(double* all_diff, double &left_x, double &right_x);
     vector<OnePeriod> infer_candidate_period_by_GADA(double* all_diff, double left_x, double right_x, int run_type);
-    OnePeak find_first_peak_ab_init(int candidate_period_int);
+    OnePeak find_first_peak_ab_init(int candidate_period_int, ostream &log_out);
     OnePeak find_first_peak_given_bounds(int candidate_period_int,
                                          int first_peak_lower_bound_int,
-                                         int first_peak_upper_bound_int);
+                                         int first_peak_upper_bound_int,
+                                         ostream &log_out);
     OnePeak refine_first_peak(int candidate_period_int,
                               OnePeak &first_peak_obj);
     int chrStr_to_index(string);
@@ -219,6 +250,10 @@ class Infer {
     int output_peak_bounds(vector<OnePeak> &peak_obj_vector);
 
     OnePeriod infer_best_period_by_logL(vector<OnePeriod> &candidate_period_vec);
+    void evaluate_candidate_period_by_rc(OnePeriod &candidate_period,
+                                         Candidate_Period_Evaluation &evaluation);
+    void prune_candidate_periods_by_logL_rc(vector<OnePeriod> &candidate_period_vec,
+                                            vector<Candidate_Period_Evaluation> &evaluation_vector);
 
     int output_logL(OnePeriod &best_period_obj,
                    vector<OnePeriod> &period_obj_vector);
@@ -228,8 +263,10 @@ class Infer {
         int cp_no_two_rc_ratio_int, int period_int, double &purity,
         double &ploidy);
 
+    void collect_copy_no_hypotheses(OnePeriod &candidate_period,
+                                    Candidate_Period_Evaluation &evaluation);
     double infer_no_of_copy_nos_bf_1st_peak_for_one_period_by_logL_snp(
-        OnePeriod &candidate_period);
+        OnePeriod &candidate_period, Candidate_Period_Evaluation &evaluation);
     double getReadDepthFromRegCoeffFile(string inputFname);
 
     int refine_peak_center(OnePeak &peak_obj, vector<int> segment_rc_ratio_vector,
@@ -255,13 +292,21 @@ class Infer {
     int _auto;
     int _returnCode;
     int custom_period_id; // user specify period to use
+    // >0: the SNP logL of only the top k candidate periods by logL_rc.
+    int _period_top_k;
+    // >0: the SNP logL of only the candidate periods whose logL_rc is within this of the best.
+    //  If both are set, a candidate is kept if either keeps it.
+    double _period_logL_rc_margin;
 
     Config _config;
     RefDictInfo ref_dict_info;
 
 
     Prob _probInstance;
-    vector<vector<OneSNP> > _SNPs;                   // indexed by chromosomes
+    // Model_Selection results of all candidate periods and of the output, fitted in parallel.
+    Model_Selection_Cache _model_selection_cache;
+    vector<vector<OneSNP> > _SNPs;                   // indexed by chromosomes, sorted by position
+    vector<float> _snp_coverage_buffer;  // findSNPsWithinSegment, reused across segments
     vector<vector<OneSegment> > _rc_ratio_segments;  // vector of segments at
                                                      // each
     // rc_ratio (high-resolution)
@@ -295,6 +340,7 @@ class Infer {
 
     ofstream _rc_logL_outf;
     ofstream _snp_logL_outf;
+    ofstream _model_selection_iteration_outf;
     ofstream _sub_outf;
     ofstream _sub_peak_outf;
 
@@ -10,7 +10,7 @@ from argparse import ArgumentParser
 import logging
 import os
 import sys
-from subprocess import Popen
+from subprocess import Popen, PIPE
 import shutil,re 
 from datetime import datetime, timedelta
 from pyflow import WorkflowRunner
@@ -24,7 +24,12 @@ class MainFlow(WorkflowRunner):
         no_of_autosomes=22,
         clean=False,
         step=0, debug=False, auto=1,
-        max_no_of_peaks_for_logL=3, nCores=4, custom_period_id=0, **keywords):
+        max_no_of_peaks_for_logL=3, nCores=4, custom_period_id=0,
+        gc_index_dir=None, tumor_coverage=None, normal_coverage=None,
+        tumor_allele_counts=None, normal_allele_counts=None, pon_dir=None,
+        snp_caller="strelka", snp_site_tier="full", segment_coarse_bin_size=0,
+        segment_chunk_size=0, segment_init_breakpoints=None,
+        period_top_k=0, period_logL_rc_margin=0, **keywords):
         self.configure_filepath = configure_filepath
         self.tumor_bam = tumor_bam
         self.normal_bam = normal_bam
@@ -42,6 +47,37 @@ class MainFlow(WorkflowRunner):
         self.nCores = nCores
         self.strelka_cores = max(1, self.nCores-2)
         self.custom_period_id = custom_period_id
+        #None: use ref_folder_path/gc_index if it exists.
+        self.gc_index_dir = gc_index_dir
+        #precomputed inputs. If given, the BAM-based normalize/SNP-calling is skipped.
+        self.tumor_coverage = tumor_coverage
+        self.normal_coverage = normal_coverage
+        self.tumor_allele_counts = tumor_allele_counts
+        self.normal_allele_counts = normal_allele_counts
+        #tumor-only: a panel of normals made by 'maestre build_pon' replaces the normal.
+        self.pon_dir = pon_dir
+        self.tumor_only = bool(pon_dir)
+        self.use_coverage_tracks = bool(tumor_coverage and (normal_coverage or pon_dir))
+        #tumor-only without --tumor_allele_counts: they are counted from the tumor BAM.
+        self.use_allele_counts = bool(tumor_allele_counts and normal_allele_counts) or \
+            self.tumor_only
+        #strelka: germline calling of both BAMs. allele_count: count alleles at snp_sites.gz.
+        self.snp_caller = snp_caller
+        #full: snp_sites.gz. auto or N: a thinned tier made by 'maestre thin_sites'.
+        self.snp_site_tier = snp_site_tier
+        #auto tier: spacing (bp) * coverage at most this.
+        self.auto_tier_spacing_coverage_product = 20000
+        self.snp_sites_filepath = None
+        #>1: GADA coarse-to-fine mode (SBL on binned ratios first).
+        self.segment_coarse_bin_size = segment_coarse_bin_size
+        #>0: GADA segments chunks of a chromosome in parallel.
+        self.segment_chunk_size = segment_chunk_size
+        #all_segments.tsv.gz of a previous run: GADA re-runs SBL only where the ratios changed.
+        self.segment_init_breakpoints = os.path.abspath(segment_init_breakpoints) \
+            if segment_init_breakpoints else None
+        #>0: infer computes the SNP logL of only the best candidate periods by read count logL.
+        self.period_top_k = period_top_k
+        self.period_logL_rc_margin = period_logL_rc_margin
 
         if not os.path.isdir(self.output_dir):
             os.mkdir(self.output_dir)
@@ -73,6 +109,8 @@ class MainFlow(WorkflowRunner):
 
         if self.snp_output_dir:
             self.strelka_output_dir = self.snp_output_dir
+        elif self.use_allele_counts:
+            self.strelka_output_dir = os.path.join(self.output_dir, "strelka_snp")
         else:
             self.strelka_output_dir = os.path.join(
                 os.path.split(self.tumor_bam)[0], "strelka_snp")
@@ -117,7 +155,72 @@ class MainFlow(WorkflowRunner):
             self.samtools_path = lines[3].strip().split("\t")[1]
             self.strelka_path = lines[4].strip().split("\t")[1]
             self.binary_folder = lines[5].strip().split("\t")[1]
+        if self.gc_index_dir is None:
+            gc_index_dir = os.path.join(self.ref_folder_path, "gc_index")
+            if os.path.isdir(gc_index_dir):
+                self.gc_index_dir = gc_index_dir
     
+    def estimateCoverage(self):
+        #mapped reads*read length/genome length, from the BAM index. None if unavailable.
+        bam = self.normal_bam or self.tumor_bam
+        if not bam or not os.path.isfile(bam + ".bai"):
+            return None
+        p = Popen([self.samtools_path, "idxstats", bam], stdout=PIPE)
+        output = p.communicate()[0]
+        if p.returncode != 0:
+            return None
+        genome_len = 0
+        no_of_mapped_reads = 0
+        for line in output.decode().splitlines():
+            fields = line.split("\t")
+            if fields[0] == "*":
+                continue
+            genome_len += int(fields[1])
+            no_of_mapped_reads += int(fields[2])
+        if genome_len == 0:
+            return None
+        return no_of_mapped_reads*float(self.read_len)/genome_len
+
+    def selectSNPSites(self):
+        #A thinned tier genotypes fewer sites, so segments get fewer SNPs for the
+        #   logOR/MAF estimate. auto thins low-coverage runs, which are shallow screens
+        #   where SNP calling time matters more than SNP precision: it picks the sparsest
+        #   tier with spacing <= auto_tier_spacing_coverage_product/coverage bp, and keeps
+        #   the full panel if no tier qualifies (above 20x when the densest tier is 1kb).
+        self.snp_sites_filepath = os.path.join(self.ref_folder_path, "snp_sites.gz")
+        if self.snp_site_tier == "full":
+            return
+        tier_list_filepath = os.path.join(self.ref_folder_path, "snp_sites.tiers.tsv")
+        if not os.path.isfile(tier_list_filepath):
+            sys.stderr.write("%s does not exist. Use the full snp_sites.gz.\n" %
+                tier_list_filepath)
+            return
+        tier2spacing_file = {}
+        with open(tier_list_filepath, 'r') as f:
+            for line in f:
+                if line.startswith("#") or line.startswith("tier"):
+                    continue
+                fields = line.strip().split("\t")
+                tier2spacing_file[int(fields[0])] = (int(fields[1]), fields[3])
+        if self.snp_site_tier == "auto":
+            coverage = self.estimateCoverage()
+            tier = None
+            if coverage:
+                for one_tier, (spacing, _) in sorted(tier2spacing_file.items()):
+                    if spacing <= self.auto_tier_spacing_coverage_product/coverage:
+                        tier = one_tier
+            sys.stderr.write("Estimated coverage: %s. SNP site tier: %s.\n" %
+                (coverage, tier if tier else "full"))
+            if tier is None:
+                return
+        else:
+            tier = int(self.snp_site_tier)
+            if tier not in tier2spacing_file:
+                logging.error("SNP site tier %s is not in %s!" % (tier, tier_list_filepath))
+                sys.exit(2)
+        self.snp_sites_filepath = os.path.join(self.ref_folder_path,
+            tier2spacing_file[tier][1])
+
     def readDictFile(self):
         ref_dict_filename = os.path.join(self.ref_folder_path, "genome.dict")
         chromosomeNames = []
@@ -180,15 +283,14 @@ class MainFlow(WorkflowRunner):
         #       pyflow_dir)
         #	shutil.rmtree(pyflow_dir)
 
-        tumor_idx = self.tumor_bam + ".bai"
-        normal_idx = self.normal_bam + ".bai"
-        if not os.path.isfile(tumor_idx):
+        #BAMs are not needed if both coverage and allele counts are given.
+        if self.tumor_bam and not os.path.isfile(self.tumor_bam + ".bai"):
             cmd = self.samtools_path + " index " + self.tumor_bam
         else:
             cmd = None
         indexTumorBamJob = self.addTask("indexTumorBam", cmd)
 
-        if not os.path.isfile(normal_idx):
+        if self.normal_bam and not os.path.isfile(self.normal_bam + ".bai"):
             cmd = self.samtools_path + " index " + self.normal_bam
         else:
             cmd = None
@@ -199,21 +301,20 @@ class MainFlow(WorkflowRunner):
         ############################################################
         # STEP 1: SNP calling                                      #
         ############################################################
-        if self.step <= 1:
+        if self.step <= 1 and not self.use_allele_counts and self.snp_caller == "strelka":
             self.startTimeList.append(datetime.now())
             status_string = "Last step time span: %s\n" % \
                 (self.startTimeList[-1] - self.startTimeList[-2])
             status_string += "step 1: call SNPs.\n\tStart time: %s\n"%\
                 self.startTimeList[-1]
             sys.stderr.write(status_string)
-            oneThousandSNPFilepath = os.path.join(self.ref_folder_path, "snp_sites.gz")
             #input: tumor bam
             #output: self.vcf_tumor_file_path
             cmd = f"{self.strelka_path}/bin/configureStrelkaGermlineWorkflow.py "\
                 f"--bam {self.normal_bam} "\
                 f"--bam {self.tumor_bam} "\
                 f"--ref {os.path.join(self.ref_folder_path, 'genome.fa')} "\
-                f"--callRegions {oneThousandSNPFilepath} --runDir {self.strelka_output_dir}"
+                f"--callRegions {self.snp_sites_filepath} --runDir {self.strelka_output_dir}"
             strelka_prepare_job = self.addTask("strelka_prepare", cmd,
                 dependencies=[indexNormalBamJob, indexTumorBamJob])
             cmd = f"{self.strelka_output_dir}/runWorkflow.py -m local -j {self.strelka_cores}"
@@ -246,13 +347,30 @@ class MainFlow(WorkflowRunner):
             #   tumor/normal.cov.adj.factor.txt
             reg_input_base_filename = "reg.in.txt"
             reg_output_base_filename = "reg.out.txt"
+            gc_index_option = ""
+            if self.gc_index_dir:
+                gc_index_option = f"--gc_index_dir {self.gc_index_dir} "
+            if self.tumor_only:
+                pon_coverage_filepath = os.path.join(self.pon_dir,
+                    "pon.coverage.w%s.tsv.gz"%self.window_size)
+                normal_option = f"--pon_file {pon_coverage_filepath} "
+            elif self.use_coverage_tracks:
+                normal_option = f"-n {self.normal_coverage} "
+            else:
+                normal_option = f"-n {self.normal_bam} "
+            if self.use_coverage_tracks:
+                coverage_input_option = f"-t {self.tumor_coverage} {normal_option}"\
+                    f"--input_format bedgraph "
+            else:
+                coverage_input_option = f"-t {self.tumor_bam} {normal_option}"
             cmd = f'{os.path.join(self.binary_folder, "maestre")} normalize '\
-                f'-t {self.tumor_bam} -n {self.normal_bam} '\
+                f'{coverage_input_option}'\
                 f'--genome_dict_path {os.path.join(self.ref_folder_path, "genome.dict")} '\
                 f'-w {self.window_size} -l {self.read_len} '\
                 f'--smooth_window_half_size {self.smooth_window_half_size} '\
                 f'--max_coverage {self.max_coverage} --debug {self.debug} '\
                 f'--no_of_autosomes {self.no_of_autosomes} '\
+                f'{gc_index_option}'\
                 f'-o {self.output_dir} 2>&1 | tee -a {self.infer_status_out_path}'
             normalize_jobs.append(self.addTask("normalize", cmd,
                 dependencies=[indexTumorBamJob, indexNormalBamJob]))
@@ -278,16 +396,16 @@ class MainFlow(WorkflowRunner):
             plot_coverage_job = self.addTask("plot_tumor_normal_coverage", cmd,
                 dependencies=normalize_jobs)
 
-            """
-            #plot GC normalization png
-            cmd = "%s -r %s -a %s -o %s" % (
-                os.path.join(self.binary_folder, "plot_GC_normalization.py"),
-                os.path.join(self.output_dir, "reg.in.txt"),
-                os.path.join(self.output_dir, "cov.adj.factor.txt"),
-                os.path.join(self.output_dir, "plot.gc.adj.png"))
-            plot_gc_adjust_tumor_job = self.addTask("plot_gc_correction", 
-                cmd, dependencies=normalize_jobs)
-            """
+            if self.gc_index_dir:
+                #plot GC normalization png
+                for sample_label in (["tumor"] if self.tumor_only else ["tumor", "normal"]):
+                    cmd = "%s -r %s -a %s -o %s" % (
+                        os.path.join(self.binary_folder, "plot_GC_normalization.py"),
+                        os.path.join(self.output_dir, f"{sample_label}.reg.in.txt"),
+                        os.path.join(self.output_dir, f"{sample_label}.cov.adj.factor.txt"),
+                        os.path.join(self.output_dir, f"plot.gc.adj.{sample_label}.png"))
+                    self.addTask(f"plot_gc_correction_{sample_label}",
+                        cmd, dependencies=normalize_jobs)
 
         ############################################################
         # STEP 3: select heterozygous SNPs                 		#
@@ -303,10 +421,43 @@ class MainFlow(WorkflowRunner):
             sys.stderr.write(status_string)
             #input: self.vcf_tumor_file_path, self.vcf_normal_file_path
             #output: het_snp
-            cmd = f"{os.path.join(self.binary_folder, 'maestre')} "\
-                f"select_het_snp -s {self.two_sample_snp_file} -m 2 -x 200 "\
-                f"--debug 0 -o {self.het_snp_filepath} 2>&1 "\
-                f"| tee -a {self.infer_status_out_path}"
+            if self.tumor_only:
+                pon_het_sites_filepath = os.path.join(self.pon_dir, "pon.het_sites.tsv.gz")
+                tumor_allele_counts = self.tumor_allele_counts
+                cmd = ""
+                if not tumor_allele_counts:
+                    tumor_allele_counts = os.path.join(self.output_dir,
+                        "tumor.allele_counts.tsv.gz")
+                    cmd = f"{os.path.join(self.binary_folder, 'maestre')} "\
+                        f"allele_count -t {self.tumor_bam} -s {self.snp_sites_filepath} "\
+                        f"-r {os.path.join(self.ref_folder_path, 'genome.fa')} "\
+                        f"-m 2 -x 200 --threads {self.nCores} "\
+                        f"-o {tumor_allele_counts} 2>&1 "\
+                        f"| tee -a {self.infer_status_out_path} && "
+                cmd += f"{os.path.join(self.binary_folder, 'maestre')} "\
+                    f"import_allele_counts -t {tumor_allele_counts} "\
+                    f"-n {pon_het_sites_filepath} --normal_is_panel -m 2 -x 200 "\
+                    f"-o {self.het_snp_filepath} 2>&1 "\
+                    f"| tee -a {self.infer_status_out_path}"
+            elif self.use_allele_counts:
+                cmd = f"{os.path.join(self.binary_folder, 'maestre')} "\
+                    f"import_allele_counts -t {self.tumor_allele_counts} "\
+                    f"-n {self.normal_allele_counts} -m 2 -x 200 "\
+                    f"-o {self.het_snp_filepath} 2>&1 "\
+                    f"| tee -a {self.infer_status_out_path}"
+            elif self.snp_caller == "allele_count":
+                cmd = f"{os.path.join(self.binary_folder, 'maestre')} "\
+                    f"allele_count -t {self.tumor_bam} -n {self.normal_bam} "\
+                    f"-s {self.snp_sites_filepath} "\
+                    f"-r {os.path.join(self.ref_folder_path, 'genome.fa')} "\
+                    f"-m 2 -x 200 --threads {self.nCores} "\
+                    f"-o {self.het_snp_filepath} 2>&1 "\
+                    f"| tee -a {self.infer_status_out_path}"
+            else:
+                cmd = f"{os.path.join(self.binary_folder, 'maestre')} "\
+                    f"select_het_snp -s {self.two_sample_snp_file} -m 2 -x 200 -t {self.nCores} "\
+                    f"--debug 0 -o {self.het_snp_filepath} 2>&1 "\
+                    f"| tee -a {self.infer_status_out_path}"
             call_het_snps_tumor_job = self.addTask("call_het_snps_tumor", cmd,
                 dependencies=[strelka_call_snp_job])
 
@@ -332,27 +483,19 @@ class MainFlow(WorkflowRunner):
                 self.startTimeList[-1]
             sys.stderr.write(status_string)
 
-            segment_jobs = []
-            segment_out_ls = []
-            for chr_index in range(self.NUM_AUTO_CHR):
-                chromosome = self.chromosomeNames[chr_index]
-                segment_out_path = os.path.join(self.output_dir, \
-                    f"{chromosome}.segments.M{self.min_segment_len}."\
-                    f"T{self.t_score_threshold}.tsv")
-                segment_out_ls.append(segment_out_path)
-                cmd = f'{os.path.join(self.binary_folder, "GADA")} '\
-                    f'--chromosome_id {chromosome} --window_size {self.window_size} '\
-                    f'-M {self.min_segment_len} -T {self.t_score_threshold} '\
-                    f'-i {normalize_output_file_ls[chr_index]} -o {segment_out_path} '\
-                    f'2>&1 | tee -a { self.infer_status_out_path}'
-                segment_jobs.append(self.addTask("segment_%s"%chromosome, cmd, 
-                    dependencies=normalize_jobs))
-            cmd = f"cat {' '.join(segment_out_ls)} | gzip > {self.segment_data_filepath}"
-            reduce_all_segments_job = self.addTask("reduce_all_segments", cmd,
-                dependencies=segment_jobs)
-            #remove all individual segments files
-            self.addTask("rm_individual_seg_files", "rm %s" % \
-                " ".join(segment_out_ls), dependencies=reduce_all_segments_job)
+            #all chromosomes in one GADA process, written straight into all_segments.tsv.gz.
+            init_breakpoints_option = f'--init_breakpoints {self.segment_init_breakpoints} ' \
+                if self.segment_init_breakpoints else ''
+            cmd = f'{os.path.join(self.binary_folder, "GADA")} --batch '\
+                f'--threads {self.nCores} --window_size {self.window_size} '\
+                f'-M {self.min_segment_len} -T {self.t_score_threshold} '\
+                f'--coarse_bin_size {self.segment_coarse_bin_size} '\
+                f'--chunk_size {self.segment_chunk_size} '\
+                f'{init_breakpoints_option}'\
+                f'{" ".join(normalize_output_file_ls)} -o {self.segment_data_filepath} '\
+                f'2>&1 | tee -a { self.infer_status_out_path}'
+            reduce_all_segments_job = self.addTask("segment", cmd, nCores=self.nCores,
+                dependencies=normalize_jobs)
         else:
             reduce_all_segments_job = self.addTask("reduce_all_segments")
 
@@ -382,9 +525,10 @@ class MainFlow(WorkflowRunner):
                 f"{self.snp_coverage_var_vs_mean_ratio} "\
                 f"{self.max_no_of_peaks_for_logL} {self.debug} {self.auto} "\
                 f"{os.path.join(self.ref_folder_path, 'genome.dict')} "\
-                f"{self.custom_period_id} "\
+                f"{self.custom_period_id} {self.nCores} "\
+                f"{self.period_top_k} {self.period_logL_rc_margin} "\
                 f" 2>&1 | tee -a {self.infer_status_out_path}"
-            infer_job = self.addTask("infer", cmd, 
+            infer_job = self.addTask("infer", cmd, nCores=self.nCores,
                 dependencies=[reduce_all_segments_job, call_het_snps_tumor_job])
             if self.debug:
                 self.addTask("gzip_rc_ratio_no_of_windows_by_chr",
@@ -479,12 +623,14 @@ if __name__ == '__main__':
         version="32acfd1e-debug")
     ap.add_argument("-c", "--configure_filepath", type=str, required=True,
         help="the path to the configure file.")
-    ap.add_argument("-t", "--tumor_bam", type=str, required=True,
+    ap.add_argument("-t", "--tumor_bam", type=str, default=None,
         help="the path to the tumor bam file. "
-        "If the bam is not indexed, an index file will be generated")
-    ap.add_argument("-n", "--normal_bam", type=str, required=True,
+        "If the bam is not indexed, an index file will be generated. "
+        "Not needed if both --tumor_coverage and --tumor_allele_counts are given.")
+    ap.add_argument("-n", "--normal_bam", type=str, default=None,
         help="the path to the normal bam file. "
-        "If the bam is not indexed, an index file will be generated")
+        "If the bam is not indexed, an index file will be generated. "
+        "Not needed if both --normal_coverage and --normal_allele_counts are given.")
     ap.add_argument("-o", "--output_dir", type=str, required=True,
         help="the output directory path.")
     ap.add_argument("--snp_output_dir", type=str, default=None,
@@ -525,7 +671,8 @@ if __name__ == '__main__':
         help="lambda for the segmentation algorithm. Default is %(default)s.")
     ap.add_argument("-d", "--debug", type=int, default=0,
         help="Set debug value. Default 0 means no debug info output."
-            "Anything >0 enables more debug output.")
+            "Anything >0 enables more debug output, i.e. the Model_Selection result "
+            "of every segment in model_selection_log/model_selection.h5 and its plots.")
     ap.add_argument("--auto", type=int, default=1,
         help="The integer-valued argument that decides which method to use "
         "to detect the period in the read-count ratio histogram. "
@@ -536,7 +683,83 @@ if __name__ == '__main__':
         "to use during inferring. "
         "0 means detected automatically by program, 1 means use the 1st period. "
         "2 means use the 2nd period, etc. Default is %(default)s")
+    ap.add_argument("--period_top_k", type=int, default=0,
+        help="If >0, the SNP log likelihood (many EM fits) is computed only for "
+        "the top k candidate periods by the read count log likelihood. "
+        "Pruned candidates are marked in infer.out.details.tsv. "
+        "0: all candidates. Default is %(default)s")
+    ap.add_argument("--period_logL_rc_margin", type=float, default=0,
+        help="If >0, the SNP log likelihood is computed only for the candidate periods "
+        "whose read count log likelihood is within this margin of the best one. "
+        "With --period_top_k, a candidate kept by either is kept. "
+        "0: no margin. Default is %(default)s")
+    ap.add_argument("--gc_index_dir", type=str, default=None,
+        help="The folder of GC index files (chrN.gcW.bi) made by 'maestre gc_index'. "
+        "Coverage is corrected for GC bias if it is available. "
+        "Default is the gc_index folder inside the reference folder, if it exists.")
+    ap.add_argument("--tumor_coverage", type=str, default=None,
+        help="A precomputed coverage track of the tumor "
+        "(bedGraph/mosdepth regions: chr, start, end, depth; optionally gzipped). "
+        "Together with --normal_coverage, it replaces reading coverage from BAMs.")
+    ap.add_argument("--normal_coverage", type=str, default=None,
+        help="A precomputed coverage track of the normal. See --tumor_coverage.")
+    ap.add_argument("--tumor_allele_counts", type=str, default=None,
+        help="A precomputed allele count table of the tumor at common SNPs "
+        "(chr, pos, ref_count, alt_count; GATK CollectAllelicCounts layout works). "
+        "Together with --normal_allele_counts, it replaces strelka SNP calling.")
+    ap.add_argument("--normal_allele_counts", type=str, default=None,
+        help="A precomputed allele count table of the normal. See --tumor_allele_counts.")
+    ap.add_argument("--pon_dir", type=str, default=None,
+        help="Tumor-only mode. The output folder of 'maestre build_pon' "
+        "(pon.coverage.wN.tsv.gz, pon.het_sites.tsv.gz). It replaces the normal. "
+        "Needs the same window size as the config file. Tumor allele counts are "
+        "counted from --tumor_bam unless --tumor_allele_counts is given.")
+    ap.add_argument("--snp_caller", type=str, default="strelka",
+        choices=["strelka", "allele_count"],
+        help="How heterozygous SNPs are found. strelka: germline calling of both BAMs. "
+        "allele_count: count alleles of both BAMs at the known sites "
+        "(snp_sites.gz in the reference folder), much faster. Default is %(default)s")
+    ap.add_argument("--snp_site_tier", type=str, default="full",
+        help="Known SNP sites to genotype. full: snp_sites.gz. "
+        "N: the N-th thinned tier (snp_sites.tiers.tsv made by 'maestre thin_sites'). "
+        "auto: thin low-coverage runs, using the sparsest tier with "
+        "spacing <= 20000bp/coverage (coverage estimated from the BAM index), "
+        "and the full panel above 20x with a 1kb tier. "
+        "Fewer sites make SNP calling faster but give fewer SNPs per segment, "
+        "so the MAF/logOR of small segments is noisier, most of all at low coverage. "
+        "Default is %(default)s")
+    ap.add_argument("--segment_coarse_bin_size", type=int, default=0,
+        help="If >1, GADA segments the medians of bins of this many windows first and "
+        "re-runs SBL at full resolution only around the coarse breakpoints. "
+        "Much faster for small windows (i.e. 10-50 for 100-200bp windows). "
+        "0: full resolution everywhere. Default is %(default)s")
+    ap.add_argument("--segment_chunk_size", type=int, default=0,
+        help="If >0, GADA cuts each chromosome into overlapping chunks of this many windows, "
+        "runs SBL on them in parallel and backward elimination across chunk boundaries. "
+        "Bounds the segmentation time and memory of long chromosomes (i.e. 200000). "
+        "Can not be combined with --segment_coarse_bin_size. Default is %(default)s")
+    ap.add_argument("--segment_init_breakpoints",
+        help="all_segments.tsv.gz of a previous run of the same sample (i.e. before a "
+        "sequencing top-up). GADA keeps its breakpoints as the starting point and re-runs SBL "
+        "only around them and inside segments that now look split. "
+        "Can not be combined with --segment_coarse_bin_size or --segment_chunk_size.")
     args = ap.parse_args()
+    if args.segment_chunk_size > 0 and args.segment_coarse_bin_size > 1:
+        ap.error("--segment_chunk_size and --segment_coarse_bin_size can not be used together.")
+    if args.segment_init_breakpoints and \
+            (args.segment_chunk_size > 0 or args.segment_coarse_bin_size > 1):
+        ap.error("--segment_init_breakpoints can not be combined with "
+            "--segment_chunk_size or --segment_coarse_bin_size.")
+    if args.pon_dir:
+        if not args.tumor_bam and \
+                not (args.tumor_coverage and args.tumor_allele_counts):
+            ap.error("--pon_dir needs --tumor_bam, or --tumor_coverage "
+                "and --tumor_allele_counts.")
+    elif not (args.tumor_bam and args.normal_bam) and \
+            not (args.tumor_coverage and args.normal_coverage and
+                 args.tumor_allele_counts and args.normal_allele_counts):
+        ap.error("--tumor_bam and --normal_bam are required unless coverage tracks "
+            "and allele count tables of both samples are given.")
     wflow = MainFlow(args.configure_filepath, args.tumor_bam, args.normal_bam,
         output_dir=args.output_dir,
         snp_output_dir=args.snp_output_dir,
@@ -546,9 +769,19 @@ if __name__ == '__main__':
         no_of_autosomes=args.no_of_autosomes,
         clean=args.clean, step=args.step, debug=args.debug, auto=args.auto,
         max_no_of_peaks_for_logL=args.max_no_of_peaks_for_logL,
-        nCores=args.nCores)
+        nCores=args.nCores, gc_index_dir=args.gc_index_dir,
+        tumor_coverage=args.tumor_coverage, normal_coverage=args.normal_coverage,
+        tumor_allele_counts=args.tumor_allele_counts,
+        normal_allele_counts=args.normal_allele_counts, pon_dir=args.pon_dir,
+        snp_caller=args.snp_caller, snp_site_tier=args.snp_site_tier,
+        segment_coarse_bin_size=args.segment_coarse_bin_size,
+        segment_chunk_size=args.segment_chunk_size,
+        segment_init_breakpoints=args.segment_init_breakpoints,
+        period_top_k=args.period_top_k,
+        period_logL_rc_margin=args.period_logL_rc_margin)
     wflow.readConfigureFile(args.configure_filepath)
     wflow.readDictFile()
+    wflow.selectSNPSites()
     retval = wflow.run(mode="local", nCores=args.nCores,
         dataDirRoot=args.output_dir, isContinue='Auto',
         isForceContinue=True, retryMax=0)
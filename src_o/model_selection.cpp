@@ -7,27 +7,141 @@
 #include <algorithm>
 #include <cmath>
 #include <numeric>
+#include <sstream>
+#include <atomic>
+#include <cstdlib>
+#include <thread>
 #include <boost/math/distributions/poisson.hpp>
-#include <boost/math/distributions/normal.hpp>
 #include "H5Cpp.h"
 
-struct Model {
-    int minor;
-    int major;
-};
+static double calc_expected_logOR(double lambda_a, double lambda_b) {
+    // E[log(a/b)], a~Poisson(lambda_a), b~Poisson(lambda_b), a,b>=1, each up to 0.9999 mass.
+    boost::math::poisson_distribution<> poisson_a(lambda_a);
+    boost::math::poisson_distribution<> poisson_b(lambda_b);
+    // b's terms are the same for every a.
+    std::vector<double> b_pmf_vector;
+    double b_pmf_accumlate = boost::math::pdf(poisson_b, 0);
+    while(b_pmf_accumlate < 0.9999) {
+        double b_pmf = boost::math::pdf(poisson_b, b_pmf_vector.size() + 1);
+        b_pmf_vector.push_back(b_pmf);
+        b_pmf_accumlate += b_pmf;
+    }
+    double a_pmf_accumlate;
+    double pmf_accumlate = 0;
+    double logOR_accumlate = 0;
+    double a_pmf;
+    int a = 1;
+    a_pmf_accumlate = boost::math::pdf(poisson_a, 0);
+    while(a_pmf_accumlate < 0.9999) {
+        a_pmf = boost::math::pdf(poisson_a, a);
+        a_pmf_accumlate += a_pmf;
+        for(int b = 1; b <= (int) b_pmf_vector.size(); b++) {
+            double b_pmf = b_pmf_vector[b - 1];
+            pmf_accumlate += a_pmf * b_pmf;
+            logOR_accumlate += a_pmf * b_pmf * std::log(1.0 * a / b);
+        }
+        a += 1;
+    }
+    return logOR_accumlate / pmf_accumlate;
+}
 
-struct Arg {
-    double alpha;
-    double mu;
-    double variance;
-    int convergence;
-};
+static double get_expected_logOR(int minor, int major, double purity, double tumor_depth) {
+    /*
+     * calc_expected_logOR() of the minor/major allele copy numbers, memoized.
+     * The same (model, purity, coverage) recurs across segments and candidate periods.
+     */
+    static std::map<std::tuple<int, int, double, double>, double> expected_logOR_map;
+    static std::mutex expected_logOR_map_mutex;
+    auto key = std::make_tuple(minor, major, purity, tumor_depth);
+    {
+        std::lock_guard<std::mutex> lock(expected_logOR_map_mutex);
+        auto it = expected_logOR_map.find(key);
+        if (it != expected_logOR_map.end()) {
+            return it->second;
+        }
+    }
+    int cp = minor + major;
+    double lambda_a = (minor * purity + 1 - purity)/(cp * purity + 2 * (1 - purity))\
+                       * tumor_depth;
+    double lambda_b = (major * purity + 1 - purity)/(cp * purity + 2 * (1 - purity))\
+                       * tumor_depth;
+    double expected_logOR = calc_expected_logOR(lambda_a, lambda_b);
+    std::lock_guard<std::mutex> lock(expected_logOR_map_mutex);
+    expected_logOR_map[key] = expected_logOR;
+    return expected_logOR;
+}
 
 Model_Selection::Model_Selection(std::vector<double> &data, int cp, 
     double purity, double tumor_depth, std::ostream &out):
         data(data), cp(cp), purity(purity), tumor_depth(tumor_depth), out(out) {}
 
+namespace {
+// EM state of one two-Gaussian model (-mu and mu, one variance) of a segment.
+struct EM_Model {
+    double mu;
+    // sum((x-mu)^2), constant over iterations.
+    double squared_distance_sum;
+    // the point the next E step is at.
+    double alpha1;
+    double var;
+    // SQUAREM: 0: at theta0, 1: at theta1=EM(theta0).
+    int phase;
+    double alpha1_0, var_0, alpha1_1, var_1;
+    // theta0 is an extrapolation: fall back to theta2=EM(theta1) if logL dropped below logL_1.
+    bool extrapolated;
+    double alpha1_2, var_2, logL_1;
+    bool need_logL;
+    double sum_hidden;
+    double sum_hidden_x;
+    double sum_log_hidden;
+    double alpha1_new;
+    double var_new;
+    int iter_count;
+    bool done;
+    bool convergence;
+    std::ostringstream log;
+};
+}
+
+static double calc_mixture_logL(const std::vector<double> &data, double alpha1, double mu,
+                                double var) {
+    // sum of log(alpha1*N(x; -mu, var) + (1-alpha1)*N(x; mu, var)), in closed form.
+    double log_norm = -0.5 * std::log(2 * M_PI * var);
+    double log_alpha1 = std::log(alpha1);
+    double log_alpha2 = std::log(1 - alpha1);
+    double logL = 0;
+    for (double x : data) {
+        double log_density1 = log_alpha1 - (x + mu) * (x + mu) / (2 * var);
+        double log_density2 = log_alpha2 - (x - mu) * (x - mu) / (2 * var);
+        double max_log_density = std::max(log_density1, log_density2);
+        logL += max_log_density + std::log(std::exp(log_density1 - max_log_density) +
+                                           std::exp(log_density2 - max_log_density));
+    }
+    return logL + log_norm * data.size();
+}
+
+static bool is_valid_EM_point(double alpha1, double var) {
+    return alpha1 > 0 && alpha1 <= 1 && var > 0 && std::isfinite(var);
+}
+
 void Model_Selection::run() {
+    /*
+     * The two components are N(-mu, var) and N(mu, var), so the E step is
+     *  hidden = alpha1 / (alpha1 + (1 - alpha1) * exp(2 * mu * x / var))
+     * and the M step only needs sum(hidden) and sum(hidden * x):
+     *  sum(h(x+mu)^2 + (1-h)(x-mu)^2) = sum((x-mu)^2) + 4 * mu * sum(h * x).
+     * The logL at the E step's point follows from sum(log(hidden)), where
+     *  log(hidden) = -log1p(t), t = (1 - alpha1) / alpha1 * exp(2 * mu * x / var), and
+     *  = -log(t) if t overflows, so that a far-off extrapolation gets a finite logL
+     *  instead of log(0) = -inf, which would make its logL +inf and accept it.
+     *
+     * EM is accelerated by SQUAREM (Varadhan & Roland 2008, SqS3 step length):
+     *  theta1=EM(theta0), theta2=EM(theta1), r=theta1-theta0, v=theta2-theta1-r,
+     *  a=min(-|r|/|v|, -1), theta0 <- theta0 - 2ar + a^2 v. The extrapolation is
+     *  dropped for theta2 if it leaves the parameter space or lowers the logL.
+     * Convergence is tested on every EM step, as before.
+     * All minor/major models of the segment iterate together, one pass over data each.
+     */
     //generate model
     for(int minor = 0; minor < (cp/2 + 1); minor++) {
         result.model_list.push_back(std::make_pair(minor, cp - minor));
@@ -37,139 +151,204 @@ void Model_Selection::run() {
     double max_num = data.back();
     int data_size = data.size();
     double mean = std::accumulate(data.begin(),data.end(),0.0)*1.0/data_size;
+    double data_sum = mean * data_size;
+    double data_var = std::accumulate(data.begin(), data.end(), 0.0,
+                        [&mean](double x, double y){return x+std::pow(y - mean, 2);})/data_size;
+    // the per-iteration log is only formatted if out is written to.
+    bool log_iterations = out.good();
 
-    double alpha1_new = 0;
-    double mu = 0;
-    double var_new = 0;
-    bool convergence = false;
+    // define threshold
+    double delta=1e-4;
+    // each iteration is a pass over the data: fewer for segments with many SNPs,
+    //  which converge in far fewer iterations anyway.
+    int iter_max = std::max(1000, std::min(10000, 10000000 / data_size));
 
-    for(auto &model: result.model_list) {
-        int minor = model.first;
-        int major = model.second;
+    std::vector<EM_Model> em_model_vector(result.model_list.size());
+    std::vector<EM_Model *> active_model_vector;
+    for(size_t i = 0; i < result.model_list.size(); i++) {
+        int minor = result.model_list[i].first;
+        int major = result.model_list[i].second;
+        EM_Model &em_model = em_model_vector[i];
+        em_model.iter_count = 0;
         if(minor == major) { //for single Gaussian model
-            alpha1_new = 1.0;
-            mu = 0.0;
-            var_new = std::accumulate(data.begin(), data.end(), 0.0,
-                        [&mean](double x, double y){return x+std::pow(y - mean, 2);})/data_size;
-            convergence = true;
-            out << "\n\n\nFor model: " << minor << "-" << major << std::endl;
-            out << "Single Gaussian model: var=" << var_new << std::endl;
+            em_model.alpha1_new = 1.0;
+            em_model.mu = 0.0;
+            em_model.var_new = data_var;
+            em_model.convergence = true;
+            em_model.done = true;
+            em_model.log << "\n\n\nFor model: " << minor << "-" << major << std::endl;
+            em_model.log << "Single Gaussian model: var=" << em_model.var_new << std::endl;
+            continue;
         }
-        else { // for gaussian mixture model
-            //initialize parameters
-            double alpha1 = (mean - min_num)/(max_num - min_num);
-            double var = std::accumulate(data.begin(), data.end(), 0.0,
-                           [&mean](double x, double y){return x+std::pow(y-mean, 2);})/data_size;
-            //adjusted expected mean for logOR
-            double lambda_a = (minor * purity + 1 - purity)/(cp * purity + 2 * (1 - purity))\
-                               * tumor_depth;
-            double lambda_b = (major * purity + 1 - purity)/(cp * purity + 2 * (1 - purity))\
-                               * tumor_depth;
-            boost::math::poisson_distribution<> poisson_a(lambda_a);
-            boost::math::poisson_distribution<> poisson_b(lambda_b);
-            double a_pmf_accumlate, b_pmf_accumlate;
-            double pmf_accumlate = 0;
-            double logOR_accumlate = 0;
-            double a_pmf, b_pmf;
-            int b, a;
-            a = 1;
-            a_pmf_accumlate = boost::math::pdf(poisson_a, 0);
-            while(a_pmf_accumlate < 0.9999) {
-                a_pmf = boost::math::pdf(poisson_a, a);
-                a_pmf_accumlate += a_pmf;
-
-                b = 1;
-                b_pmf_accumlate = boost::math::pdf(poisson_b, 0);
-                while(b_pmf_accumlate < 0.9999) {
-                    b_pmf = boost::math::pdf(poisson_b, b);
-                    b_pmf_accumlate += b_pmf;
-                    pmf_accumlate += a_pmf * b_pmf;
-                    logOR_accumlate += a_pmf * b_pmf * std::log(1.0 * a / b);
-                    b += 1;
-                }
-                a += 1;
-            }
-            mu = logOR_accumlate / pmf_accumlate;
-
-            std::vector<double> hidden_variable1(data_size, 0);
-            convergence = true;
-            out << "\n\n\nEM for model: " << minor << "-" << major << std::endl;
-            out << "initialize parameters" << std::endl;
-            out << "alpha1=" << alpha1 << ", alpha2=" << 1 - alpha1 << std::endl
-                << "mu1=" << -mu << ", mu2=" << mu << std::endl
-                << "var1=" << var << ", var2=" << var << std::endl;
-            
-            // define threshold
-            double delta=1e-4;
-            int iter_max = 10000;
-            int iter_count = 0;
+        //initialize parameters
+        em_model.alpha1 = (mean - min_num)/(max_num - min_num);
+        em_model.var = data_var;
+        //adjusted expected mean for logOR
+        em_model.mu = get_expected_logOR(minor, major, purity, tumor_depth);
+        double mu = em_model.mu;
+        em_model.squared_distance_sum = std::accumulate(data.begin(), data.end(), 0.0,
+                        [&mu](double x, double y){return x + (y - mu) * (y - mu);});
+        em_model.phase = 0;
+        em_model.extrapolated = false;
+        em_model.need_logL = false;
+        em_model.done = false;
+        em_model.convergence = true;
+        em_model.log << "\n\n\nEM for model: " << minor << "-" << major << std::endl;
+        em_model.log << "initialize parameters" << std::endl;
+        em_model.log << "alpha1=" << em_model.alpha1 << ", alpha2=" << 1 - em_model.alpha1 << std::endl
+            << "mu1=" << -mu << ", mu2=" << mu << std::endl
+            << "var1=" << em_model.var << ", var2=" << em_model.var << std::endl;
+        active_model_vector.push_back(&em_model);
+    }
 
-            while(true) {
-                // E step
-                boost::math::normal norm1(-mu, std::sqrt(var));
-                boost::math::normal norm2(mu, std::sqrt(var));
-                //data and hidden_variable1 has the same length
-                for(auto data_iter = data.begin(), hidden_iter = hidden_variable1.begin();
-                    data_iter != data.end() && hidden_iter != hidden_variable1.end();
-                    data_iter++, hidden_iter++) {
-                        *hidden_iter = alpha1 * boost::math::pdf(norm1, *data_iter)/\
-                                       (alpha1 * boost::math::pdf(norm1, *data_iter)
-                                        + (1 - alpha1) * boost::math::pdf(norm2, *data_iter));
+    while(!active_model_vector.empty()) {
+        // E step, and the sums of the M step
+        for(EM_Model *em_model : active_model_vector) {
+            double exp_coefficient = 2 * em_model->mu / em_model->var;
+            double alpha_ratio = (1 - em_model->alpha1) / em_model->alpha1;
+            double sum_hidden = 0;
+            double sum_hidden_x = 0;
+            double sum_log_hidden = 0;
+            if (em_model->need_logL) {
+                double log_alpha_ratio = std::log(alpha_ratio);
+                for(const double x : data) {
+                    double t = alpha_ratio * std::exp(exp_coefficient * x);
+                    double hidden = 1.0 / (1.0 + t);
+                    sum_hidden += hidden;
+                    sum_hidden_x += hidden * x;
+                    sum_log_hidden -= std::isinf(t) ? log_alpha_ratio + exp_coefficient * x :
+                                      std::log1p(t);
                 }
-                // M step
-                double sum1 = 0;
-                double denominator = 0;
-                for(auto data_iter = data.cbegin(), hidden_iter = hidden_variable1.cbegin();
-                    data_iter != data.cend() && hidden_iter != hidden_variable1.cend();
-                    data_iter++, hidden_iter++) {
-                        sum1 += (*hidden_iter) * std::pow((*data_iter) - (-mu), 2)
-                                 + (1 - (*hidden_iter)) * std::pow((*data_iter) - mu , 2);
-                        denominator += (*hidden_iter);
+            } else {
+                for(const double x : data) {
+                    double hidden = 1.0 / (1.0 + alpha_ratio * std::exp(exp_coefficient * x));
+                    sum_hidden += hidden;
+                    sum_hidden_x += hidden * x;
                 }
-                var_new = sum1 / data_size;
-                alpha1_new = denominator / data_size;
-                //somethimes due to the precision, alpha1_new will greater than 1 when
-                //alpha1_new is very close to 1
-                if(alpha1_new > 1.0) {
-                    alpha1_new = 1;
+            }
+            em_model->sum_hidden = sum_hidden;
+            em_model->sum_hidden_x = sum_hidden_x;
+            em_model->sum_log_hidden = sum_log_hidden;
+        }
+        // M step
+        for(EM_Model *em_model_pointer : active_model_vector) {
+            EM_Model &em_model = *em_model_pointer;
+            double alpha1 = em_model.alpha1;
+            double var = em_model.var;
+            double logL = 0;
+            if (em_model.need_logL) {
+                logL = data_size * (-0.5 * std::log(2 * M_PI * var) + std::log(alpha1)) -
+                       em_model.squared_distance_sum / (2 * var) -
+                       2 * em_model.mu / var * data_sum - em_model.sum_log_hidden;
+            }
+            em_model.iter_count += 1;
+            if (em_model.phase == 0 && em_model.extrapolated) {
+                em_model.extrapolated = false;
+                if (!(logL >= em_model.logL_1)) {
+                    // restart from theta2. The E step at the extrapolation counts as an iteration.
+                    em_model.alpha1 = em_model.alpha1_2;
+                    em_model.var = em_model.var_2;
+                    em_model.need_logL = false;
+                    if (em_model.iter_count > iter_max) {
+                        em_model.alpha1_new = em_model.alpha1;
+                        em_model.var_new = em_model.var;
+                        em_model.log << "Warning: the EM algorithm hit maximum iteration "
+                            << "before convergence!!!" << std::endl;
+                        em_model.convergence = false;
+                        em_model.done = true;
+                    }
+                    continue;
                 }
+            }
+            em_model.var_new = (em_model.squared_distance_sum +
+                                4 * em_model.mu * em_model.sum_hidden_x) / data_size;
+            em_model.alpha1_new = em_model.sum_hidden / data_size;
+            //somethimes due to the precision, alpha1_new will greater than 1 when
+            //alpha1_new is very close to 1
+            if(em_model.alpha1_new > 1.0) {
+                em_model.alpha1_new = 1;
+            }
 
-                iter_count += 1;
-                out << "Iteration " << iter_count << std::endl
-                    << "alpha1=" << alpha1_new << ", alpha2=" << 1 - alpha1_new << std::endl
-                    << "mu1=" << -mu << ", mu2=" << mu << std::endl
-                    << "var1=" << var_new << ", var2=" << var_new << std::endl;
-                // convergence ?
-                if(std::abs((alpha1 - alpha1_new)/alpha1) < delta
-                   && std::abs((var - var_new)/var) < delta) {
-                       break;
-                }
-                //hit iter_max ?
-                if(iter_count > iter_max) {
-                    out << "Warning: the EM algorithm hit maximum iteration "
-                        << "before convergence!!!" << std::endl;
-                        convergence = false;
-                        break;
+            if (log_iterations) {
+                em_model.log << "Iteration " << em_model.iter_count << std::endl
+                    << "alpha1=" << em_model.alpha1_new << ", alpha2=" << 1 - em_model.alpha1_new << std::endl
+                    << "mu1=" << -em_model.mu << ", mu2=" << em_model.mu << std::endl
+                    << "var1=" << em_model.var_new << ", var2=" << em_model.var_new << std::endl;
+            }
+            // convergence ?
+            if(std::abs((alpha1 - em_model.alpha1_new)/alpha1) < delta
+               && std::abs((var - em_model.var_new)/var) < delta) {
+                em_model.done = true;
+                continue;
+            }
+            //hit iter_max ?
+            if(em_model.iter_count > iter_max) {
+                em_model.log << "Warning: the EM algorithm hit maximum iteration "
+                    << "before convergence!!!" << std::endl;
+                em_model.convergence = false;
+                em_model.done = true;
+                continue;
+            }
+            if (em_model.phase == 0) {
+                em_model.alpha1_0 = alpha1;
+                em_model.var_0 = var;
+                em_model.alpha1_1 = em_model.alpha1_new;
+                em_model.var_1 = em_model.var_new;
+                em_model.alpha1 = em_model.alpha1_new;
+                em_model.var = em_model.var_new;
+                // the logL at theta1 is the bar for the extrapolation.
+                em_model.need_logL = true;
+                em_model.phase = 1;
+                continue;
+            }
+            em_model.logL_1 = logL;
+            em_model.alpha1_2 = em_model.alpha1_new;
+            em_model.var_2 = em_model.var_new;
+            double r_alpha1 = em_model.alpha1_1 - em_model.alpha1_0;
+            double r_var = em_model.var_1 - em_model.var_0;
+            double v_alpha1 = em_model.alpha1_2 - em_model.alpha1_1 - r_alpha1;
+            double v_var = em_model.var_2 - em_model.var_1 - r_var;
+            double v_norm = std::sqrt(v_alpha1 * v_alpha1 + v_var * v_var);
+            em_model.phase = 0;
+            em_model.alpha1 = em_model.alpha1_2;
+            em_model.var = em_model.var_2;
+            em_model.need_logL = false;
+            if (v_norm > 0) {
+                double step_length = std::min(-1.0,
+                        -std::sqrt(r_alpha1 * r_alpha1 + r_var * r_var) / v_norm);
+                double alpha1_extrapolated = em_model.alpha1_0 - 2 * step_length * r_alpha1 +
+                                             step_length * step_length * v_alpha1;
+                double var_extrapolated = em_model.var_0 - 2 * step_length * r_var +
+                                          step_length * step_length * v_var;
+                if (step_length < -1.0 && is_valid_EM_point(alpha1_extrapolated, var_extrapolated)) {
+                    em_model.alpha1 = alpha1_extrapolated;
+                    em_model.var = var_extrapolated;
+                    em_model.extrapolated = true;
+                    em_model.need_logL = true;
                 }
-                //update parameters
-                alpha1 = alpha1_new;
-                var = var_new;
             }
-            out << std::endl << "Optimal value:" << std::endl
-                << "alpha1=" << alpha1_new << ", alpha2=" << 1 - alpha1_new << std::endl
-                << "mu1=" << -mu << ", mu2=" << mu << std::endl
-                << "var1=" << var_new << ", var2=" << var_new << std::endl;
         }
-        result.arg_list.push_back(std::make_tuple(alpha1_new, -mu, var_new, convergence));
-        // calculate logL
-        double logL = 0;
-        boost::math::normal norm1(-mu, std::sqrt(var_new));
-        boost::math::normal norm2(mu, std::sqrt(var_new));
-        for(auto &x: data) {
-            logL += std::log(alpha1_new * boost::math::pdf(norm1, x) + (1 - alpha1_new)
-                     * boost::math::pdf(norm2, x));
+        active_model_vector.erase(std::remove_if(active_model_vector.begin(),
+                active_model_vector.end(), [](const EM_Model *em_model){return em_model->done;}),
+            active_model_vector.end());
+    }
+
+    for(size_t i = 0; i < result.model_list.size(); i++) {
+        EM_Model &em_model = em_model_vector[i];
+        if(result.model_list[i].first != result.model_list[i].second) {
+            em_model.log << std::endl << "Optimal value after " << em_model.iter_count
+                << " iterations:" << std::endl
+                << "alpha1=" << em_model.alpha1_new << ", alpha2=" << 1 - em_model.alpha1_new << std::endl
+                << "mu1=" << -em_model.mu << ", mu2=" << em_model.mu << std::endl
+                << "var1=" << em_model.var_new << ", var2=" << em_model.var_new << std::endl;
         }
-        result.logL_list.push_back(logL);
+        out << em_model.log.str();
+        result.arg_list.push_back(std::make_tuple(em_model.alpha1_new, -em_model.mu,
+                                                  em_model.var_new, em_model.convergence));
+        result.iteration_list.push_back(em_model.iter_count);
+        // calculate logL
+        result.logL_list.push_back(calc_mixture_logL(data, em_model.alpha1_new, em_model.mu,
+                                                     em_model.var_new));
     }
     // select model
     double max_logL = result.logL_list[0];
@@ -184,95 +363,208 @@ void Model_Selection::run() {
     result.selection = result.model_list[max_idx];
 }
 
-HDF5_Log::HDF5_Log(std::string filename):
-    file(H5std_string(filename), H5F_ACC_TRUNC), group_idx(0) {}
+static H5::DataSet create_extendible_dataset(H5::H5File &file, const std::string &name,
+                                             const H5::DataType &type, hsize_t chunk_size) {
+    hsize_t dims[1] = {0};
+    hsize_t max_dims[1] = {H5S_UNLIMITED};
+    H5::DataSpace dataspace(1, dims, max_dims);
+    H5::DSetCreatPropList property_list;
+    hsize_t chunk_dims[1] = {chunk_size};
+    property_list.setChunk(1, chunk_dims);
+    property_list.setDeflate(6);
+    return file.createDataSet(name, type, dataspace, property_list);
+}
 
-void HDF5_Log::write(std::string &data_name, std::vector<double> &data, Result &result) {
-    hsize_t dims[1] = {1};
-    H5std_string groupname(std::string("/segment_") + std::to_string(group_idx++));
-    H5::Group group(file.createGroup(groupname));
+template <class T>
+static void append_to_dataset(H5::DataSet &dataset, const H5::DataType &type,
+                              const std::vector<T> &buffer, hsize_t no_of_rows) {
+    // no_of_rows: rows in the dataset before the append.
+    if (buffer.empty()) {
+        return;
+    }
+    hsize_t dims[1] = {no_of_rows + buffer.size()};
+    dataset.extend(dims);
+    H5::DataSpace file_space = dataset.getSpace();
+    hsize_t offset[1] = {no_of_rows};
+    hsize_t count[1] = {buffer.size()};
+    file_space.selectHyperslab(H5S_SELECT_SET, count, offset);
+    H5::DataSpace memory_space(1, count);
+    dataset.write(buffer.data(), type, memory_space, file_space);
+}
 
-    H5std_string dataset_name("title");
-    H5::DataSpace * dataspace = new H5::DataSpace(1, dims);
-    H5::DataSet * dataset = new H5::DataSet(group.createDataSet(dataset_name,
-        H5::StrType(0, H5T_VARIABLE), *dataspace));
-    dataset->write(data_name, H5::StrType(0, H5T_VARIABLE));
-    delete dataspace;
-    delete dataset;
+HDF5_Log::HDF5_Log(std::string filename, size_t batch_size):
+    file(H5std_string(filename), H5F_ACC_TRUNC),
+    segment_type(sizeof(Segment_Row)), model_type(sizeof(Model_Row)),
+    batch_size(std::max((size_t) 1, batch_size)),
+    no_of_segments(0), no_of_models(0), no_of_data(0),
+    no_of_segments_written(0), no_of_models_written(0), no_of_data_written(0) {
+    segment_type.insertMember("chr", HOFFSET(Segment_Row, chr), H5::PredType::NATIVE_INT);
+    segment_type.insertMember("start", HOFFSET(Segment_Row, start), H5::PredType::NATIVE_INT);
+    segment_type.insertMember("end", HOFFSET(Segment_Row, end), H5::PredType::NATIVE_INT);
+    segment_type.insertMember("cp", HOFFSET(Segment_Row, cp), H5::PredType::NATIVE_INT);
+    segment_type.insertMember("purity", HOFFSET(Segment_Row, purity), H5::PredType::NATIVE_DOUBLE);
+    segment_type.insertMember("selection_minor", HOFFSET(Segment_Row, selection_minor),
+                              H5::PredType::NATIVE_INT);
+    segment_type.insertMember("selection_major", HOFFSET(Segment_Row, selection_major),
+                              H5::PredType::NATIVE_INT);
+    segment_type.insertMember("best_logL", HOFFSET(Segment_Row, best_logL),
+                              H5::PredType::NATIVE_DOUBLE);
+    segment_type.insertMember("model_offset", HOFFSET(Segment_Row, model_offset),
+                              H5::PredType::NATIVE_LLONG);
+    segment_type.insertMember("no_of_models", HOFFSET(Segment_Row, no_of_models),
+                              H5::PredType::NATIVE_LLONG);
+    segment_type.insertMember("data_offset", HOFFSET(Segment_Row, data_offset),
+                              H5::PredType::NATIVE_LLONG);
+    segment_type.insertMember("no_of_data", HOFFSET(Segment_Row, no_of_data),
+                              H5::PredType::NATIVE_LLONG);
 
-    dataset_name = "model_list";
-    int model_size = result.model_list.size();
-    dims[0] = model_size;
-    Model * model_list = new Model[model_size];
-    for(int i = 0; i < model_size; i++) {
-        model_list[i].minor = result.model_list[i].first;
-        model_list[i].major = result.model_list[i].second;
-    }
-    dataspace = new H5::DataSpace(1, dims);
-    H5::CompType model_type(sizeof(Model));
-    model_type.insertMember(std::string("minor"), HOFFSET(Model, minor), H5::PredType::NATIVE_INT);
-    model_type.insertMember(std::string("major"), HOFFSET(Model, major), H5::PredType::NATIVE_INT);
-    dataset = new H5::DataSet(group.createDataSet(dataset_name, model_type, *dataspace));
-    dataset->write(model_list, model_type);
-    delete [] model_list;
-    delete dataset;
-    delete dataspace;
+    model_type.insertMember("segment", HOFFSET(Model_Row, segment), H5::PredType::NATIVE_LLONG);
+    model_type.insertMember("minor", HOFFSET(Model_Row, minor), H5::PredType::NATIVE_INT);
+    model_type.insertMember("major", HOFFSET(Model_Row, major), H5::PredType::NATIVE_INT);
+    model_type.insertMember("alpha", HOFFSET(Model_Row, alpha), H5::PredType::NATIVE_DOUBLE);
+    model_type.insertMember("mu", HOFFSET(Model_Row, mu), H5::PredType::NATIVE_DOUBLE);
+    model_type.insertMember("variance", HOFFSET(Model_Row, variance), H5::PredType::NATIVE_DOUBLE);
+    model_type.insertMember("convergence", HOFFSET(Model_Row, convergence),
+                            H5::PredType::NATIVE_INT);
+    model_type.insertMember("logL", HOFFSET(Model_Row, logL), H5::PredType::NATIVE_DOUBLE);
+    model_type.insertMember("iterations", HOFFSET(Model_Row, iterations), H5::PredType::NATIVE_INT);
 
-    dataset_name = "arg_list";
-    int arg_size = result.arg_list.size();
-    dims[0] = arg_size;
-    Arg * arg_list = new Arg[arg_size];
-    for(int i = 0; i < arg_size; i++) {
-        arg_list[i].alpha = std::get<0>(result.arg_list[i]);
-        arg_list[i].mu = std::get<1>(result.arg_list[i]);
-        arg_list[i].variance = std::get<2>(result.arg_list[i]);
-        arg_list[i].convergence = std::get<3>(result.arg_list[i]) ? 1 : 0;
+    segment_dataset = create_extendible_dataset(file, "segment", segment_type, 1024);
+    model_dataset = create_extendible_dataset(file, "model", model_type, 4096);
+    data_dataset = create_extendible_dataset(file, "data", H5::PredType::NATIVE_DOUBLE, 65536);
+}
+
+HDF5_Log::~HDF5_Log() {
+    flush();
+}
+
+void HDF5_Log::write(int chr_index, int start_pos, int end_pos, int cp, double purity,
+                     const std::vector<double> &data, const Result &result) {
+    Segment_Row segment_row{chr_index + 1, start_pos, end_pos, cp, purity,
+                            result.selection.first, result.selection.second, result.best_logL,
+                            (long long) no_of_models, (long long) result.model_list.size(),
+                            (long long) no_of_data, (long long) data.size()};
+    for (size_t i = 0; i < result.model_list.size(); i++) {
+        model_buffer.push_back(Model_Row{(long long) no_of_segments,
+                                         result.model_list[i].first, result.model_list[i].second,
+                                         std::get<0>(result.arg_list[i]),
+                                         std::get<1>(result.arg_list[i]),
+                                         std::get<2>(result.arg_list[i]),
+                                         std::get<3>(result.arg_list[i]) ? 1 : 0,
+                                         result.logL_list[i], result.iteration_list[i]});
+    }
+    segment_buffer.push_back(segment_row);
+    data_buffer.insert(data_buffer.end(), data.begin(), data.end());
+    no_of_segments++;
+    no_of_models += result.model_list.size();
+    no_of_data += data.size();
+    if (segment_buffer.size() >= batch_size) {
+        flush();
     }
-    dataspace = new H5::DataSpace(1, dims);
-    H5::CompType arg_type(sizeof(Arg));
-    arg_type.insertMember(std::string("alpha"), HOFFSET(Arg, alpha), H5::PredType::NATIVE_DOUBLE);
-    arg_type.insertMember(std::string("mu"), HOFFSET(Arg, mu), H5::PredType::NATIVE_DOUBLE);
-    arg_type.insertMember(std::string("variance"), HOFFSET(Arg, variance), H5::PredType::NATIVE_DOUBLE);
-    arg_type.insertMember(std::string("convergence"), HOFFSET(Arg, convergence), H5::PredType::NATIVE_INT);
-    dataset = new H5::DataSet(group.createDataSet(dataset_name, arg_type, *dataspace));
-    dataset->write(arg_list, arg_type);
-    delete [] arg_list;
-    delete dataspace;
-    delete dataset;
+}
+
+void HDF5_Log::flush() {
+    append_to_dataset(segment_dataset, segment_type, segment_buffer, no_of_segments_written);
+    append_to_dataset(model_dataset, model_type, model_buffer, no_of_models_written);
+    append_to_dataset(data_dataset, H5::PredType::NATIVE_DOUBLE, data_buffer, no_of_data_written);
+    no_of_segments_written = no_of_segments;
+    no_of_models_written = no_of_models;
+    no_of_data_written = no_of_data;
+    segment_buffer.clear();
+    model_buffer.clear();
+    data_buffer.clear();
+}
 
-    dataset_name = "logL_list";
-    dims[0] = result.logL_list.size();
-    dataspace = new H5::DataSpace(1, dims);
-    dataset = new H5::DataSet(group.createDataSet(dataset_name, H5::PredType::NATIVE_DOUBLE, *dataspace));
-    dataset->write(result.logL_list.data(), H5::PredType::NATIVE_DOUBLE);
-    delete dataspace;
-    delete dataset;
+constexpr double Model_Selection_Cache::purity_resolution;
 
-    dataset_name = "selection";
-    int selection[2];
-    selection[0] = result.selection.first;
-    selection[1] = result.selection.second;
-    dims[0] = 2;
-    dataspace = new H5::DataSpace(1, dims);
-    dataset = new H5::DataSet(group.createDataSet(dataset_name, H5::PredType::NATIVE_INT, *dataspace));
-    dataset->write(selection, H5::PredType::NATIVE_INT);
-    delete dataspace;
-    delete dataset;
+Model_Selection_Cache::Model_Selection_Cache(int no_of_threads):
+    no_of_threads(std::max(1, no_of_threads)), no_of_fits(0), no_of_lookups(0),
+    no_of_em_iterations(0), iteration_out(nullptr) {}
 
-    dataset_name = "best_logL";
-    dims[0] = 1;
-    dataspace = new H5::DataSpace(1, dims);
-    dataset = new H5::DataSet(group.createDataSet(dataset_name, H5::PredType::NATIVE_DOUBLE, *dataspace));
-    dataset->write(&result.best_logL, H5::PredType::NATIVE_DOUBLE);
-    delete dataspace;
-    delete dataset;
+Model_Selection_Cache::Key Model_Selection_Cache::get_key(const Model_Selection_Task &task) const {
+    return std::make_tuple(task.chr_index, task.start_pos, task.end_pos, task.cp,
+                           std::lround(task.purity / purity_resolution), task.tumor_depth);
+}
 
-    dataset_name = "data";
-    dims[0] = data.size();
-    dataspace = new H5::DataSpace(1, dims);
-    dataset = new H5::DataSet(group.createDataSet(dataset_name, H5::PredType::NATIVE_DOUBLE, *dataspace));
-    dataset->write(data.data(), H5::PredType::NATIVE_DOUBLE);
-    delete dataspace;
-    delete dataset;
-    group.close();
-}
\ No newline at end of file
+bool Model_Selection_Cache::fit(const Model_Selection_Task &task) {
+    // false if the result was cached already.
+    Key key = get_key(task);
+    // no buffer: writes are dropped before any formatting, and Model_Selection skips its
+    //  per-iteration log.
+    std::ostream null_ostream(nullptr);
+    std::unique_lock<std::mutex> lock(result_map_mutex);
+    if (result_map.find(key) != result_map.end()) {
+        return false;
+    }
+    lock.unlock();
+    // Model_Selection sorts its data.
+    std::vector<double> data(*task.data);
+    Model_Selection model_selection(data, task.cp, std::get<4>(key) * purity_resolution,
+                                    task.tumor_depth, null_ostream);
+    model_selection.run();
+    lock.lock();
+    result_map[key] = model_selection.result;
+    no_of_fits++;
+    return true;
+}
+
+void Model_Selection_Cache::run(const std::vector<Model_Selection_Task> &task_vector) {
+    // one task per key. Same key, same result, so the order of fits does not matter.
+    std::vector<const Model_Selection_Task *> unique_task_vector;
+    std::map<Key, bool> key_seen_map;
+    for (const Model_Selection_Task &task : task_vector) {
+        if (key_seen_map.insert(std::make_pair(get_key(task), true)).second) {
+            unique_task_vector.push_back(&task);
+        }
+    }
+    std::vector<char> fitted_vector(unique_task_vector.size(), 0);
+    std::atomic<size_t> next_task_index(0);
+    auto worker = [&]() {
+        for (size_t i = next_task_index++; i < unique_task_vector.size(); i = next_task_index++) {
+            fitted_vector[i] = fit(*unique_task_vector[i]);
+        }
+    };
+    int no_of_workers = std::min((size_t) no_of_threads, unique_task_vector.size());
+    if (no_of_workers <= 1) {
+        worker();
+    } else {
+        std::vector<std::thread> thread_vector;
+        for (int i = 0; i < no_of_workers; i++) {
+            thread_vector.push_back(std::thread(worker));
+        }
+        for (std::thread &one_thread : thread_vector) {
+            one_thread.join();
+        }
+    }
+    // in task order, so the iteration log does not depend on the threads.
+    for (size_t i = 0; i < unique_task_vector.size(); i++) {
+        if (!fitted_vector[i]) {
+            continue;
+        }
+        const Model_Selection_Task &task = *unique_task_vector[i];
+        const Result &result = result_map[get_key(task)];
+        for (size_t j = 0; j < result.model_list.size(); j++) {
+            no_of_em_iterations += result.iteration_list[j];
+            if (iteration_out) {
+                *iteration_out << "chr" << task.chr_index + 1 << "\t" << task.start_pos << "\t"
+                               << task.end_pos << "\t" << task.cp << "\t"
+                               << std::get<4>(get_key(task)) * purity_resolution << "\t"
+                               << result.model_list[j].first << "-" << result.model_list[j].second
+                               << "\t" << result.iteration_list[j] << "\n";
+            }
+        }
+    }
+}
+
+const Result &Model_Selection_Cache::get(const Model_Selection_Task &task) {
+    std::lock_guard<std::mutex> lock(result_map_mutex);
+    no_of_lookups++;
+    auto result_it = result_map.find(get_key(task));
+    if (result_it == result_map.end()) {
+        std::cerr << "ERROR: Model_Selection_Cache::get() before run() for segment chr"
+                  << task.chr_index + 1 << ":" << task.start_pos << "-" << task.end_pos
+                  << ", cp=" << task.cp << "." << std::endl;
+        exit(3);
+    }
+    return result_it->second;
+}
@@ -3,10 +3,13 @@
  Xinping Fan, 897488736@qq.com
 
  */
+#pragma once
 #include <vector>
 #include <iostream>
 #include <tuple>
 #include <string>
+#include <map>
+#include <mutex>
 #include "H5Cpp.h"
 
 struct Result {
@@ -15,15 +18,72 @@ struct Result {
     std::vector<double> logL_list;
     std::pair<int,int> selection;
     double best_logL;
+    // EM iterations (E steps) of each model. 0 for the single Gaussian one.
+    std::vector<int> iteration_list;
 };
 
 class HDF5_Log {
+    /*
+     * Model_Selection results of many segments in one HDF5 file. Three chunked,
+     *  compressed datasets grow by batch_size segments at a time:
+     *  /segment: chr, start, end, cp, purity, selection (minor, major), best_logL,
+     *      model_offset/no_of_models (rows of /model), data_offset/no_of_data (rows of /data).
+     *  /model: segment (row of /segment), minor, major, alpha, mu, variance, convergence,
+     *      logL, iterations.
+     *  /data: the sorted logOR of all segments, one after another.
+     * Read by plot_model_select_result.py.
+     */
     private:
+        struct Segment_Row {
+            int chr;
+            int start;
+            int end;
+            int cp;
+            double purity;
+            int selection_minor;
+            int selection_major;
+            double best_logL;
+            long long model_offset;
+            long long no_of_models;
+            long long data_offset;
+            long long no_of_data;
+        };
+        struct Model_Row {
+            long long segment;
+            int minor;
+            int major;
+            double alpha;
+            double mu;
+            double variance;
+            int convergence;
+            double logL;
+            int iterations;
+        };
         H5::H5File file;
-        size_t group_idx;
+        H5::CompType segment_type;
+        H5::CompType model_type;
+        H5::DataSet segment_dataset;
+        H5::DataSet model_dataset;
+        H5::DataSet data_dataset;
+        size_t batch_size;
+        std::vector<Segment_Row> segment_buffer;
+        std::vector<Model_Row> model_buffer;
+        std::vector<double> data_buffer;
+        // rows in the file plus rows in the buffers
+        hsize_t no_of_segments;
+        hsize_t no_of_models;
+        hsize_t no_of_data;
+        // rows in the file
+        hsize_t no_of_segments_written;
+        hsize_t no_of_models_written;
+        hsize_t no_of_data_written;
     public:
-        HDF5_Log(std::string filename);
-        void write(std::string &data_name, std::vector<double> &data, Result &result);
+        HDF5_Log(std::string filename, size_t batch_size = 1024);
+        ~HDF5_Log();
+        void write(int chr_index, int start_pos, int end_pos, int cp, double purity,
+                   const std::vector<double> &data, const Result &result);
+        // append the buffered segments to the file.
+        void flush();
 };
 
 class Model_Selection {
@@ -38,4 +98,42 @@ class Model_Selection {
         Model_Selection(std::vector<double> &data, int cp, double purity,
                         double tumor_depth, std::ostream &out);
         void run();
-};
\ No newline at end of file
+};
+
+// one Model_Selection of one segment.
+struct Model_Selection_Task {
+    int chr_index;
+    int start_pos;
+    int end_pos;
+    const std::vector<double> *data;
+    int cp;
+    double purity;
+    double tumor_depth;
+};
+
+class Model_Selection_Cache {
+    /*
+     * Results of Model_Selection keyed on (segment, cp, purity, tumor_depth).
+     * Purity is rounded to purity_resolution and the fit uses the rounded purity, so
+     *  a result does not depend on which call computed it first.
+     */
+    private:
+        typedef std::tuple<int, int, int, int, long, double> Key;
+        std::map<Key, Result> result_map;
+        std::mutex result_map_mutex;
+        Key get_key(const Model_Selection_Task &task) const;
+        bool fit(const Model_Selection_Task &task);
+    public:
+        static constexpr double purity_resolution = 1e-4;
+        int no_of_threads;
+        long no_of_fits;
+        long no_of_lookups;
+        long no_of_em_iterations;
+        // if not nullptr, one line per fit: segment, cp, purity, model, EM iterations.
+        std::ostream *iteration_out;
+        Model_Selection_Cache(int no_of_threads);
+        // fit the tasks that are not cached yet, no_of_threads at a time.
+        void run(const std::vector<Model_Selection_Task> &task_vector);
+        // the task must have been given to run().
+        const Result &get(const Model_Selection_Task &task);
+};
@@ -22,7 +22,7 @@ def draw_normalization_plot(inFile_adj_factor=None, reginFile=None, out_png=None
             # plot the distribution
             ax = plt.subplot(211)
             ax.set_title("adjust factor")
-            plt.xlabel("GC-ratio*1000")
+            plt.xlabel("GC-ratio*100")
             plt.ylabel("adj-factor")
             plt.plot(range(len(data)), data[0], ".", alpha=0.3)
     else:
@@ -57,24 +57,23 @@ if __name__ == '__main__':
         sys.stderr.write("%s aleady exists.\n" % args.output)
     else:
         os.mkdir(args.output)
+    # one row per segment in /segment. Its models and its (sorted) logORs are the
+    #   rows model_offset... of /model and data_offset... of /data.
     f = h5py.File(args.file, 'r')
-    for each_group in f.keys():
-        data = None
+    segment_array = f['segment'][:]
+    model_array = f['model'][:]
+    data_array = f['data'][:]
+    for segment in segment_array:
+        model_start = segment['model_offset']
+        models = model_array[model_start:model_start + segment['no_of_models']]
         result = dict()
-        title = None
-        group = f[each_group]
-        for name, value in group.iteritems():
-            if name == 'model_list':
-                result["model"] = list(value)
-            if name == 'arg_list':
-                result["arg"] = list(value)
-            if name == 'logL_list':
-                result["logL"] = list(value)
-            if name == 'selection':
-                result['selection'] = list(value)
-            if name == 'data':
-                data = list(value)
-            if name == 'title':
-                title = list(value)[0]
+        result["model"] = list(zip(models['minor'], models['major']))
+        result["arg"] = list(zip(models['alpha'], models['mu'], models['variance'],
+            models['convergence']))
+        result["logL"] = list(models['logL'])
+        result['selection'] = [segment['selection_minor'], segment['selection_major']]
+        data_start = segment['data_offset']
+        data = data_array[data_start:data_start + segment['no_of_data']]
+        title = "chr%d_%d_%d" % (segment['chr'], segment['start'], segment['end'])
         outputfile = os.path.join(args.output, title + ".png")
-        result_plot(data,result,outputfile,title+"\n")
\ No newline at end of file
+        result_plot(data,result,outputfile,title+"\n")
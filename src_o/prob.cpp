@@ -5,6 +5,9 @@
 
  */
 #include "prob.h"
+#include <functional>
+#include <gsl/gsl_fft_real.h>
+#include <gsl/gsl_fft_halfcomplex.h>
 
 Prob::Prob()
 {
@@ -130,3 +133,84 @@ void Prob::calc_window_average(double *a, double *smoothed, int sample_size,
     }
     cerr << "Done.\n";
 }
+
+void Prob::calc_autocor_of_largest_terms(const vector<double> &pdf_vec, int max_shift,
+                                         int max_no_of_terms, double *cor_array)
+{
+    /*
+     * cor_array[shift] (shift=0..max_shift) = sum of the max_no_of_terms largest
+     *  pdf_vec[i]*pdf_vec[i+shift]. Same as sorting all products of a shift,
+     *  but only the largest ones are ordered (nth_element), in one reused buffer.
+     * If pdf_vec has at most max_no_of_terms non-zero entries, every shift sums
+     *  all its (non-zero) products, which is the plain autocorrelation => FFT.
+     */
+    long no_of_non_zeros = 0;
+    for (double pdf : pdf_vec) {
+        if (pdf != 0) no_of_non_zeros++;
+    }
+    if (no_of_non_zeros <= max_no_of_terms) {
+        calc_autocor_by_fft(pdf_vec, max_shift, cor_array);
+        return;
+    }
+    vector<double> term_vec;
+    term_vec.reserve(pdf_vec.size());
+    for (int shift = 0; shift <= max_shift; shift++) {
+        term_vec.clear();
+        for (long i = 0; i + shift < (long) pdf_vec.size(); i++) {
+            term_vec.push_back(pdf_vec[i] * pdf_vec[i + shift]);
+        }
+        if ((long) term_vec.size() > max_no_of_terms) {
+            nth_element(term_vec.begin(), term_vec.begin() + max_no_of_terms - 1,
+                        term_vec.end(), greater<double>());
+            term_vec.resize(max_no_of_terms);
+        }
+        // add up in descending order, as the full sort did.
+        sort(term_vec.begin(), term_vec.end(), greater<double>());
+        double sum_cor = 0;
+        for (double term : term_vec) {
+            sum_cor += term;
+        }
+        cor_array[shift] = sum_cor;
+    }
+}
+
+void Prob::calc_autocor_by_fft(const vector<double> &pdf_vec, int max_shift,
+                               double *cor_array)
+{
+    /*
+     * cor_array[shift] = sum_i pdf_vec[i]*pdf_vec[i+shift], shift=0..max_shift,
+     *  as the inverse FFT of the power spectrum. Zero-padded so that shifts
+     *  up to max_shift do not wrap around.
+     */
+    size_t fft_size = 1;
+    while (fft_size < pdf_vec.size() + max_shift + 1) {
+        fft_size *= 2;
+    }
+    vector<double> data(fft_size, 0.0);
+    copy(pdf_vec.begin(), pdf_vec.end(), data.begin());
+
+    gsl_fft_real_wavetable *real_wavetable = gsl_fft_real_wavetable_alloc(fft_size);
+    gsl_fft_halfcomplex_wavetable *halfcomplex_wavetable =
+        gsl_fft_halfcomplex_wavetable_alloc(fft_size);
+    gsl_fft_real_workspace *workspace = gsl_fft_real_workspace_alloc(fft_size);
+    gsl_fft_real_transform(data.data(), 1, fft_size, real_wavetable, workspace);
+    // half-complex layout: data[0]=Re(0), data[2k-1]=Re(k), data[2k]=Im(k),
+    //  data[n-1]=Re(n/2) as n is even.
+    data[0] = data[0] * data[0];
+    for (size_t k = 1; 2 * k < fft_size; k++) {
+        data[2 * k - 1] = data[2 * k - 1] * data[2 * k - 1] + data[2 * k] * data[2 * k];
+        data[2 * k] = 0;
+    }
+    data[fft_size - 1] = data[fft_size - 1] * data[fft_size - 1];
+    gsl_fft_halfcomplex_inverse(data.data(), 1, fft_size, halfcomplex_wavetable, workspace);
+    gsl_fft_real_wavetable_free(real_wavetable);
+    gsl_fft_halfcomplex_wavetable_free(halfcomplex_wavetable);
+    gsl_fft_real_workspace_free(workspace);
+
+    // round-off turns exact zeros into +-1e-16*cor_array[0]. Later steps take log10 of
+    //  positive correlations only, so put them back to zero.
+    double round_off = 1e-12 * data[0];
+    for (int shift = 0; shift <= max_shift; shift++) {
+        cor_array[shift] = data[shift] > round_off ? data[shift] : 0;
+    }
+}
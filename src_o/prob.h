@@ -11,6 +11,7 @@
 #include <algorithm>
 #include <cmath>
 #include <iostream>
+#include <vector>
 
 using namespace std;
 
@@ -35,6 +36,10 @@ class Prob
                           int right_moving_average_window);
     void calc_window_average(double *a, double *smoothed, int sample_size,
                              int width);
+    void calc_autocor_of_largest_terms(const vector<double> &pdf_vec, int max_shift,
+                                       int max_no_of_terms, double *cor_array);
+    void calc_autocor_by_fft(const vector<double> &pdf_vec, int max_shift,
+                             double *cor_array);
 
    private:
     int counter;
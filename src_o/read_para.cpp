@@ -4,6 +4,11 @@
 
  */
 #include "read_para.h"
+#include <atomic>
+#include <climits>
+#include <cstring>
+#include <thread>
+#include <zlib.h>
 
 using namespace std;
 
@@ -261,6 +266,195 @@ std::vector<std::string> string_split(std::string str,std::string sep){
 
 
 
+static size_t read_uint16_le(const unsigned char *b)
+{
+    return b[0] | (b[1] << 8);
+}
+
+static unsigned long read_uint32_le(const unsigned char *b)
+{
+    return (unsigned long) b[0] | ((unsigned long) b[1] << 8) | ((unsigned long) b[2] << 16) |
+           ((unsigned long) b[3] << 24);
+}
+
+/*
+ * the size of the BGZF block at offset (a gzip member whose extra field carries
+ *  the block size in a BC subfield) and the size of its header. 0 if it is not one.
+ */
+static size_t get_bgzf_block_size(const string &raw, size_t offset, size_t &header_size)
+{
+    const unsigned char *b = (const unsigned char *) raw.data() + offset;
+    size_t remaining = raw.size() - offset;
+    if (remaining < 18 || b[0] != 0x1f || b[1] != 0x8b || b[2] != 8 || b[3] != 4) {
+        return 0;
+    }
+    size_t extra_end = 12 + read_uint16_le(b + 10);
+    for (size_t i = 12; i + 4 <= extra_end && extra_end <= remaining;
+         i += 4 + read_uint16_le(b + i + 2)) {
+        if (b[i] == 'B' && b[i + 1] == 'C' && read_uint16_le(b + i + 2) == 2 && i + 6 <= extra_end) {
+            size_t block_size = read_uint16_le(b + i + 4) + 1;
+            if (block_size < extra_end + 8 || block_size > remaining) {
+                return 0;
+            }
+            header_size = extra_end;
+            return block_size;
+        }
+    }
+    return 0;
+}
+
+/*
+ * inflate a BGZF file into content. The ISIZE trailer of each block gives its offset in
+ *  content, so blocks are inflated independently, no_of_threads at a time.
+ * Return false (content untouched) if raw is not BGZF.
+ */
+static bool inflate_bgzf(const string &input_file_path, const string &raw, int no_of_threads,
+                         string &content)
+{
+    vector<size_t> block_offset_vector, header_size_vector, content_offset_vector;
+    size_t content_size = 0;
+    for (size_t offset = 0; offset < raw.size();) {
+        size_t header_size = 0;
+        size_t block_size = get_bgzf_block_size(raw, offset, header_size);
+        if (block_size == 0) {
+            return false;
+        }
+        block_offset_vector.push_back(offset);
+        header_size_vector.push_back(header_size);
+        content_offset_vector.push_back(content_size);
+        offset += block_size;
+        content_size += read_uint32_le((const unsigned char *) raw.data() + offset - 4);
+    }
+    block_offset_vector.push_back(raw.size());
+    content_offset_vector.push_back(content_size);
+    content.resize(content_size);
+
+    long no_of_blocks = (long) header_size_vector.size();
+    std::atomic<long> next_block_index(0);
+    std::atomic<bool> has_error(false);
+    auto inflate_blocks = [&]() {
+        for (long i = next_block_index++; i < no_of_blocks && !has_error; i = next_block_index++) {
+            const unsigned char *block = (const unsigned char *) raw.data() + block_offset_vector[i];
+            size_t block_size = block_offset_vector[i + 1] - block_offset_vector[i];
+            size_t block_content_size = content_offset_vector[i + 1] - content_offset_vector[i];
+            Bytef *block_content = (Bytef *) &content[0] + content_offset_vector[i];
+            z_stream stream;
+            memset(&stream, 0, sizeof(stream));
+            // raw deflate data between the header and the CRC32/ISIZE trailer
+            if (inflateInit2(&stream, -MAX_WBITS) != Z_OK) {
+                has_error = true;
+                break;
+            }
+            stream.next_in = (Bytef *) block + header_size_vector[i];
+            stream.avail_in = block_size - header_size_vector[i] - 8;
+            stream.next_out = block_content;
+            stream.avail_out = block_content_size;
+            int ret = inflate(&stream, Z_FINISH);
+            inflateEnd(&stream);
+            if (ret != Z_STREAM_END || stream.total_out != block_content_size ||
+                crc32(crc32(0L, Z_NULL, 0), block_content, block_content_size) !=
+                    read_uint32_le(block + block_size - 8)) {
+                has_error = true;
+            }
+        }
+    };
+    vector<std::thread> thread_vector;
+    for (long i = 1; i < std::min((long) no_of_threads, no_of_blocks); i++) {
+        thread_vector.push_back(std::thread(inflate_blocks));
+    }
+    inflate_blocks();
+    for (std::thread &one_thread : thread_vector) {
+        one_thread.join();
+    }
+    if (has_error) {
+        cerr << "ERROR: corrupt BGZF block in " << input_file_path << endl;
+        exit(3);
+    }
+    return true;
+}
+
+// inflate a gzip file, member after member, into content.
+static void inflate_gzip(const string &input_file_path, const string &raw, string &content)
+{
+    z_stream stream;
+    memset(&stream, 0, sizeof(stream));
+    if (inflateInit2(&stream, 16 + MAX_WBITS) != Z_OK) {
+        cerr << "ERROR: zlib inflateInit2() failed for " << input_file_path << endl;
+        exit(3);
+    }
+    // ISIZE of the last member is the exact size of a single-member file (mod 4GB).
+    size_t content_size = read_uint32_le((const unsigned char *) raw.data() + raw.size() - 4);
+    content.resize(std::max(content_size, raw.size()) + 1);
+    size_t in_offset = 0, out_offset = 0;
+    while (true) {
+        if (out_offset == content.size()) {
+            content.resize(content.size() * 2);
+        }
+        stream.next_in = (Bytef *) raw.data() + in_offset;
+        stream.avail_in = (uInt) std::min(raw.size() - in_offset, (size_t) UINT_MAX);
+        stream.next_out = (Bytef *) &content[0] + out_offset;
+        stream.avail_out = (uInt) std::min(content.size() - out_offset, (size_t) UINT_MAX);
+        uInt avail_in = stream.avail_in, avail_out = stream.avail_out;
+        int ret = inflate(&stream, Z_NO_FLUSH);
+        in_offset += avail_in - stream.avail_in;
+        out_offset += avail_out - stream.avail_out;
+        if (ret == Z_STREAM_END) {
+            if (in_offset + 1 < raw.size() && (unsigned char) raw[in_offset] == 0x1f &&
+                (unsigned char) raw[in_offset + 1] == 0x8b) {
+                // another gzip member
+                inflateReset(&stream);
+                continue;
+            }
+            break;
+        }
+        if ((ret != Z_OK && ret != Z_BUF_ERROR) ||
+            (ret == Z_BUF_ERROR && out_offset < content.size())) {
+            cerr << "ERROR: corrupt or truncated gzip file " << input_file_path << endl;
+            exit(3);
+        }
+    }
+    inflateEnd(&stream);
+    content.resize(out_offset);
+}
+
+string read_whole_file(const string &input_file_path, int no_of_threads)
+{
+    std::ifstream input_file(input_file_path.c_str(), std::ios::in | std::ios::binary);
+    if (!input_file.is_open()) {
+        cerr << "ERROR: cannot open " << input_file_path << endl;
+        exit(3);
+    }
+    input_file.seekg(0, std::ios::end);
+    string raw((size_t) input_file.tellg(), '\0');
+    input_file.seekg(0, std::ios::beg);
+    input_file.read(&raw[0], raw.size());
+    input_file.close();
+    if (raw.size() < 18 || (unsigned char) raw[0] != 0x1f || (unsigned char) raw[1] != 0x8b) {
+        return raw;
+    }
+    string content;
+    if (!inflate_bgzf(input_file_path, raw, no_of_threads, content)) {
+        inflate_gzip(input_file_path, raw, content);
+    }
+    return content;
+}
+
+int split_line(const char *line, const char *line_end, char sep,
+               vector<const char *> &field_vector)
+{
+    field_vector.clear();
+    const char *p = line;
+    while (p != NULL && p < line_end) {
+        if (*p == sep) {
+            p++;
+            continue;
+        }
+        field_vector.push_back(p);
+        p = (const char *) memchr(p, sep, line_end - p);
+    }
+    return field_vector.size();
+}
+
 // int main(int argc, char** argv) {
 //	string f_conf="configure";
 //	string hg;
@@ -165,4 +165,30 @@ void calculate_robust_mean_stddev(double *input_array, long start_index, long st
 void calculate_robust_mean_stddev(vector<float> float_vector, int percent_to_exclude,
                                   float &mean_ref, float &stddev_ref, double &squared_sum, int &sample_size);
 vector<std::string> string_split(std::string str,std::string sep);
+
+/*
+ * the whole content of a plain or gzipped (detected by the gzip magic bytes) file.
+ * BGZF files (i.e. by bgzip) are inflated block by block on no_of_threads threads.
+ *  Other gzip files, including multi-member ones, are inflated on one thread.
+ */
+string read_whole_file(const string &input_file_path, int no_of_threads = 1);
+/*
+ * start of each non-empty sep-separated field of [line, line_end), like string_split(),
+ *  but without copying. Fields end at sep, so strtol()/strtod() can parse them in place.
+ */
+int split_line(const char *line, const char *line_end, char sep,
+               vector<const char *> &field_vector);
+// strtod() of a field, with a fast path for the plain non-negative integers of read counts.
+inline double parse_count(const char *field)
+{
+    long value = 0;
+    const char *p = field;
+    for (; *p >= '0' && *p <= '9' && p - field < 15; p++) {
+        value = value * 10 + (*p - '0');
+    }
+    if (p > field && (*p == '\t' || *p == '\n' || *p == '\r' || *p == '\0')) {
+        return value;
+    }
+    return strtod(field, NULL);
+}
 #endif
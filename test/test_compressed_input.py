@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+ Check read_whole_file() (src_o/read_para.cpp) through the GADA binary: the same
+ ratio file as plain text, gzip, multi-member gzip and BGZF (parallel inflate) gives
+ the same segments, and a truncated or corrupt file stops GADA with exit code 3.
+ Build GADA first (make GADA in src_o). GADA_PATH overrides the GADA binary.
+
+    python -m pytest test/test_compressed_input.py
+"""
+import gzip
+import os
+import random
+import struct
+import subprocess
+import zlib
+
+import pytest
+
+src_o_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src_o")
+gada_path = os.environ.get("GADA_PATH", os.path.join(src_o_dir, "GADA"))
+pytestmark = pytest.mark.skipif(not os.path.isfile(gada_path), reason="GADA binary is not built.")
+
+# the empty block that ends a BGZF file.
+bgzf_eof_block = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def get_ratio_file_content(seed=1):
+    random_generator = random.Random(seed)
+    line_ls = ["start,coverage_ratio,coverage_tumor_adj,coverage_normal_adj\n"]
+    for i in range(6000):
+        ratio = 1.0 if (i // 1500) % 2 == 0 else 1.5
+        line_ls.append("%d,%.4f,1,1\n" % (i * 500 + 1, ratio + random_generator.gauss(0, 0.1)))
+    return "".join(line_ls).encode()
+
+
+def compress_bgzf(content, block_size=4096):
+    # one BGZF block per block_size bytes: a gzip member with the BC extra field (SAM spec).
+    block_ls = []
+    for offset in range(0, len(content), block_size):
+        data = content[offset:offset + block_size]
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        deflated = compressor.compress(data) + compressor.flush()
+        block_ls.append(b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00" +
+            struct.pack("<H", 25 + len(deflated)) + deflated +
+            struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data)))
+    return b"".join(block_ls) + bgzf_eof_block
+
+
+def compress_multi_member_gzip(content, no_of_members=3):
+    member_size = len(content) // no_of_members + 1
+    return b"".join(gzip.compress(content[offset:offset + member_size])
+        for offset in range(0, len(content), member_size))
+
+
+def run_gada(input_file_path, output_file_path, no_of_threads=4):
+    return subprocess.call([gada_path, "-i", input_file_path, "-o", output_file_path,
+        "-T", "30", "-a", "0.5", "-M", "50", "-t", str(no_of_threads), "--chromosome_id", "chr1"],
+        stdout=open(os.devnull, "w"), stderr=open(os.devnull, "w"))
+
+
+def read_segments(output_file_path):
+    return [line for line in open(output_file_path) if line[0] != '#']
+
+
+@pytest.mark.parametrize("compress", [gzip.compress, compress_multi_member_gzip, compress_bgzf])
+@pytest.mark.parametrize("no_of_threads", [1, 4])
+def test_compressed_input_gives_same_segments(tmpdir, compress, no_of_threads):
+    content = get_ratio_file_content()
+    plain_file_path = str(tmpdir.join("chr1.ratio.w500.csv"))
+    open(plain_file_path, "wb").write(content)
+    assert run_gada(plain_file_path, str(tmpdir.join("plain.seg.tsv")), no_of_threads) == 0
+    expected_segment_ls = read_segments(str(tmpdir.join("plain.seg.tsv")))
+    assert len(expected_segment_ls) == 4
+
+    input_file_path = str(tmpdir.join("chr1.ratio.w500.csv.gz"))
+    open(input_file_path, "wb").write(compress(content))
+    assert run_gada(input_file_path, str(tmpdir.join("chr1.seg.tsv")), no_of_threads) == 0
+    assert read_segments(str(tmpdir.join("chr1.seg.tsv"))) == expected_segment_ls
+
+
+def test_bgzf_is_recognized():
+    content = get_ratio_file_content()
+    assert gzip.decompress(compress_bgzf(content)) == content
+
+
+@pytest.mark.parametrize("compress", [gzip.compress, compress_multi_member_gzip, compress_bgzf])
+def test_truncated_input_exits_3(tmpdir, compress):
+    compressed = compress(get_ratio_file_content())
+    input_file_path = str(tmpdir.join("chr1.ratio.w500.csv.gz"))
+    open(input_file_path, "wb").write(compressed[:len(compressed) // 2])
+    assert run_gada(input_file_path, str(tmpdir.join("chr1.seg.tsv"))) == 3
+
+
+def test_corrupt_bgzf_block_exits_3(tmpdir):
+    compressed = bytearray(compress_bgzf(get_ratio_file_content()))
+    # flip one byte of the CRC32 of the first block.
+    block_size = struct.unpack("<H", bytes(compressed[16:18]))[0] + 1
+    compressed[block_size - 8] ^= 0xff
+    input_file_path = str(tmpdir.join("chr1.ratio.w500.csv.gz"))
+    open(input_file_path, "wb").write(bytes(compressed))
+    assert run_gada(input_file_path, str(tmpdir.join("chr1.seg.tsv"))) == 3
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+ Check that gada.segment() (the _gada extension) gives the same segments as the GADA
+ binary on a small synthetic chromosome, and that a GADA warm start (--init_breakpoints)
+ finds an event added after the previous run. Build both first (make GADA _gada in src_o).
+ GADA_PATH overrides the GADA binary.
+
+    python -m pytest test/test_gada.py
+"""
+import gzip
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+src_o_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src_o")
+sys.path.insert(0, src_o_dir)
+np = pytest.importorskip("numpy")
+pytest.importorskip("_gada")
+import gada
+
+gada_path = os.environ.get("GADA_PATH", os.path.join(src_o_dir, "GADA"))
+window_size = 500
+
+
+default_segment_ls = [(1.0, 1500), (1.5, 400), (1.0, 800), (0.5, 300), (2.0, 1000),
+    (1.0, 120), (0.5, 880)]
+
+
+def write_synthetic_chromosome(output_file_path, segment_ls=default_segment_ls, seed=1):
+    # piecewise-constant ratios plus Gaussian noise, same layout as chrN.ratio.wN.csv.gz.
+    random_generator = random.Random(seed)
+    position_ls = []
+    ratio_ls = []
+    for ratio, no_of_windows in segment_ls:
+        for i in range(no_of_windows):
+            position_ls.append(len(position_ls) * window_size + 1)
+            ratio_ls.append(round(ratio + random_generator.gauss(0, 0.1), 4))
+    with gzip.open(output_file_path, "wt") as output_file:
+        output_file.write("start,coverage_ratio,coverage_tumor_adj,coverage_normal_adj\n")
+        for position, ratio in zip(position_ls, ratio_ls):
+            output_file.write("%d,%.4f,1,1\n" % (position, ratio))
+    return np.array(position_ls), np.array(ratio_ls)
+
+
+def read_gada_output(output_file_path):
+    segment_ls = []
+    for line in open(output_file_path):
+        if line[0] == '#':
+            continue
+        row = line.split()
+        segment_ls.append((int(row[1]), int(row[2]), float(row[3]), float(row[4]), int(row[5])))
+    return segment_ls
+
+
+def run_gada(input_file_path, output_file_path, *extra_args):
+    subprocess.check_call([gada_path, "-i", input_file_path, "-o", output_file_path,
+        "-T", "30", "-a", "0.5", "-M", "50", "--chromosome_id", "chr1"] + list(extra_args),
+        stdout=open(os.devnull, "w"), stderr=open(os.devnull, "w"))
+    return read_gada_output(output_file_path)
+
+
+@pytest.mark.skipif(not os.path.isfile(gada_path), reason="GADA binary is not built.")
+def test_segment_matches_gada_binary(tmpdir):
+    input_file_path = str(tmpdir.join("chr1.ratio.w500.csv.gz"))
+    output_file_path = str(tmpdir.join("chr1.seg.tsv"))
+    positions, ratios = write_synthetic_chromosome(input_file_path)
+    expected_segment_ls = run_gada(input_file_path, output_file_path)
+    assert len(expected_segment_ls) > 1
+
+    result = gada.segment(ratios, positions=positions, window_size=window_size,
+        T=30, MinSegLen=50, a=0.5)
+    assert list(result["start"]) == [segment[0] for segment in expected_segment_ls]
+    assert list(result["stop"]) == [segment[1] for segment in expected_segment_ls]
+    assert list(result["no_of_windows"]) == [segment[4] for segment in expected_segment_ls]
+    # GADA prints 6 significant digits.
+    np.testing.assert_allclose(result["mean"], [segment[2] for segment in expected_segment_ls],
+        rtol=1e-5)
+    np.testing.assert_allclose(result["stddev"], [segment[3] for segment in expected_segment_ls],
+        rtol=1e-5)
+
+
+@pytest.mark.skipif(not os.path.isfile(gada_path), reason="GADA binary is not built.")
+def test_warm_start_finds_new_interior_event(tmpdir):
+    # a 100-window drop in the middle of a long segment of the previous run. No single
+    #  split of that segment stands out, so only the interval (two-breakpoint) test finds it.
+    init_file_path = str(tmpdir.join("chr1.init.ratio.w500.csv.gz"))
+    init_output_file_path = str(tmpdir.join("chr1.init.seg.tsv"))
+    write_synthetic_chromosome(init_file_path, [(1.0, 1000), (1.5, 4000), (1.0, 1000)])
+    init_segment_ls = run_gada(init_file_path, init_output_file_path)
+    assert [segment[4] for segment in init_segment_ls] == [1000, 4000, 1000]
+
+    input_file_path = str(tmpdir.join("chr1.ratio.w500.csv.gz"))
+    output_file_path = str(tmpdir.join("chr1.seg.tsv"))
+    write_synthetic_chromosome(input_file_path,
+        [(1.0, 1000), (1.5, 2000), (0.8, 100), (1.5, 1900), (1.0, 1000)])
+    segment_ls = run_gada(input_file_path, output_file_path,
+        "--init_breakpoints", init_output_file_path)
+    assert [segment[4] for segment in segment_ls] == [1000, 2000, 100, 1900, 1000]
+    assert segment_ls == run_gada(input_file_path, str(tmpdir.join("chr1.cold.seg.tsv")))
+
+
+def test_segment_returns_writable_arrays():
+    ratios = np.concatenate([np.full(500, 1.0), np.full(500, 2.0)]) + \
+        np.random.RandomState(1).normal(0, 0.05, 1000)
+    result = gada.segment(ratios, T=30, MinSegLen=50)
+    for key in ["start_index", "stop_index", "mean", "stddev", "no_of_windows"]:
+        assert result[key].flags.writeable
+    result["mean"] -= 1.0